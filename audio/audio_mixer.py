@@ -0,0 +1,110 @@
+"""
+In-memory audio assembly.
+Each source is decoded once to PCM; placement, looping, trimming and volume
+are done with NumPy, and the mix is handed to the encoder as raw samples.
+"""
+
+import subprocess
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+
+def decode_audio(path: str, sample_rate: int = SAMPLE_RATE,
+                 channels: int = CHANNELS) -> np.ndarray:
+    """
+    Decode an audio file to float PCM.
+
+    Args:
+        path: Audio (or video) file path
+        sample_rate: Output sample rate
+        channels: Output channel count
+
+    Returns:
+        float32 array of shape (samples, channels) in [-1, 1]
+    """
+    from moviepy.config import get_setting
+    from jobs import tracing
+    from render.media_readers import get_reader_manager
+
+    cmd = [
+        get_setting('FFMPEG_BINARY'), '-loglevel', 'error',
+        '-i', path, '-vn',
+        '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(sample_rate), '-ac', str(channels), '-'
+    ]
+    with get_reader_manager().slot():
+        with tracing.span('ffmpeg decode audio', cat='subprocess', path=path):
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise IOError(
+            "ffmpeg failed to decode %s:\n%s" % (path, proc.stderr.decode(errors='replace'))
+        )
+    pcm = np.frombuffer(proc.stdout, dtype=np.int16).reshape(-1, channels)
+    return pcm.astype(np.float32) / 32768.0
+
+
+class AudioMixer:
+    """Mixes PCM tracks into one buffer covering the whole video."""
+
+    def __init__(self, duration: float, sample_rate: int = SAMPLE_RATE,
+                 channels: int = CHANNELS):
+        """
+        Initialize an empty (silent) mix.
+
+        Args:
+            duration: Length of the mix in seconds
+            sample_rate: Sample rate of the mix
+            channels: Channel count of the mix
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.buffer = np.zeros((int(round(duration * sample_rate)), channels), np.float32)
+
+    @property
+    def duration(self) -> float:
+        return len(self.buffer) / self.sample_rate
+
+    def add(self, pcm: np.ndarray, start: float = 0.0,
+            duration: Optional[float] = None, volume: float = 1.0,
+            loop: bool = False):
+        """
+        Mix a track into the buffer.
+
+        Args:
+            pcm: float PCM (samples, channels) at the mix sample rate
+            start: Where the track starts, in seconds
+            duration: How long it plays (defaults to its own length)
+            volume: Gain applied to the track
+            loop: Repeat the track to fill `duration`
+        """
+        offset = int(round(start * self.sample_rate))
+        if duration is None:
+            length = len(pcm)
+        else:
+            length = int(round(duration * self.sample_rate))
+        length = min(length, len(self.buffer) - offset)
+        if length <= 0 or len(pcm) == 0:
+            return
+
+        if loop and len(pcm) < length:
+            repeats = -(-length // len(pcm))
+            pcm = np.tile(pcm, (repeats, 1))
+        pcm = pcm[:length]
+
+        target = self.buffer[offset:offset + len(pcm)]
+        if volume == 1.0:
+            target += pcm
+        else:
+            target += pcm * np.float32(volume)
+
+    def add_file(self, path: str, **kwargs):
+        """Decode a file once and mix it in (see add)."""
+        self.add(decode_audio(path, self.sample_rate, self.channels), **kwargs)
+
+    def render(self) -> np.ndarray:
+        """The mix as int16 PCM, clipped to full scale."""
+        return (np.clip(self.buffer, -1.0, 1.0) * 32767).astype(np.int16)
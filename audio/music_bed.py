@@ -0,0 +1,164 @@
+"""
+Background music beds.
+Each music track is decoded once per process, loudness-normalized and
+prepared as a seamless loop (the tail crossfades into the head). Any
+duration is then served from memory by tiling the loop, with no decode
+per job.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from audio.audio_mixer import CHANNELS, SAMPLE_RATE, decode_audio
+
+# Target RMS level of a normalized bed, in dBFS
+TARGET_LEVEL = -20.0
+# Length of the crossfade at each loop seam, in seconds
+SEAM_DURATION = 1.0
+
+
+class MusicLoop:
+    """A normalized track split into a head and a repeatable loop body."""
+
+    def __init__(self, pcm: np.ndarray, sample_rate: int,
+                 target_level: float = TARGET_LEVEL,
+                 seam_duration: float = SEAM_DURATION):
+        """
+        Prepare a loop from decoded PCM.
+
+        Args:
+            pcm: float PCM (samples, channels)
+            sample_rate: Sample rate of `pcm`
+            target_level: RMS level to normalize to, in dBFS
+            seam_duration: Crossfade length at each seam, in seconds
+        """
+        self.sample_rate = sample_rate
+        pcm = self._normalize(pcm, target_level)
+
+        # Never let the seam take more than a quarter of the track
+        seam = min(int(seam_duration * sample_rate), len(pcm) // 4)
+        if seam == 0:
+            self.head = pcm
+            self.body = pcm
+            return
+
+        # Equal-power crossfade from the tail into the head
+        ramp = np.linspace(0.0, np.pi / 2, seam, dtype=np.float32)[:, None]
+        blend = pcm[-seam:] * np.cos(ramp) + pcm[:seam] * np.sin(ramp)
+
+        # First pass plays the untouched start; every repeat enters
+        # through the crossfaded seam
+        self.head = pcm[:-seam]
+        self.body = np.concatenate([blend, pcm[seam:-seam]])
+
+    @staticmethod
+    def _normalize(pcm: np.ndarray, target_level: float) -> np.ndarray:
+        """Scale to the target RMS level without letting peaks clip."""
+        rms = float(np.sqrt(np.mean(np.square(pcm, dtype=np.float64)))) if len(pcm) else 0.0
+        if rms == 0.0:
+            return pcm.astype(np.float32)
+        gain = 10 ** (target_level / 20.0) / rms
+        peak = float(np.max(np.abs(pcm)))
+        if peak * gain > 1.0:
+            gain = 1.0 / peak
+        return (pcm * np.float32(gain)).astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.head.nbytes + self.body.nbytes
+
+    def render(self, duration: float) -> np.ndarray:
+        """PCM of the looped bed for `duration` seconds."""
+        length = int(round(duration * self.sample_rate))
+        if length <= len(self.head):
+            return self.head[:length]
+        repeats = -(-(length - len(self.head)) // len(self.body))
+        pcm = np.concatenate([self.head] + [self.body] * repeats)
+        return pcm[:length]
+
+
+class MusicBedService:
+    """In-memory cache of prepared music loops."""
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+                 max_entries: int = 4):
+        """
+        Initialize the service.
+
+        Args:
+            sample_rate: Sample rate beds are served at
+            channels: Channel count beds are served with
+            max_entries: Tracks kept in memory (least recently used evicted)
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_entries = max_entries
+        self._loops = OrderedDict()
+        self._lock = threading.Lock()
+
+    def loop(self, path: str, fingerprint: str = None, sample_rate: int = None,
+             channels: int = None) -> MusicLoop:
+        """
+        Prepared loop for a music file, decoding it on first use.
+
+        Args:
+            path: Music file path
+            fingerprint: Content hash of the file (cache key)
+            sample_rate: Sample rate (defaults to the service's)
+            channels: Channel count (defaults to the service's)
+        """
+        if fingerprint is None:
+            from render.timeline import file_fingerprint
+            fingerprint = file_fingerprint(path)
+        sample_rate = sample_rate or self.sample_rate
+        channels = channels or self.channels
+        key = (fingerprint, sample_rate, channels)
+
+        with self._lock:
+            loop = self._loops.get(key)
+            if loop is not None:
+                self._loops.move_to_end(key)
+                return loop
+
+        # Decode outside the lock; a concurrent first use just decodes twice
+        pcm = decode_audio(path, sample_rate, channels)
+        loop = MusicLoop(pcm, sample_rate)
+        print(f"  Cached music bed {os.path.basename(path)} "
+              f"({len(pcm) / sample_rate:.1f}s, {loop.nbytes / 1e6:.1f} MB)")
+
+        with self._lock:
+            self._loops[key] = loop
+            self._loops.move_to_end(key)
+            while len(self._loops) > self.max_entries:
+                self._loops.popitem(last=False)
+        return loop
+
+    def bed(self, path: str, duration: float, fingerprint: str = None,
+            sample_rate: int = None, channels: int = None) -> np.ndarray:
+        """
+        Float PCM (samples, channels) of a music bed looped to `duration`.
+
+        Args:
+            path: Music file path
+            duration: Length of the bed in seconds
+            fingerprint: Content hash of the file (cache key)
+            sample_rate: Sample rate (defaults to the service's)
+            channels: Channel count (defaults to the service's)
+        """
+        return self.loop(path, fingerprint, sample_rate, channels).render(duration)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_music_beds() -> MusicBedService:
+    """Process-wide music bed service."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = MusicBedService()
+        return _service
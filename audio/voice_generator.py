@@ -4,8 +4,9 @@ Provides a clean interface for TTS providers that can be easily swapped.
 """
 
 from abc import ABC, abstractmethod
-from gtts import gTTS
+import hashlib
 import os
+import tempfile
 from typing import Tuple
 
 
@@ -45,15 +46,16 @@ class GTTSProvider(VoiceProvider):
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
+        # Imported on first use to keep worker startup light
+        from gtts import gTTS
+        
         # Generate speech
         tts = gTTS(text=text, lang=language, slow=self.slow)
         tts.save(output_path)
         
-        # Get duration using moviepy
-        from moviepy.editor import AudioFileClip
-        audio = AudioFileClip(output_path)
-        duration = audio.duration
-        audio.close()
+        # Get duration from a (cached) probe instead of opening a reader
+        from render.media_readers import get_reader_manager
+        duration = get_reader_manager().duration(output_path)
         
         return output_path, duration
 
@@ -83,6 +85,66 @@ class VoiceGenerator:
             Tuple of (audio_file_path, duration_in_seconds)
         """
         return self.provider.generate(text, language, output_path)
+    
+    def static_voiceover(self, text: str, language: str, cache_dir: str) -> Tuple[str, float]:
+        """
+        Voiceover for a script that does not change between videos.
+        
+        Generated once into `cache_dir`, keyed by language and text, and
+        reused afterwards.
+        
+        Args:
+            text: Script text to convert to speech
+            language: Language code
+            cache_dir: Directory holding static voiceovers
+            
+        Returns:
+            Tuple of (audio_file_path, duration_in_seconds)
+        """
+        # Baked into the image at build time when possible
+        from render.bake import get_bake
+        baked = get_bake()
+        found = baked.voiceover(language, text) if baked is not None else None
+        if found is not None:
+            return found
+        return self.cached_voiceover(text, language, cache_dir)
+    
+    def cached_voiceover(self, text: str, language: str, cache_dir: str) -> Tuple[str, float]:
+        """
+        Voiceover stored in `cache_dir` under its language and text.
+        
+        Generated on first use; later videos with the same script (e.g. a
+        re-render after swapping a wallpaper) reuse the file.
+        
+        Args:
+            text: Script text to convert to speech
+            language: Language code
+            cache_dir: Directory holding cached voiceovers
+            
+        Returns:
+            Tuple of (audio_file_path, duration_in_seconds)
+        """
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        output_path = os.path.join(cache_dir, f'{language}_{digest}.mp3')
+        if os.path.exists(output_path):
+            from jobs.storage import touch
+            from render.media_readers import get_reader_manager
+            touch(output_path)
+            return output_path, get_reader_manager().duration(output_path)
+        
+        # Generate next to the final path so readers never see a partial
+        # file; a unique name keeps concurrent renders of the same script apart
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{language}_{digest}.', suffix='.tmp.mp3',
+                                        dir=cache_dir)
+        os.close(fd)
+        try:
+            path, duration = self.generate_voiceover(text, language, tmp_path)
+            os.replace(path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return output_path, duration
 
 
 # Example usage for future providers:
@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration.
+The app is preloaded in the master and the shared video assets are warmed
+up there once, so every forked worker starts with them already in memory
+(shared copy-on-write) instead of loading them on its first request.
+Each worker then starts render threads that pull videos from the shared
+job queue (RENDER_WORKER_THREADS, 0 for a web-only instance) and the
+background sweep that keeps outputs, uploads and caches within quota.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+timeout = 300
+preload_app = True
+
+
+def on_starting(server):
+    """Warm up shared assets in the master before any worker forks."""
+    if os.environ.get('SKIP_WARM_UP'):
+        return
+    from templates.base_template import warm_up
+    warm_up()
+
+
+def post_fork(server, worker):
+    """Start render threads in each worker (threads don't survive fork)."""
+    from jobs.storage import get_storage_manager
+    from jobs.worker import start_worker_threads
+    start_worker_threads()
+    get_storage_manager().start()
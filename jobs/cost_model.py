@@ -0,0 +1,253 @@
+"""
+Render cost model and admission control.
+Estimates how many worker-seconds a video will take from its wallpapers
+(count, images vs. videos), the expected scene durations and the encoding
+profile, calibrated against the timings of finished jobs.
+Admission compares that with the work already queued per live worker:
+requests that could not start in time are refused up front with a
+Retry-After instead of timing out mid-render, and admitted ones get an ETA.
+"""
+
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from jobs.job_queue import QUEUED, RUNNING, JobQueue, get_job_queue
+
+# Seconds of queued work per worker beyond which requests are refused
+MAX_WAIT_SECONDS = float(os.environ.get('MAX_QUEUE_WAIT', 600))
+# Largest single video accepted, in estimated worker-seconds
+MAX_JOB_SECONDS = float(os.environ.get('MAX_JOB_SECONDS', 900))
+
+# Scene timing used by the template (see base_template / scene plans)
+SECONDS_PER_WALLPAPER = 4
+# Speech rate of the TTS voice, used to guess voiceover lengths
+CHARS_PER_SECOND = {'en': 14.0, 'hi': 11.0}
+
+# x264 preset cost relative to 'medium'
+PRESET_FACTORS = {
+    'ultrafast': 0.35, 'superfast': 0.45, 'veryfast': 0.55, 'faster': 0.7,
+    'fast': 0.85, 'medium': 1.0, 'slow': 1.5, 'slower': 2.2, 'veryslow': 4.0,
+}
+
+# Feature order of the linear model
+FEATURES = ('fixed', 'animated_mpx_frames', 'static_frames', 'video_seconds')
+# Seconds per unit of each feature before any calibration
+DEFAULT_COEFFICIENTS = (10.0, 0.03, 0.004, 0.1)
+
+# Calibration needs this many timings; a full refit needs more
+MIN_SAMPLES = 3
+FIT_SAMPLES = 20
+CALIBRATION_TTL = 60.0
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """Output format the cost depends on."""
+
+    size: tuple = (1080, 1920)
+    fps: int = 30
+    preset: str = 'medium'
+
+    @property
+    def megapixels(self) -> float:
+        return self.size[0] * self.size[1] / 1e6
+
+
+def _speech_seconds(text: str, language: str) -> float:
+    return len(text) / CHARS_PER_SECOND.get(language, CHARS_PER_SECOND['en'])
+
+
+def video_features(params: Dict, profile: EncodingProfile = EncodingProfile()) -> Dict[str, float]:
+    """
+    Cost features of a generate_video job.
+
+    Args:
+        params: Job parameters (wallpapers, god_name, custom_text,
+            language_code, formats)
+        profile: Encoding profile of the output (its size is replaced by
+            the requested formats, which are all composed and encoded)
+
+    Returns:
+        Feature name -> value (see FEATURES)
+
+    Only the file names are looked at, so admission never waits on ffprobe
+    in the request thread: a video wallpaper is costed as filling its whole
+    slot (the render loops shorter videos, so decoding is bounded by the
+    slot either way).
+    """
+    from scripts.script_generator import ScriptGenerator
+    from render.formats import get_formats
+    from render.timeline import is_video_file
+
+    wallpapers = params.get('wallpapers') or [params.get('wallpaper')]
+    language = params.get('language_code', 'en')
+    scripts = ScriptGenerator.generate_all_scripts(
+        params.get('god_name', ''), params.get('custom_text', ''), language
+    )
+
+    # Scene 1 is animated for its whole length, scene 2 is a static frame
+    scene1 = max(_speech_seconds(scripts['scene1'], language),
+                 len(wallpapers) * SECONDS_PER_WALLPAPER)
+    scene2 = _speech_seconds(scripts['scene2'], language)
+
+    slot = scene1 / len(wallpapers)
+    video_seconds = slot * sum(1 for path in wallpapers if is_video_file(path))
+
+    megapixels = profile.megapixels
+    if params.get('formats'):
+        megapixels = sum(output_format.megapixels
+                         for output_format in get_formats(params['formats']))
+
+    preset = PRESET_FACTORS.get(profile.preset, 1.0)
+    return {
+        'fixed': 1.0,
+        'animated_mpx_frames': scene1 * profile.fps * megapixels * preset,
+        'static_frames': scene2 * profile.fps * preset,
+        'video_seconds': video_seconds,
+    }
+
+
+class CostModel:
+    """Linear cost model, refit from recent job timings."""
+
+    def __init__(self, queue: JobQueue, kind: str = 'generate_video'):
+        self.queue = queue
+        self.kind = kind
+        self.coefficients = np.array(DEFAULT_COEFFICIENTS)
+        self._calibrated_at = 0.0
+        self._lock = threading.Lock()
+
+    def _vector(self, features: Dict[str, float]) -> np.ndarray:
+        return np.array([features.get(name, 0.0) for name in FEATURES])
+
+    def calibrate(self, force: bool = False):
+        """
+        Fit the coefficients to finished jobs (at most once per TTL).
+
+        With few samples the default coefficients are only rescaled by the
+        median ratio of actual to predicted time; with enough samples the
+        model is refit by least squares (kept only if every coefficient
+        stays positive).
+        """
+        with self._lock:
+            if not force and time.time() - self._calibrated_at < CALIBRATION_TTL:
+                return
+            self._calibrated_at = time.time()
+
+        timings = self.queue.recent_timings(self.kind)
+        if len(timings) < MIN_SAMPLES:
+            return
+        X = np.array([self._vector(features) for features, _ in timings])
+        y = np.array([seconds for _, seconds in timings])
+
+        defaults = np.array(DEFAULT_COEFFICIENTS)
+        coefficients = defaults * float(np.median(y / np.maximum(X @ defaults, 1e-6)))
+        if len(timings) >= FIT_SAMPLES:
+            fitted, *_ = np.linalg.lstsq(X, y, rcond=None)
+            if np.all(fitted > 0):
+                coefficients = fitted
+        with self._lock:
+            self.coefficients = coefficients
+
+    def estimate(self, features: Dict[str, float]) -> float:
+        """Estimated worker-seconds for a job with these features."""
+        self.calibrate()
+        with self._lock:
+            coefficients = self.coefficients
+        return float(self._vector(features) @ coefficients)
+
+
+@dataclass
+class Admission:
+    """Outcome of an admission check."""
+
+    admitted: bool
+    cost: float
+    eta: float
+    retry_after: int = 0
+    reason: str = ''
+
+
+class AdmissionController:
+    """Admits jobs while the queued work per live worker stays bounded."""
+
+    def __init__(self, queue: JobQueue, model: CostModel = None,
+                 max_wait: float = MAX_WAIT_SECONDS, max_job: float = MAX_JOB_SECONDS):
+        """
+        Args:
+            queue: Shared job queue
+            model: Cost model (one for generate_video by default)
+            max_wait: Longest acceptable wait before a job starts, in seconds
+            max_job: Largest acceptable single job, in worker-seconds
+        """
+        self.queue = queue
+        self.model = model or CostModel(queue)
+        self.max_wait = max_wait
+        self.max_job = max_job
+
+    def workers(self) -> int:
+        # Assume one worker is on its way if none has checked in yet
+        return max(1, self.queue.active_workers())
+
+    def backlog(self) -> float:
+        """Worker-seconds of work queued or still running."""
+        queued, running = self._pending()
+        return sum(queued) + sum(running)
+
+    def _pending(self):
+        # Estimated cost of each queued job and remaining cost of running ones
+        now = time.time()
+        queued, running = [], []
+        for status, cost, started_at in self.queue.pending_costs():
+            if status == RUNNING:
+                running.append(max((cost or 0.0) - (now - (started_at or now)), 0.0))
+            else:
+                queued.append(cost or 0.0)
+        return queued, running
+
+    def check(self, features: Dict[str, float]) -> Admission:
+        """Decide whether a job with these features can be queued."""
+        cost = self.model.estimate(features)
+        if cost > self.max_job:
+            return Admission(False, cost, 0.0, reason=(
+                f'This video is too large to render (about {cost / 60:.0f} minutes of work). '
+                'Try fewer or shorter wallpapers.'
+            ))
+
+        workers = self.workers()
+        wait = self.backlog() / workers
+        if wait > self.max_wait:
+            retry_after = int(math.ceil(wait - self.max_wait))
+            return Admission(False, cost, wait + cost, retry_after=max(retry_after, 1), reason=(
+                'All render workers are busy. Please try again later.'
+            ))
+        return Admission(True, cost, wait + cost)
+
+    def eta(self, job) -> float:
+        """Seconds until a queued or running job should finish."""
+        if job.status == RUNNING:
+            return max((job.cost or 0.0) - (time.time() - job.started_at), 0.0)
+        if job.status != QUEUED:
+            return 0.0
+        _, running = self._pending()
+        ahead = self.queue.cost_ahead(job)
+        return (ahead + sum(running)) / self.workers() + (job.cost or 0.0)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Admission controller over the process-wide job queue."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(get_job_queue())
+        return _controller
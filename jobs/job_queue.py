@@ -0,0 +1,454 @@
+"""
+Durable job queue.
+Jobs live in a SQLite database, so any number of render processes (gunicorn
+workers, standalone workers) can pull from one queue with no external
+broker. A worker claims a job with a
+time-limited lease and renews it with heartbeats. If it dies, the lease
+expires and the job is handed to another worker, up to its attempt limit.
+Higher priorities are claimed first, then the oldest job.
+
+Jobs may carry an estimated cost (worker-seconds) and the features it was
+estimated from; finished jobs record their actual run time against those
+features, and workers check in periodically, which is what admission
+control (jobs/cost_model.py) sizes the backlog with.
+
+The database uses WAL journaling, whose shared-memory index only works
+between processes on one host. Processes on several nodes sharing the
+database file must set JOB_DB_JOURNAL=delete (rollback journal, slower
+under write contention), and the shared volume must support POSIX file
+locks (many network filesystems do not).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DB_PATH = os.environ.get(
+    'JOB_DB',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output', 'jobs.sqlite3')
+)
+
+# 'wal' for processes on one host, 'delete' when nodes share the file
+JOURNAL_MODE = os.environ.get('JOB_DB_JOURNAL', 'wal').lower()
+
+# Seconds a claim stays valid without a heartbeat
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+# Delay before a failed job is retried, multiplied by the attempt count
+RETRY_DELAY = 5.0
+# A worker that has not checked in for this long is considered gone
+WORKER_TIMEOUT = 2 * LEASE_SECONDS
+# Run times kept per job kind for calibrating the cost model
+MAX_TIMINGS = 500
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    cost REAL,
+    features TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    features TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, for databases created before them
+_ADDED_COLUMNS = {
+    'cost': 'REAL',
+    'features': 'TEXT',
+}
+
+
+@dataclass
+class Job:
+    """A job row."""
+
+    id: str
+    kind: str
+    params: Dict
+    priority: int
+    status: str
+    attempts: int
+    max_attempts: int
+    available_at: float
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[float] = None
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    cost: Optional[float] = None
+    features: Optional[Dict] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'Job':
+        data = dict(row)
+        data['params'] = json.loads(data['params'])
+        data['result'] = json.loads(data['result']) if data['result'] else None
+        data['features'] = json.loads(data['features']) if data['features'] else None
+        return cls(**data)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+
+class JobQueue:
+    """SQLite-backed job queue shared by every process that opens it."""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, journal_mode: str = JOURNAL_MODE):
+        """
+        Open (and create if needed) the queue database.
+
+        Args:
+            db_path: SQLite file, on a volume shared by all workers
+            journal_mode: 'wal' (single host) or 'delete' (several nodes)
+        """
+        if journal_mode not in ('wal', 'delete'):
+            raise ValueError(f"Unsupported journal mode: {journal_mode}")
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(f'PRAGMA journal_mode={journal_mode.upper()}')
+            conn.executescript(_SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for name, column_type in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {name} {column_type}')
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction holding the database lock from the start."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def enqueue(self, kind: str, params: Dict, priority: int = 0,
+                max_attempts: int = MAX_ATTEMPTS, job_id: str = None,
+                cost: float = None, features: Dict = None) -> str:
+        """
+        Add a job.
+
+        Args:
+            kind: Handler name (e.g. 'generate_video')
+            params: JSON-serializable job parameters
+            priority: Higher runs first
+            max_attempts: Claims allowed before the job is marked failed
+            job_id: Id to use (a random one by default)
+            cost: Estimated worker-seconds (see jobs/cost_model.py)
+            features: Cost features, recorded with the run time when done
+
+        Returns:
+            The job id
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, params, priority, status, max_attempts, '
+                'available_at, created_at, cost, features) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), priority, QUEUED, max_attempts, now, now,
+                 cost, json.dumps(features) if features is not None else None)
+            )
+        return job_id
+
+    def claim(self, worker_id: str, kinds: List[str] = None,
+              lease: float = LEASE_SECONDS) -> Optional[Job]:
+        """
+        Lease the next runnable job.
+
+        Queued jobs and running jobs whose lease expired (their worker
+        died) are both claimable; the latter fail once out of attempts.
+
+        Args:
+            worker_id: Unique id of the claiming worker
+            kinds: Only claim jobs of these kinds (all by default)
+            lease: Seconds the claim lasts without a heartbeat
+
+        Returns:
+            The claimed job, or None if nothing is runnable
+        """
+        kind_filter = ''
+        kind_args = []
+        if kinds:
+            kind_filter = ' AND kind IN (%s)' % ','.join('?' * len(kinds))
+            kind_args = list(kinds)
+
+        with self._transaction() as conn:
+            while True:
+                now = time.time()
+                row = conn.execute(
+                    'SELECT * FROM jobs WHERE ((status = ? AND available_at <= ?) '
+                    'OR (status = ? AND lease_expires < ?))' + kind_filter +
+                    ' ORDER BY priority DESC, created_at LIMIT 1',
+                    [QUEUED, now, RUNNING, now] + kind_args
+                ).fetchone()
+                if row is None:
+                    return None
+
+                if row['attempts'] >= row['max_attempts']:
+                    # Its last worker died mid-job
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, finished_at = ?, lease_owner = NULL, '
+                        'error = ? WHERE id = ?',
+                        (FAILED, now, row['error'] or 'Worker lost', row['id'])
+                    )
+                    continue
+
+                conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, '
+                    'lease_owner = ?, lease_expires = ? WHERE id = ?',
+                    (RUNNING, now, worker_id, now + lease, row['id'])
+                )
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+                return Job.from_row(row)
+
+    def heartbeat(self, job_id: str, worker_id: str, lease: float = LEASE_SECONDS) -> bool:
+        """
+        Extend a lease.
+
+        Returns:
+            False if the worker no longer holds the job
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = ? AND lease_owner = ?',
+                (time.time() + lease, job_id, RUNNING, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict = None) -> bool:
+        """
+        Mark a job done, recording its run time if it has cost features.
+
+        Returns:
+            False if the worker had lost the job (the result is dropped)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, lease_owner = NULL, '
+                'lease_expires = NULL, result = ?, error = NULL '
+                'WHERE id = ? AND status = ? AND lease_owner = ?',
+                (DONE, now, json.dumps(result or {}), job_id, RUNNING, worker_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            row = conn.execute(
+                'SELECT kind, features, started_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row['features']:
+                self._record_timing(conn, row['kind'], row['features'], now - row['started_at'], now)
+            return True
+
+    def _record_timing(self, conn, kind: str, features: str, seconds: float, now: float):
+        conn.execute(
+            'INSERT INTO timings (kind, features, seconds, finished_at) VALUES (?, ?, ?, ?)',
+            (kind, features, seconds, now)
+        )
+        conn.execute(
+            'DELETE FROM timings WHERE kind = ? AND id NOT IN '
+            '(SELECT id FROM timings WHERE kind = ? ORDER BY id DESC LIMIT ?)',
+            (kind, kind, MAX_TIMINGS)
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True) -> bool:
+        """
+        Record a failed attempt; requeue it with a delay if attempts remain.
+
+        Returns:
+            False if the worker had lost the job
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = ? '
+                'AND lease_owner = ?',
+                (job_id, RUNNING, worker_id)
+            ).fetchone()
+            if row is None:
+                return False
+            if retry and row['attempts'] < row['max_attempts']:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, available_at = ?, lease_owner = NULL, '
+                    'lease_expires = NULL, error = ? WHERE id = ?',
+                    (QUEUED, now + RETRY_DELAY * row['attempts'], error, job_id)
+                )
+            else:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, finished_at = ?, lease_owner = NULL, '
+                    'lease_expires = NULL, error = ? WHERE id = ?',
+                    (FAILED, now, error, job_id)
+                )
+            return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return Job.from_row(row) if row else None
+
+    def position(self, job: Job) -> int:
+        """Number of queued jobs that will be claimed before `job`."""
+        if job.status != QUEUED:
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ? AND kind = ? AND '
+                '(priority > ? OR (priority = ? AND created_at < ?))',
+                (QUEUED, job.kind, job.priority, job.priority, job.created_at)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def active_jobs(self) -> List[Job]:
+        """Queued and running jobs."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT * FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [Job.from_row(row) for row in rows]
+
+    def cost_ahead(self, job: Job) -> float:
+        """Estimated worker-seconds of queued jobs claimed before `job`."""
+        if job.status != QUEUED:
+            return 0.0
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT COALESCE(SUM(cost), 0) FROM jobs WHERE status = ? AND kind = ? AND '
+                '(priority > ? OR (priority = ? AND created_at < ?))',
+                (QUEUED, job.kind, job.priority, job.priority, job.created_at)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def pending_costs(self) -> List[Tuple[str, Optional[float], Optional[float]]]:
+        """(status, cost, started_at) of every queued or running job."""
+        conn = self._connect()
+        try:
+            return [tuple(row) for row in conn.execute(
+                'SELECT status, cost, started_at FROM jobs WHERE status IN (?, ?)',
+                (QUEUED, RUNNING)
+            )]
+        finally:
+            conn.close()
+
+    # Workers and timings
+
+    def touch_worker(self, worker_id: str):
+        """Record that a worker is alive (called from its poll loop)."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO workers (id, last_seen) VALUES (?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET last_seen = excluded.last_seen',
+                (worker_id, now)
+            )
+            conn.execute('DELETE FROM workers WHERE last_seen < ?', (now - 10 * WORKER_TIMEOUT,))
+
+    def remove_worker(self, worker_id: str):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+
+    def active_workers(self, timeout: float = WORKER_TIMEOUT) -> int:
+        """Number of workers that checked in within `timeout` seconds."""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT COUNT(*) FROM workers WHERE last_seen >= ?', (time.time() - timeout,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def recent_timings(self, kind: str, limit: int = MAX_TIMINGS) -> List[Tuple[Dict, float]]:
+        """(features, seconds) of the latest finished jobs of a kind."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT features, seconds FROM timings WHERE kind = ? ORDER BY id DESC LIMIT ?',
+                (kind, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(json.loads(row['features']), row['seconds']) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        finally:
+            conn.close()
+        return {status: count for status, count in rows}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Queue at JOB_DB (output/jobs.sqlite3 by default) for this process."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,251 @@
+"""
+Per-job memory accounting and budgets.
+A render samples the process RSS on a background thread for as long as it
+runs and records its peak, overall and per generation step. With
+JOB_TRACEMALLOC=1 it also traces Python and NumPy allocations and keeps
+the top allocation sites of a snapshot taken at the soft limit and at the
+end. The job is charged for what the process grew by since it started.
+
+Two limits apply to that growth:
+
+- soft (JOB_MEMORY_SOFT_MB, 75% of the budget by default): the job
+  switches to a low-memory mode (formats are encoded one after the other
+  instead of in lockstep, cached wallpaper pyramids are dropped);
+- budget (JOB_MEMORY_BUDGET_MB, off by default): the render stops at the
+  next frame with MemoryBudgetExceeded, before the container's OOM killer
+  takes the whole process down with every other job in it.
+
+RSS is per process: with several render threads in one process, the
+growth of concurrent jobs is counted by each of them, so budgets should
+leave room for that (threads x budget + baseline < container limit).
+"""
+
+import gc
+import os
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+MB = 1024 * 1024
+
+# Growth of the process RSS a job may cause (0 for no budget)
+BUDGET_BYTES = int(float(os.environ.get('JOB_MEMORY_BUDGET_MB', 0)) * MB)
+# Growth past which the job switches to its low-memory mode
+SOFT_BYTES = int(float(os.environ.get('JOB_MEMORY_SOFT_MB', BUDGET_BYTES * 0.75 / MB)) * MB)
+# Trace allocations (slows Python allocations down noticeably)
+TRACEMALLOC = os.environ.get('JOB_TRACEMALLOC', '0') == '1'
+# Seconds between RSS samples
+SAMPLE_INTERVAL = float(os.environ.get('JOB_MEMORY_SAMPLE_SECONDS', 0.2))
+# Allocation sites kept per tracemalloc snapshot
+TOP_ALLOCATIONS = 10
+# Frames recorded per traced allocation (to find the caller in this repo)
+TRACE_FRAMES = 16
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """A render grew past its memory budget and was stopped."""
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Only the peak is available; kilobytes on Linux, bytes on macOS
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+# Jobs tracing allocations (tracemalloc is process-wide)
+_tracing = 0
+_tracing_lock = threading.Lock()
+
+
+def _start_tracing():
+    global _tracing
+    with _tracing_lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        _tracing += 1
+
+
+def _stop_tracing():
+    global _tracing
+    with _tracing_lock:
+        _tracing -= 1
+        if _tracing == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def _top_allocations(limit: int = TOP_ALLOCATIONS) -> List[Dict]:
+    """
+    Largest allocation sites of a tracemalloc snapshot.
+
+    Allocations made inside libraries (NumPy, Pillow, moviepy) are charged
+    to the innermost line of this repository that led to them.
+    """
+    sites: Dict[str, List[int]] = {}
+    for trace in tracemalloc.take_snapshot().traces:
+        frame = trace.traceback[0]
+        for candidate in trace.traceback:
+            if candidate.filename.startswith(ROOT_DIR):
+                frame = candidate
+                break
+        site = sites.setdefault(f'{os.path.relpath(frame.filename, ROOT_DIR)}:{frame.lineno}',
+                                [0, 0])
+        site[0] += trace.size
+        site[1] += 1
+    top = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    return [{'site': site, 'mb': round(size / MB, 2), 'count': count}
+            for site, (size, count) in top]
+
+
+class MemoryMonitor:
+    """Memory accounting of one render; use as a context manager."""
+
+    def __init__(self, name: str = '', budget: int = BUDGET_BYTES, soft_limit: int = SOFT_BYTES,
+                 trace: bool = TRACEMALLOC, interval: float = SAMPLE_INTERVAL):
+        """
+        Args:
+            name: Job name for logging
+            budget: Growth in bytes that stops the render (0 for none)
+            soft_limit: Growth in bytes that enables the low-memory mode
+                (0 for never)
+            trace: Record tracemalloc snapshots
+            interval: Seconds between RSS samples
+        """
+        self.name = name
+        self.budget = budget
+        self.soft_limit = soft_limit
+        self.trace = trace
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self.step = None
+        self.step_peaks: Dict[str, int] = {}
+        self.snapshots: Dict[str, List[Dict]] = {}
+        self.started = None
+        self.finished = None
+        self._low_memory = threading.Event()
+        self._exceeded = None
+        self._low_memory_hooks: List[Callable] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> 'MemoryMonitor':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def start(self):
+        """Take the baseline and start sampling."""
+        if self.trace:
+            _start_tracing()
+        self.started = time.time()
+        self.baseline = current_rss()
+        self.peak = self.baseline
+        self._thread = threading.Thread(target=self._sample_loop, name='memory-monitor',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and take the final snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._sample()
+        if self.trace:
+            if tracemalloc.is_tracing():
+                self.snapshots['end'] = _top_allocations()
+            _stop_tracing()
+        self.finished = time.time()
+        print(f"  Memory{f' of {self.name}' if self.name else ''}: "
+              f"peak {self.peak / MB:.0f} MB, job growth {self.peak_growth / MB:.0f} MB"
+              f"{' (low-memory mode)' if self.low_memory else ''}")
+
+    def begin_step(self, step: str):
+        """Attribute the following samples to a generation step."""
+        self._sample()
+        self.step = step
+        self.step_peaks.setdefault(step, 0)
+
+    @property
+    def peak_growth(self) -> int:
+        return max(self.peak - self.baseline, 0)
+
+    @property
+    def low_memory(self) -> bool:
+        """True once the job went past its soft limit."""
+        return self._low_memory.is_set()
+
+    def on_low_memory(self, hook: Callable):
+        """Call `hook` (once) when the job enters its low-memory mode."""
+        self._low_memory_hooks.append(hook)
+        if self.low_memory:
+            hook()
+
+    def check(self):
+        """
+        Raise MemoryBudgetExceeded if the job went past its budget.
+
+        Cheap enough to call before every frame: sampling happens on the
+        monitor thread.
+        """
+        if self._exceeded is not None:
+            raise MemoryBudgetExceeded(self._exceeded)
+
+    def report(self) -> Dict:
+        """JSON-serializable summary (for the job result)."""
+        report = {
+            'baseline_mb': round(self.baseline / MB, 1),
+            'peak_mb': round(self.peak / MB, 1),
+            'peak_growth_mb': round(self.peak_growth / MB, 1),
+            'steps_mb': {step: round(max(peak - self.baseline, 0) / MB, 1)
+                         for step, peak in self.step_peaks.items()},
+            'low_memory': self.low_memory,
+        }
+        if self.budget:
+            report['budget_mb'] = round(self.budget / MB, 1)
+        if self.trace:
+            report['allocations'] = self.snapshots
+        return report
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss()
+        self.peak = max(self.peak, rss)
+        if self.step is not None:
+            self.step_peaks[self.step] = max(self.step_peaks[self.step], rss)
+
+        growth = rss - self.baseline
+        if self.soft_limit and growth > self.soft_limit and not self._low_memory.is_set():
+            print(f"  {self.name or 'Job'} grew by {growth / MB:.0f} MB "
+                  f"(soft limit {self.soft_limit / MB:.0f} MB): switching to low-memory mode")
+            if self.trace and tracemalloc.is_tracing():
+                self.snapshots['soft_limit'] = _top_allocations()
+            self._low_memory.set()
+            for hook in self._low_memory_hooks:
+                hook()
+            gc.collect()
+        if self.budget and growth > self.budget and self._exceeded is None:
+            self._exceeded = (
+                f"Render used {growth / MB:.0f} MB, over its {self.budget / MB:.0f} MB "
+                f"memory budget"
+            )
+
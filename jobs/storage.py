@@ -0,0 +1,301 @@
+"""
+Disk quota manager.
+Generated videos, uploads and intermediate caches are grouped into pools,
+each with a byte quota. A background sweep evicts the least recently used
+entries of a pool until it fits, drops temporary leftovers past their
+maximum age, and keeps a minimum of free disk space across all pools.
+Files an active (queued or running) job still needs are never evicted.
+
+Last use is the later of a file's mtime and atime; readers mark a use
+explicitly with touch(), so it does not depend on how the volume is mounted
+(relatime, noatime).
+"""
+
+import fnmatch
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MB = 1024 * 1024
+# Seconds between background sweeps
+SWEEP_INTERVAL = float(os.environ.get('STORAGE_SWEEP_SECONDS', 300))
+# Free space kept on the volume of the managed directories
+MIN_FREE_BYTES = int(float(os.environ.get('STORAGE_MIN_FREE_MB', 512)) * MB)
+
+
+@dataclass
+class StoragePool:
+    """A group of files sharing one quota."""
+
+    name: str
+    root: str
+    patterns: Tuple[str, ...] = ('*',)
+    # Bytes (0 for no quota)
+    quota: int = 0
+    # Entries used more recently than this are never evicted
+    min_age: float = 300.0
+    # Entries unused for longer than this are removed regardless of quota
+    max_age: Optional[float] = None
+
+
+@dataclass
+class Entry:
+    """A file or directory directly under a pool root."""
+
+    path: str
+    size: int
+    last_used: float
+
+
+def _quota(variable: str, default_mb: float) -> int:
+    return int(float(os.environ.get(variable, default_mb)) * MB)
+
+
+def default_pools(root: str = ROOT_DIR) -> List[StoragePool]:
+    """Pools of the app's directories, with quotas from the environment."""
+    output_dir = os.path.join(root, 'output')
+    return [
+        # Videos wait an hour for their download before they can go
+        StoragePool('outputs', output_dir, ('*_ad.mp4',),
+                    quota=_quota('STORAGE_OUTPUT_MB', 2048), min_age=3600),
+        StoragePool('previews', os.path.join(output_dir, 'previews'),
+                    quota=_quota('STORAGE_PREVIEW_MB', 256), min_age=3600),
+        # Progressive HLS of videos being rendered (see render/streaming.py)
+        StoragePool('streams', os.path.join(output_dir, 'streams'),
+                    quota=_quota('STORAGE_STREAMS_MB', 512), min_age=3600),
+        # Execution traces of jobs (see jobs/tracing.py)
+        StoragePool('traces', os.path.join(output_dir, 'traces'),
+                    quota=_quota('STORAGE_TRACES_MB', 64), min_age=3600),
+        # Frame profiles of RENDER_PROFILE renders (see render/profiler.py)
+        StoragePool('profiles', os.path.join(output_dir, 'profiles'),
+                    quota=_quota('STORAGE_PROFILES_MB', 64), min_age=3600),
+        StoragePool('uploads', os.path.join(root, 'uploads'),
+                    quota=_quota('STORAGE_UPLOADS_MB', 1024), min_age=3600),
+        StoragePool('frame_cache', os.path.join(output_dir, 'frame_cache'),
+                    quota=_quota('STORAGE_FRAME_CACHE_MB', 2048), min_age=600),
+        StoragePool('segment_cache', os.path.join(output_dir, 'segment_cache'),
+                    quota=_quota('STORAGE_SEGMENT_CACHE_MB', 1024), min_age=600),
+        StoragePool('voice_cache', os.path.join(output_dir, 'voice_cache'),
+                    quota=_quota('STORAGE_VOICE_CACHE_MB', 128), min_age=600),
+        StoragePool('closing_segments', os.path.join(output_dir, 'closing_segments'),
+                    quota=_quota('STORAGE_CLOSING_MB', 64), min_age=3600),
+        # Segment files; leftovers of crashed renders
+        StoragePool('temp_audio', os.path.join(output_dir, 'temp_audio'),
+                    quota=_quota('STORAGE_TEMP_MB', 256), min_age=3600, max_age=86400),
+        # Frame dumps and drawn images of older versions of the pipeline
+        StoragePool('temp_frames', os.path.join(root, 'temp_frames'),
+                    ('frame_*.png',), min_age=3600, max_age=86400),
+        StoragePool('temp_assets', os.path.join(root, 'assets'),
+                    ('temp_*',), min_age=3600, max_age=86400),
+    ]
+
+
+def touch(path: str):
+    """Mark a file as used now (keeps its mtime)."""
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+def _entry(path: str) -> Optional[Entry]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    size = stat.st_size
+    last_used = max(stat.st_mtime, stat.st_atime)
+    if os.path.isdir(path):
+        # A directory is as large and as recent as its contents (its own
+        # atime only says that it was listed, e.g. by this scan)
+        size = 0
+        last_used = stat.st_mtime
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    file_stat = os.stat(os.path.join(dir_path, file_name))
+                except OSError:
+                    continue
+                size += file_stat.st_size
+                last_used = max(last_used, file_stat.st_mtime, file_stat.st_atime)
+    return Entry(path, size, last_used)
+
+
+def _remove(path: str) -> bool:
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except FileNotFoundError:
+        # Another process got there first
+        return False
+    except OSError as e:
+        print(f"Could not evict {path}: {e}")
+        return False
+
+
+class StorageManager:
+    """Keeps the pools within their quotas."""
+
+    def __init__(self, pools: List[StoragePool] = None, min_free: int = MIN_FREE_BYTES,
+                 queue=None):
+        """
+        Args:
+            pools: Managed pools (default_pools() by default)
+            min_free: Bytes of free disk space to keep
+            queue: Job queue whose active jobs are protected (the
+                process-wide one by default)
+        """
+        self.pools = pools if pools is not None else default_pools()
+        self.min_free = min_free
+        self._queue = queue
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            from jobs.job_queue import get_job_queue
+            self._queue = get_job_queue()
+        return self._queue
+
+    def scan(self, pool: StoragePool) -> List[Entry]:
+        """Entries of a pool, least recently used first."""
+        try:
+            names = os.listdir(pool.root)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if any(fnmatch.fnmatch(name, pattern) for pattern in pool.patterns):
+                entry = _entry(os.path.join(pool.root, name))
+                if entry is not None:
+                    entries.append(entry)
+        entries.sort(key=lambda entry: entry.last_used)
+        return entries
+
+    def protected(self) -> Tuple[Set[str], List[str]]:
+        """
+        What active jobs still need.
+
+        Returns:
+            Tuple of (absolute paths, job ids that mark their files by name)
+        """
+        paths, job_ids = set(), []
+        for job in self.queue.active_jobs():
+            job_ids.append(job.id)
+            wallpapers = job.params.get('wallpapers') or [job.params.get('wallpaper')]
+            for path in wallpapers:
+                if path:
+                    paths.add(os.path.abspath(path))
+        return paths, job_ids
+
+    def _evictable(self, entry: Entry, pool: StoragePool, now: float,
+                   protected: Tuple[Set[str], List[str]]) -> bool:
+        if now - entry.last_used < pool.min_age:
+            return False
+        paths, job_ids = protected
+        if os.path.abspath(entry.path) in paths:
+            return False
+        name = os.path.basename(entry.path)
+        # Outputs carry the first 8 characters of their job id
+        return not any(job_id[:8] in name for job_id in job_ids)
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Enforce max ages, quotas and the free space floor once.
+
+        Returns:
+            Bytes evicted per pool
+        """
+        with self._lock:
+            now = time.time()
+            protected = self.protected()
+            evicted = {pool.name: 0 for pool in self.pools}
+            candidates = []
+
+            for pool in self.pools:
+                entries = self.scan(pool)
+                total = sum(entry.size for entry in entries)
+                for entry in entries:
+                    evictable = self._evictable(entry, pool, now, protected)
+                    expired = pool.max_age is not None and now - entry.last_used > pool.max_age
+                    over_quota = pool.quota and total > pool.quota
+                    if evictable and (expired or over_quota):
+                        if _remove(entry.path):
+                            evicted[pool.name] += entry.size
+                        total -= entry.size
+                    elif evictable:
+                        candidates.append((entry, pool))
+                if pool.quota and total > pool.quota:
+                    print(f"Storage pool {pool.name} over quota "
+                          f"({total / MB:.1f}/{pool.quota / MB:.1f} MB) with nothing evictable")
+
+            # Still short of free space: evict across pools, oldest first
+            candidates.sort(key=lambda item: item[0].last_used)
+            for entry, pool in candidates:
+                if self.free_bytes() >= self.min_free:
+                    break
+                if _remove(entry.path):
+                    evicted[pool.name] += entry.size
+
+            for name, size in evicted.items():
+                if size:
+                    print(f"Storage: evicted {size / MB:.1f} MB from {name}")
+            return evicted
+
+    def free_bytes(self) -> int:
+        roots = [pool.root for pool in self.pools if os.path.isdir(pool.root)]
+        if not roots:
+            return self.min_free
+        return min(shutil.disk_usage(root).free for root in roots)
+
+    def usage(self) -> Dict[str, Dict]:
+        """Bytes, entry count and quota of each pool."""
+        report = {}
+        for pool in self.pools:
+            entries = self.scan(pool)
+            report[pool.name] = {
+                'bytes': sum(entry.size for entry in entries),
+                'entries': len(entries),
+                'quota': pool.quota,
+            }
+        return report
+
+    def _run(self, interval: float):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Storage sweep failed: {e}")
+            time.sleep(interval)
+
+    def start(self, interval: float = SWEEP_INTERVAL) -> threading.Thread:
+        """Sweep in a background thread (once per process)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval,), name='storage-sweeper', daemon=True
+                )
+                self._thread.start()
+            return self._thread
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_storage_manager() -> StorageManager:
+    """Process-wide storage manager over the default pools."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = StorageManager()
+        return _manager
@@ -0,0 +1,273 @@
+"""
+Execution traces of generation jobs.
+Each part of a job records timed spans while it runs: the HTTP request that
+queued it (web process) and every render attempt (worker thread: queue wait,
+generation steps, chunks, muxing), including the helper threads it starts
+(source prefetch, PCM writer) and the ffmpeg processes it runs, each of
+which gets its own track from spawn to exit.
+
+Parts are saved as Chrome trace event lists under
+`output/traces/<job_id>/<part>.json` and merged by load_trace() into one
+trace for chrome://tracing or https://ui.perfetto.dev. Timestamps are wall
+clock microseconds, so parts written by different processes line up.
+
+Code records into the trace of the current context, so instrumented code
+needs no trace argument, and does nothing outside a traced job:
+
+    with tracing.span('mux', path=output_path):
+        ...
+"""
+
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Record traces of jobs (spans cost microseconds; nothing is per frame)
+ENABLED = os.environ.get('JOB_TRACE', '1') == '1'
+TRACE_DIR = os.environ.get('TRACE_DIR', os.path.join(ROOT_DIR, 'output', 'traces'))
+
+
+def trace_dir(job_id: str) -> str:
+    """Directory holding the trace parts of a job."""
+    return os.path.join(TRACE_DIR, job_id)
+
+
+def _now() -> float:
+    return time.time() * 1e6
+
+
+class Trace:
+    """Spans recorded by one part of a job (e.g. one render attempt)."""
+
+    def __init__(self, part: str, process_name: str = None):
+        """
+        Args:
+            part: Name of the part (file name of its events)
+            process_name: Label of this process in the trace
+        """
+        self.part = part
+        self.pid = os.getpid()
+        self.process_name = process_name or f'pid {self.pid}'
+        self.events: List[Dict] = []
+        self._threads: Dict[int, str] = {}
+        # Open step of each thread: (name, start)
+        self._steps: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, cat: str = 'job',
+                 tid: int = None, args: Dict = None):
+        """
+        Record a complete span.
+
+        Args:
+            name: Span name
+            start: Start in microseconds since the epoch
+            end: End in microseconds since the epoch
+            cat: Category (filterable in the trace viewers)
+            tid: Track; the calling thread's by default
+            args: Details shown with the span
+        """
+        if tid is None:
+            tid = self._thread_track()
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                 'ts': start, 'dur': max(end - start, 0)}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    def name_track(self, tid: int, name: str):
+        """Label a track (threads are labeled with their thread name)."""
+        with self._lock:
+            self._threads[tid] = name
+
+    def begin_step(self, name: str):
+        """End the calling thread's current step, if any, and start `name`."""
+        self.end_step()
+        self._steps[self._thread_track()] = (name, _now())
+
+    def end_step(self):
+        """End the calling thread's current step."""
+        step = self._steps.pop(self._thread_track(), None)
+        if step is not None:
+            self.add_span(step[0], step[1], _now(), cat='step')
+
+    def trace_events(self) -> List[Dict]:
+        """Events with the process and track labels."""
+        with self._lock:
+            events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                       'args': {'name': self.process_name}}]
+            events.extend({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                           'args': {'name': name}} for tid, name in self._threads.items())
+            events.extend(self.events)
+        return events
+
+    def save(self, job_id: str):
+        """Write this part to the job's trace directory."""
+        directory = trace_dir(job_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.part}.json')
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.trace_events(), f)
+        os.replace(tmp_path, path)
+
+    def _thread_track(self) -> int:
+        tid = threading.get_native_id()
+        if tid not in self._threads:
+            self.name_track(tid, threading.current_thread().name)
+        return tid
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace of the job running in this context, or None."""
+    return _current.get()
+
+
+def set_current(trace: Optional[Trace]):
+    """Make `trace` current; returns a token for reset_current()."""
+    return _current.set(trace)
+
+
+def reset_current(token):
+    _current.reset(token)
+
+
+@contextmanager
+def activate(trace: Optional[Trace]):
+    """Record into `trace` for the duration of the block."""
+    token = set_current(trace)
+    try:
+        yield trace
+    finally:
+        reset_current(token)
+
+
+@contextmanager
+def span(name: str, cat: str = 'render', **args):
+    """Time the block as a span of the current trace (no-op without one)."""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = _now()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, _now(), cat=cat, args=args or None)
+
+
+def begin_step(name: str):
+    """Start a step of the current trace on this thread (see Trace.begin_step)."""
+    trace = current_trace()
+    if trace is not None:
+        trace.begin_step(name)
+
+
+def end_step():
+    trace = current_trace()
+    if trace is not None:
+        trace.end_step()
+
+
+def bind(func: Callable, name: str = None, **args) -> Callable:
+    """
+    Carry the current trace into another thread.
+
+    Args:
+        func: Function run by the other thread
+        name: Record each call as a span with this name
+
+    Returns:
+        Function recording into the caller's trace
+    """
+    trace = current_trace()
+    if trace is None:
+        return func
+
+    def bound(*a, **k):
+        with activate(trace):
+            if name is None:
+                return func(*a, **k)
+            with span(name, **args):
+                return func(*a, **k)
+
+    return bound
+
+
+# Running processes: pid -> (trace, name, start, args)
+_processes: Dict[int, tuple] = {}
+_processes_lock = threading.Lock()
+
+
+def process_started(pid: int, name: str, **args):
+    """
+    Start the track of a subprocess (ends with process_exited).
+
+    Args:
+        pid: Process id (also the id of its track)
+        name: Span name (e.g. 'ffmpeg encode')
+    """
+    trace = current_trace()
+    if trace is None:
+        return
+    trace.name_track(pid, f'{name} (pid {pid})')
+    with _processes_lock:
+        _processes[pid] = (trace, name, _now(), args)
+
+
+def process_exited(pid: int, returncode: int = None):
+    """End the track of a subprocess started with process_started."""
+    with _processes_lock:
+        entry = _processes.pop(pid, None)
+    if entry is None:
+        return
+    trace, name, start, args = entry
+    if returncode is not None:
+        args = dict(args, returncode=returncode)
+    trace.add_span(name, start, _now(), cat='subprocess', tid=pid, args=args or None)
+
+
+def load_trace(job_id: str) -> Optional[Dict]:
+    """
+    The parts of a job's trace merged into one Chrome trace.
+
+    Returns:
+        Trace object ({'traceEvents': [...]}), or None if the job has none
+    """
+    paths = sorted(glob.glob(os.path.join(trace_dir(job_id), '*.json')))
+    if not paths:
+        return None
+    events = []
+    # Parts written by one process (web server with in-process workers)
+    # share its pid: label the process once with all their names
+    process_names: Dict[int, List[str]] = {}
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                part = json.load(f)
+        except (OSError, ValueError):
+            # Removed or being replaced; the next load has it
+            continue
+        for event in part:
+            if event.get('ph') == 'M' and event.get('name') == 'process_name':
+                names = process_names.setdefault(event['pid'], [])
+                if event['args']['name'] not in names:
+                    names.append(event['args']['name'])
+            else:
+                events.append(event)
+    events[:0] = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                   'args': {'name': ' + '.join(names)}}
+                  for pid, names in process_names.items()]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'job_id': job_id}}
@@ -0,0 +1,205 @@
+"""
+Render workers.
+A worker claims jobs from the shared queue, runs them and keeps its lease
+alive with a heartbeat thread. If the lease is lost (e.g. the worker stalled
+and the job was handed to another one), the handler is told to abort, so
+two workers do not keep rendering the same job. Workers run as background
+threads inside the web processes (see gunicorn.conf.py) or standalone
+processes sharing the queue database (see jobs/job_queue.py):
+
+    python -m jobs.worker
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from jobs import tracing
+from jobs.job_queue import LEASE_SECONDS, Job, JobQueue, get_job_queue
+from jobs.memory import MemoryBudgetExceeded
+
+
+def run_generate_video(params: Dict, abort: threading.Event = None) -> Dict:
+    """Handler for 'generate_video' jobs."""
+    from render.previews import load_previews
+    from templates.base_template import VideoTemplate
+    template = VideoTemplate()
+    output_paths = template.generate_videos(params, abort=abort)
+    outputs = {
+        name: {
+            'filename': os.path.basename(output_path),
+            'previews': load_previews(output_path)
+        }
+        for name, output_path in output_paths.items()
+    }
+    # The primary (first) format also at the top level
+    result = dict(next(iter(outputs.values())))
+    result['outputs'] = outputs
+    result['memory'] = template.memory_report
+    return result
+
+
+# Job kind -> handler(params, abort) returning a JSON-serializable result;
+# handlers stop early once `abort` is set
+HANDLERS: Dict[str, Callable[[Dict, threading.Event], Dict]] = {
+    'generate_video': run_generate_video,
+}
+
+
+class Worker:
+    """Pulls jobs from the queue and runs them one at a time."""
+
+    def __init__(self, queue: JobQueue = None, worker_id: str = None,
+                 poll_interval: float = 1.0, lease: float = LEASE_SECONDS):
+        """
+        Initialize the worker.
+
+        Args:
+            queue: Job queue (the process-wide one by default)
+            worker_id: Unique id (host, pid and a random suffix by default)
+            poll_interval: Seconds to sleep when the queue is empty
+            lease: Lease length; heartbeats renew it 4 times per lease
+        """
+        self.queue = queue or get_job_queue()
+        self.worker_id = worker_id or (
+            f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        )
+        self.poll_interval = poll_interval
+        self.lease = lease
+
+    def run_once(self) -> bool:
+        """
+        Claim and run one job.
+
+        Returns:
+            False if there was nothing to run
+        """
+        job = self.queue.claim(self.worker_id, kinds=list(HANDLERS), lease=self.lease)
+        if job is None:
+            return False
+
+        print(f"[{self.worker_id}] Running job {job.id} ({job.kind}, attempt {job.attempts})")
+        # Spans of this attempt, saved with the job's other trace parts
+        trace = None
+        if tracing.ENABLED:
+            trace = tracing.Trace(f'attempt-{job.attempts}', process_name=f'worker {self.worker_id}')
+            trace.add_span('queued', job.available_at * 1e6, time.time() * 1e6, cat='queue')
+        stop_heartbeat = threading.Event()
+        lease_lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job, stop_heartbeat, lease_lost), daemon=True
+        )
+        heartbeat.start()
+        try:
+            with tracing.activate(trace), tracing.span(job.kind, cat='job', job_id=job.id,
+                                                       attempt=job.attempts):
+                result = HANDLERS[job.kind](job.params, lease_lost)
+        except Exception as e:
+            if lease_lost.is_set():
+                # The job belongs to another worker now
+                print(f"[{self.worker_id}] Abandoned job {job.id}: {e}")
+            elif isinstance(e, MemoryBudgetExceeded):
+                # Another attempt would only grow as large again
+                print(f"[{self.worker_id}] Job {job.id} failed: {e}")
+                self.queue.fail(job.id, self.worker_id, str(e), retry=False)
+            else:
+                traceback.print_exc()
+                self.queue.fail(job.id, self.worker_id, str(e))
+        else:
+            if not self.queue.complete(job.id, self.worker_id, result):
+                print(f"[{self.worker_id}] Lost the lease on job {job.id}; result dropped")
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            if trace is not None:
+                try:
+                    trace.save(job.id)
+                except OSError as e:
+                    print(f"[{self.worker_id}] Could not save the trace of job {job.id}: {e}")
+        return True
+
+    def _heartbeat(self, job: Job, stop: threading.Event, lost: threading.Event):
+        while not stop.wait(self.lease / 4):
+            self._check_in()
+            try:
+                if not self.queue.heartbeat(job.id, self.worker_id, self.lease):
+                    print(f"[{self.worker_id}] Job {job.id} was reclaimed by another worker")
+                    lost.set()
+                    return
+            except Exception as e:
+                # A transient database error; the next beat may succeed
+                print(f"[{self.worker_id}] Heartbeat failed for job {job.id}: {e}")
+
+    def _check_in(self):
+        # Counted by admission control while it keeps checking in
+        try:
+            self.queue.touch_worker(self.worker_id)
+        except Exception as e:
+            print(f"[{self.worker_id}] Check-in failed: {e}")
+
+    def run(self, stop: threading.Event = None):
+        """Run jobs until `stop` is set."""
+        stop = stop or threading.Event()
+        checked_in = 0.0
+        try:
+            while not stop.is_set():
+                if time.time() - checked_in >= self.lease / 4:
+                    self._check_in()
+                    checked_in = time.time()
+                try:
+                    ran = self.run_once()
+                except Exception:
+                    traceback.print_exc()
+                    ran = False
+                if not ran:
+                    stop.wait(self.poll_interval)
+        finally:
+            try:
+                self.queue.remove_worker(self.worker_id)
+            except Exception:
+                pass
+
+
+def start_worker_threads(count: int = None) -> list:
+    """
+    Start background worker threads in this process.
+
+    Args:
+        count: Number of threads (RENDER_WORKER_THREADS, default 1;
+            0 makes this process enqueue only)
+
+    Returns:
+        The started threads
+    """
+    if count is None:
+        count = int(os.environ.get('RENDER_WORKER_THREADS', 1))
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(
+            target=Worker().run, name=f'render-worker-{i}', daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+if __name__ == '__main__':
+    # Standalone worker process
+    import moviepy_compat  # noqa: F401
+    from jobs.storage import get_storage_manager
+    get_storage_manager().start()
+    worker = Worker()
+    print(f"Render worker {worker.worker_id} polling {worker.queue.db_path}")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
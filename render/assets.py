@@ -0,0 +1,182 @@
+"""
+Process-wide asset registry.
+Mockups and placeholder screens are drawn (or loaded from assets/) once per
+process and kept as decoded, read-only arrays. Scenes refer to them by an
+`asset:<name>` source instead of a PNG path, so nothing is written to or
+re-read from disk per video and concurrent jobs never race on a file.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+ASSET_SCHEME = 'asset:'
+
+
+def is_asset(source: str) -> bool:
+    """Check whether a layer source refers to a registered asset."""
+    return isinstance(source, str) and source.startswith(ASSET_SCHEME)
+
+
+def asset_source(name: str) -> str:
+    """Layer source string for a registered asset."""
+    return ASSET_SCHEME + name
+
+
+class Asset:
+    """A decoded asset: read-only pixels and their content hash."""
+
+    def __init__(self, name: str, array: np.ndarray, fingerprint: str = None):
+        """
+        Args:
+            name: Asset name
+            array: Pixels (H, W, 3 or 4), e.g. memory-mapped from the bake
+            fingerprint: Content hash (computed when not given)
+        """
+        self.name = name
+        self.array = array
+        if self.array.flags.writeable:
+            self.array.setflags(write=False)
+        if fingerprint is None:
+            digest = hashlib.sha1(str(self.array.shape).encode())
+            digest.update(self.array.tobytes())
+            fingerprint = digest.hexdigest()
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_image(cls, name: str, image: Image.Image) -> 'Asset':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        return cls(name, np.array(image))
+
+    @property
+    def has_alpha(self) -> bool:
+        return self.array.shape[2] == 4
+
+    @property
+    def size(self):
+        height, width = self.array.shape[:2]
+        return width, height
+
+
+class AssetRegistry:
+    """Builds each registered asset once and shares it read-only."""
+
+    def __init__(self):
+        self._builders: Dict[str, Callable[[], Image.Image]] = {}
+        self._files: Dict[str, str] = {}
+        self._assets: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, builder: Callable[[], Image.Image],
+                 path: Optional[str] = None):
+        """
+        Register an asset.
+
+        Args:
+            name: Asset name (used as `asset:<name>`)
+            builder: Callable drawing the asset as a PIL image
+            path: Image file that replaces the drawn asset when it exists
+        """
+        with self._lock:
+            self._builders[name] = builder
+            if path is not None:
+                self._files[name] = path
+
+    def asset(self, name: str) -> Asset:
+        """The decoded asset, building it on first use."""
+        asset = self._assets.get(name)
+        if asset is not None:
+            return asset
+
+        with self._lock:
+            if name not in self._builders:
+                raise KeyError(f"Unknown asset: {name}")
+            build_lock = self._building.setdefault(name, threading.Lock())
+
+        # One build per asset; other callers wait for it
+        with build_lock:
+            asset = self._assets.get(name)
+            if asset is None:
+                asset = self._load(name)
+                self._assets[name] = asset
+        return asset
+
+    def _load(self, name: str) -> Asset:
+        from render.bake import get_bake
+
+        # Memory-mapped from the build-time bake when available
+        baked = get_bake()
+        if baked is not None:
+            array = baked.array(f'asset_{name}')
+            if array is not None:
+                return Asset(name, array, baked.array_fingerprint(f'asset_{name}'))
+        return Asset.from_image(name, self._load_image(name))
+
+    def _load_image(self, name: str) -> Image.Image:
+        path = self._files.get(name)
+        if path and os.path.exists(path):
+            with Image.open(path) as img:
+                img.load()
+                return img.copy()
+        return self._builders[name]()
+
+    def get(self, name: str) -> np.ndarray:
+        """Read-only view of an asset's pixels (H, W, 3 or 4)."""
+        return self.asset(name).array.view()
+
+    def fingerprint(self, name: str) -> str:
+        return self.asset(name).fingerprint
+
+    def names(self):
+        with self._lock:
+            return list(self._builders)
+
+    def warm_up(self):
+        """Build every registered asset."""
+        for name in self.names():
+            self.asset(name)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_asset_registry() -> AssetRegistry:
+    """Process-wide asset registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = AssetRegistry()
+        return _registry
+
+
+def load_image(source: str):
+    """
+    Pixels of an image source: a shared read-only array for assets, the
+    file path itself otherwise (moviepy's ImageClip accepts both).
+    """
+    if is_asset(source):
+        return get_asset_registry().get(source[len(ASSET_SCHEME):])
+    return source
+
+
+def source_fingerprint(source: str) -> str:
+    """Content hash of an image source (registered asset or file)."""
+    if is_asset(source):
+        return get_asset_registry().fingerprint(source[len(ASSET_SCHEME):])
+    from render.timeline import file_fingerprint
+    return file_fingerprint(source)
+
+
+def source_size(source: str):
+    """(width, height) of an image source (registered asset or file)."""
+    if is_asset(source):
+        return get_asset_registry().asset(source[len(ASSET_SCHEME):]).size
+    with Image.open(source) as image:
+        return image.size
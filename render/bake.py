@@ -0,0 +1,303 @@
+"""
+Build-time asset bake.
+Precomputes every deterministic artifact of the ad (mockups and
+placeholders, background images, the looping mandala background, the
+static voiceovers of each language and the encoded closing scene of each
+language and output format) into a versioned cache directory. The
+directory name carries a key of the code and asset files that produce the
+artifacts, so a stale bake is simply not found. At startup the app
+validates the manifest and memory-maps the arrays; anything missing is
+still generated on demand.
+
+Run during the image build:
+
+    python -m render.bake
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+# Bump when the layout of the cache changes
+BAKE_VERSION = 1
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BAKE_DIR = os.environ.get('BAKE_DIR', os.path.join(ROOT_DIR, 'cache', 'baked'))
+
+# Files whose content determines the baked artifacts
+KEY_FILES = (
+    'render/assets.py',
+    'render/bake.py',
+    'render/closing_segment.py',
+    'render/compositor.py',
+    'render/encoder.py',
+    'render/formats.py',
+    'templates/animated_background.py',
+    'templates/base_template.py',
+    'templates/scene2_showcase.py',
+    'templates/scene3_install.py',
+    'templates/scene_multi_wallpapers.py',
+    'scripts/script_generator.py',
+    'audio/voice_generator.py',
+    'assets/phone_mockup.png',
+)
+
+# Background sizes and frame rate baked (the plan size of the ad)
+BACKGROUND_SIZES = ((1080, 1920),)
+BACKGROUND_FPS = 30
+
+
+def bake_key() -> str:
+    """Hash of the bake version and every file that shapes the artifacts."""
+    digest = hashlib.sha1(f'bake-v{BAKE_VERSION}'.encode())
+    for rel_path in KEY_FILES:
+        digest.update(rel_path.encode())
+        path = os.path.join(ROOT_DIR, rel_path)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        else:
+            digest.update(b'<missing>')
+    return digest.hexdigest()
+
+
+def bake_dir(root: str = DEFAULT_BAKE_DIR) -> str:
+    """Versioned directory of the bake for the current code."""
+    return os.path.join(root, f'v{BAKE_VERSION}-{bake_key()[:16]}')
+
+
+def array_name(kind: str, size) -> str:
+    """Manifest name of a sized array (e.g. 'gradient_1080x1920')."""
+    width, height = size
+    return f'{kind}_{width}x{height}'
+
+
+class BakedCache:
+    """A validated bake: memory-mapped arrays and static voiceovers."""
+
+    def __init__(self, path: str, manifest: Dict):
+        self.path = path
+        self.manifest = manifest
+        self._arrays = {}
+        for name, entry in manifest['arrays'].items():
+            self._arrays[name] = np.load(os.path.join(path, entry['file']), mmap_mode='r')
+
+    def array(self, name: str) -> Optional[np.ndarray]:
+        """Read-only memory-mapped array, or None if it was not baked."""
+        return self._arrays.get(name)
+
+    def array_fingerprint(self, name: str) -> Optional[str]:
+        entry = self.manifest['arrays'].get(name)
+        return entry.get('fingerprint') if entry else None
+
+    def background_loop(self, style: str, size):
+        """
+        Baked background loop.
+
+        Returns:
+            Tuple of (frames, fps), or None if it was not baked
+        """
+        name = array_name(f'background_{style}', size)
+        frames = self._arrays.get(name)
+        if frames is None:
+            return None
+        return frames, self.manifest['arrays'][name]['fps']
+
+    def voiceover(self, language: str, text: str):
+        """
+        Baked static voiceover.
+
+        Returns:
+            Tuple of (path, duration), or None if it was not baked
+        """
+        entry = self.manifest['voiceovers'].get(voiceover_key(language, text))
+        if entry is None:
+            return None
+        return os.path.join(self.path, entry['file']), entry['duration']
+
+    def closing_segment(self, key: str):
+        """
+        Baked closing segment (see render/closing_segment.py).
+
+        Returns:
+            Tuple of (video path, still frame path), or None if it was not baked
+        """
+        entry = self.manifest.get('closing', {}).get(key)
+        if entry is None:
+            return None
+        return os.path.join(self.path, entry['file']), os.path.join(self.path, entry['still'])
+
+
+def voiceover_key(language: str, text: str) -> str:
+    return f"{language}_{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}"
+
+
+def load_bake(root: str = DEFAULT_BAKE_DIR) -> Optional[BakedCache]:
+    """
+    Validate and map the bake for the current code.
+
+    Returns:
+        BakedCache, or None when there is no valid bake
+    """
+    path = bake_dir(root)
+    manifest_path = os.path.join(path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != BAKE_VERSION or manifest.get('key') != bake_key():
+            raise ValueError("version or key mismatch")
+        entries = (list(manifest['arrays'].values()) + list(manifest['voiceovers'].values())
+                   + list(manifest.get('closing', {}).values()))
+        for entry in entries:
+            file_path = os.path.join(path, entry['file'])
+            if os.path.getsize(file_path) != entry['bytes']:
+                raise ValueError(f"{entry['file']} has the wrong size")
+        return BakedCache(path, manifest)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring invalid asset bake at {path}: {e}")
+        return None
+
+
+_bake = None
+_bake_loaded = False
+_bake_lock = threading.Lock()
+
+
+def get_bake() -> Optional[BakedCache]:
+    """Process-wide bake, validated on first use (None if there is none)."""
+    global _bake, _bake_loaded
+    with _bake_lock:
+        if not _bake_loaded:
+            _bake = load_bake()
+            _bake_loaded = True
+            if _bake is not None:
+                print(f"Using asset bake {os.path.basename(_bake.path)} "
+                      f"({len(_bake.manifest['arrays'])} arrays, "
+                      f"{len(_bake.manifest['voiceovers'])} voiceovers)")
+        return _bake
+
+
+def _set_bake(bake: Optional[BakedCache]):
+    global _bake, _bake_loaded
+    with _bake_lock:
+        _bake = bake
+        _bake_loaded = True
+
+
+def bake(root: str = DEFAULT_BAKE_DIR, languages=None) -> str:
+    """
+    Precompute every deterministic artifact into the versioned bake dir.
+
+    Args:
+        root: Directory holding bakes (older versions are removed)
+        languages: Language codes of static voiceovers (defaults to all)
+
+    Returns:
+        Path of the bake directory
+    """
+    import moviepy_compat  # noqa: F401
+    import templates.scene2_showcase  # noqa: F401 (registers its placeholder)
+    from audio.voice_generator import VoiceGenerator
+    from render.assets import get_asset_registry
+    from render.closing_segment import ClosingSegmentCache
+    from render.formats import FORMATS
+    from scripts.script_generator import ScriptGenerator
+    from templates import animated_background
+    from templates.base_template import VideoTemplate
+
+    # Produce everything from scratch, never from an older bake
+    _set_bake(None)
+
+    final_path = bake_dir(root)
+    work_path = f'{final_path}.{os.getpid()}.tmp'
+    shutil.rmtree(work_path, ignore_errors=True)
+    os.makedirs(os.path.join(work_path, 'voice'))
+    manifest = {'version': BAKE_VERSION, 'key': bake_key(), 'created': time.time(),
+                'arrays': {}, 'voiceovers': {}, 'closing': {}}
+
+    def save_array(name, array, **extra):
+        file_name = f'{name}.npy'
+        file_path = os.path.join(work_path, file_name)
+        np.save(file_path, np.ascontiguousarray(array))
+        manifest['arrays'][name] = dict(file=file_name, bytes=os.path.getsize(file_path), **extra)
+        print(f"  {name}: {array.shape} ({array.nbytes / 1e6:.1f} MB)")
+
+    print("Baking mockups and placeholders...")
+    template = VideoTemplate(output_dir=os.path.join(work_path, 'output'))
+    registry = get_asset_registry()
+    for name in registry.names():
+        asset = registry.asset(name)
+        save_array(f'asset_{name}', asset.array, fingerprint=asset.fingerprint)
+
+    print("Baking backgrounds...")
+    for size in BACKGROUND_SIZES:
+        save_array(array_name('gradient', size),
+                   animated_background._gradient_image(size, animated_background.DEFAULT_COLORS))
+        save_array(array_name('mandala', size), animated_background._mandala_image(size))
+        frames = animated_background.render_mandala_loop(size, BACKGROUND_FPS)
+        save_array(array_name('background_mandala', size), frames, fps=BACKGROUND_FPS)
+
+    print("Baking static voiceovers...")
+    voice_generator = VoiceGenerator()
+    voice_dir = os.path.join(work_path, 'voice')
+    for language in languages or ScriptGenerator.TEMPLATES:
+        scripts = ScriptGenerator.generate_all_scripts('', '', language)
+        for scene_name in ScriptGenerator.STATIC_SCENES:
+            try:
+                path, duration = voice_generator.static_voiceover(
+                    scripts[scene_name], language, voice_dir
+                )
+            except Exception as e:
+                # Not fatal: the app generates it on first use instead
+                print(f"  Skipping {language} {scene_name}: {e}")
+                continue
+            key = voiceover_key(language, scripts[scene_name])
+            file_name = os.path.relpath(path, work_path)
+            manifest['voiceovers'][key] = {
+                'file': file_name,
+                'bytes': os.path.getsize(path),
+                'duration': duration,
+            }
+            print(f"  {language} {scene_name}: {duration:.2f}s")
+
+            if scene_name == ScriptGenerator.CLOSING_SCENE:
+                template.closing_segments = ClosingSegmentCache(os.path.join(work_path, 'closing'))
+                for output_format in FORMATS.values():
+                    key, (video_path, still_path) = template.prepare_closing(
+                        language, path, duration, output_format
+                    )
+                    manifest['closing'][key] = {
+                        'file': os.path.relpath(video_path, work_path),
+                        'still': os.path.relpath(still_path, work_path),
+                        'bytes': os.path.getsize(video_path),
+                    }
+
+    shutil.rmtree(os.path.join(work_path, 'output'), ignore_errors=True)
+    with open(os.path.join(work_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # Swap in the new bake and drop older ones
+    shutil.rmtree(final_path, ignore_errors=True)
+    os.replace(work_path, final_path)
+    for entry in os.listdir(root):
+        path = os.path.join(root, entry)
+        if path != final_path and entry.startswith('v') and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(f"Asset bake written to {final_path}")
+    return final_path
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, ROOT_DIR)
+    bake(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_BAKE_DIR)
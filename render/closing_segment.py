@@ -0,0 +1,152 @@
+"""
+Pre-encoded closing scene.
+The Play Store scene that ends every ad depends only on the mockup assets
+and on the language's static voiceover (which sets its length), so it is
+the same in every ad of a language. It is encoded once per (language,
+assets version, encoding profile) as a silent chunk with the settings of
+every other chunk (same codec, preset and closed GOPs), so ads append it
+by stream copy without composing or encoding it. The composed still frame
+is kept next to it for the previews.
+
+Closing segments are baked into the image (see render/bake.py) or encoded
+on first use into a cache directory.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from render.segment_cache import Chunk, _layer_key, code_key
+
+
+def closing_key(language: str, segment, size, fps: int, encoding: Dict) -> str:
+    """
+    Key of a closing segment.
+
+    Args:
+        language: Language code of its voiceover
+        segment: Planned closing Segment (its layers carry the asset
+            fingerprints)
+        size: Video size
+        fps: Frame rate
+        encoding: Encoder settings (see SegmentRenderer.encoding)
+    """
+    data = {
+        'code': code_key(),
+        'language': language,
+        'encoding': encoding,
+        'size': list(size),
+        'fps': fps,
+        'frames': int(round(segment.duration * fps)),
+        'layers': [_layer_key(layer) for layer in segment.layers],
+    }
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _load_still(path: str) -> np.ndarray:
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+class ClosingSegmentCache:
+    """Encoded closing segments, from the bake or a cache directory."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def paths(self, key: str) -> Tuple[str, str]:
+        """(video, still frame) paths of a key in the cache directory."""
+        base = os.path.join(self.cache_dir, key[:40])
+        return f'{base}.mp4', f'{base}.png'
+
+    def lookup(self, key: str) -> Optional[Tuple[str, str]]:
+        """Encoded (video, still) of a key, or None if not encoded yet."""
+        from render.bake import get_bake
+        baked = get_bake()
+        found = baked.closing_segment(key) if baked is not None else None
+        if found is not None:
+            return found
+        video_path, still_path = self.paths(key)
+        if os.path.exists(video_path) and os.path.exists(still_path):
+            from jobs.storage import touch
+            touch(video_path)
+            touch(still_path)
+            return video_path, still_path
+        return None
+
+    def prepare(self, key: str, plan, segment, renderer, segment_renderer) -> Tuple[str, str]:
+        """
+        Encode a closing segment unless it already is.
+
+        Args:
+            key: closing_key of the segment
+            plan: TimelinePlan holding the segment (for size and fps)
+            segment: The closing Segment
+            renderer: TimelineRenderer of the plan (only used to encode)
+            segment_renderer: SegmentRenderer with the ad's encoding
+
+        Returns:
+            Tuple of (video path, still frame path)
+        """
+        found = self.lookup(key)
+        if found is not None:
+            return found
+
+        with self._lock:
+            found = self.lookup(key)
+            if found is not None:
+                return found
+            print(f"  Encoding closing segment {segment.name} ({segment.duration:.1f}s)")
+            video_path, still_path = self.paths(key)
+            suffix = f'{os.getpid()}.{threading.get_ident()}.tmp'
+            tmp_video, tmp_still = f'{video_path}.{suffix}.mp4', f'{still_path}.{suffix}'
+            frame_count = int(round(segment.duration * plan.fps))
+            clip = renderer.segment_clip(segment, with_audio=False)
+            try:
+                chunk = Chunk(0, frame_count, plan.fps, lambda: clip, name=segment.name)
+                still = np.asarray(clip.get_frame(0)).astype('uint8')
+                Image.fromarray(still).save(tmp_still, 'PNG')
+                segment_renderer.encode_chunk(chunk, tmp_video)
+                # The still goes first: a video without its still is not used
+                os.replace(tmp_still, still_path)
+                os.replace(tmp_video, video_path)
+            finally:
+                clip.close()
+                for path in (tmp_video, tmp_still):
+                    if os.path.exists(path):
+                        os.remove(path)
+            return video_path, still_path
+
+    def chunk(self, language: str, plan, segment, renderer, segment_renderer) -> Chunk:
+        """
+        The closing segment of a plan as a pre-encoded chunk.
+
+        Args:
+            language: Language code of the closing voiceover
+            plan: TimelinePlan ending with `segment`
+            segment: The planned closing Segment
+            renderer: TimelineRenderer of the plan
+            segment_renderer: SegmentRenderer with the ad's encoding
+
+        Returns:
+            Chunk whose encoded file is appended as-is
+        """
+        key = closing_key(language, segment, plan.size, plan.fps, segment_renderer.encoding())
+        video_path, still_path = self.prepare(key, plan, segment, renderer, segment_renderer)
+        first_frame = int(round(segment.start * plan.fps))
+        frame_count = int(round(segment.duration * plan.fps))
+        return Chunk(
+            first_frame, frame_count, plan.fps,
+            lambda: renderer.segment_clip(segment, with_audio=False),
+            name=f'{segment.name} (closing)',
+            encoded_path=video_path,
+            still=lambda: _load_still(still_path)
+        )
@@ -0,0 +1,184 @@
+"""
+Static-layer flattening compositor.
+Drop-in replacement for CompositeVideoClip that pre-renders layers which
+never change (gradients, phone mockups, Play Store screens) once and only
+composites the animated layers per frame.
+"""
+
+import numpy as np
+from moviepy.video.VideoClip import ImageClip
+from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+
+# Position functions created by moviepy for constant positions
+_CONSTANT_POSITIONS = (
+    'VideoClip.__init__.<locals>.<lambda>',
+    'VideoClip.set_position.<locals>.<lambda>',
+)
+
+
+def is_static_layer(clip, duration=None) -> bool:
+    """
+    Check whether a clip renders the same pixels at the same place for its
+    whole lifetime in a composition.
+
+    Args:
+        clip: Layer of a composition
+        duration: Duration of the composition (None if unknown)
+
+    Returns:
+        True if the layer is time-invariant
+    """
+    # ImageClip.fl() downgrades the class to VideoClip, so any animated
+    # effect (fades, rotation, time-dependent resize) fails this check
+    if not isinstance(clip, ImageClip):
+        return False
+    if clip.mask is not None and not isinstance(clip.mask, ImageClip):
+        return False
+    if getattr(clip.pos, '__qualname__', None) not in _CONSTANT_POSITIONS:
+        return False
+
+    # Must be on screen for the whole composition
+    if clip.start != 0:
+        return False
+    if clip.end is not None and (duration is None or clip.end < duration):
+        return False
+    return True
+
+
+class StaticLayer:
+    """A contiguous run of static layers pre-flattened into one image."""
+
+    def __init__(self, clips, size, backdrop=None):
+        """
+        Flatten the clips (bottom to top) over a transparent canvas.
+
+        Args:
+            clips: Static clips in stacking order
+            size: (width, height) of the canvas
+            backdrop: Composite background clip; it is blended like any
+                other layer but does not count towards `covers_canvas`
+        """
+        width, height = size
+        color = np.zeros((height, width, 3), dtype=float)
+        transmission = np.ones((height, width), dtype=float)
+        uncovered = np.ones((height, width), dtype=float)
+
+        for clip in clips:
+            # blit_on over black gives premultiplied color
+            color = clip.blit_on(color, 0)
+            alpha = self._layer_alpha(clip, (height, width))
+            transmission *= 1.0 - alpha
+            if clip is not backdrop:
+                uncovered *= 1.0 - alpha
+
+        self.clips = clips
+        self.opaque = bool((transmission <= 0).all())
+        self.covers_canvas = bool((uncovered <= 0).all())
+
+        # Restrict per-frame work to the area actually covered
+        covered = transmission < 1.0
+        if covered.any():
+            rows = np.flatnonzero(covered.any(axis=1))
+            cols = np.flatnonzero(covered.any(axis=0))
+            self.box = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        else:
+            self.box = None
+
+        self.color = np.clip(np.rint(color), 0, 255).astype(np.uint8)
+        # Transmission in 1/256 steps for integer blending
+        self.transmission = np.rint(transmission * 256).astype(np.uint16)
+
+    @staticmethod
+    def _layer_alpha(clip, shape):
+        """Alpha coverage of a clip on the canvas."""
+        if clip.ismask:
+            return np.zeros(shape)
+        mask = clip.mask if clip.mask is not None else clip.add_mask().mask
+        mask = mask.set_position(clip.pos, relative=clip.relative_pos)
+        return mask.blit_on(np.zeros(shape), 0)
+
+    def blit_on(self, frame):
+        """
+        Composite the flattened run over a frame.
+
+        Args:
+            frame: Frame below this run (H x W x 3)
+
+        Returns:
+            New frame as uint8 array
+        """
+        frame = np.asarray(frame)
+        if self.box is None:
+            return frame
+        if self.opaque:
+            return self.color
+
+        y1, y2, x1, x2 = self.box
+        out = frame.astype(np.uint8, copy=True)
+        region = out[y1:y2, x1:x2].astype(np.uint16)
+        trans = self.transmission[y1:y2, x1:x2, None]
+        region = ((region * trans) >> 8) + self.color[y1:y2, x1:x2]
+        out[y1:y2, x1:x2] = np.minimum(region, 255)
+        return out
+
+
+class FlattenedCompositeClip(CompositeVideoClip):
+    """
+    CompositeVideoClip that flattens contiguous runs of static layers into
+    cached images and only blits animated layers per frame.
+
+    Same arguments as CompositeVideoClip. A composition made only of static
+    layers returns one cached frame for its whole duration.
+    """
+
+    def __init__(self, clips, size=None, bg_color=None, use_bgclip=False,
+                 ismask=False):
+        CompositeVideoClip.__init__(self, clips, size=size, bg_color=bg_color,
+                                    use_bgclip=use_bgclip, ismask=ismask)
+        if ismask:
+            # Masks keep moviepy's additive blending
+            return
+
+        duration = self.duration
+        layers = [self.bg] + list(self.clips)
+
+        # Group layers into static runs and animated layers
+        self.layers = []
+        run = []
+        for clip in layers:
+            if is_static_layer(clip, duration):
+                run.append(clip)
+                continue
+            if run:
+                self.layers.append(StaticLayer(run, self.size, self.bg))
+                run = []
+            self.layers.append(clip)
+        if run:
+            self.layers.append(StaticLayer(run, self.size, self.bg))
+
+        self.static_count = sum(len(layer.clips) for layer in self.layers
+                                if isinstance(layer, StaticLayer))
+
+        # A static base covering the canvas makes the composite opaque
+        first = self.layers[0]
+        if isinstance(first, StaticLayer) and first.covers_canvas:
+            self.mask = None
+
+        if all(isinstance(layer, StaticLayer) for layer in self.layers):
+            frame = self._compose(np.zeros((self.h, self.w, 3), np.uint8), 0)
+            self.is_static = True
+            self.make_frame = lambda t: frame
+        else:
+            width, height = self.size
+            empty = np.zeros((height, width, 3), np.uint8)
+            self.is_static = False
+            self.make_frame = lambda t: self._compose(empty, t)
+
+    def _compose(self, frame, t):
+        """Blit every layer playing at time `t` over `frame`."""
+        for layer in self.layers:
+            if isinstance(layer, StaticLayer):
+                frame = layer.blit_on(frame)
+            elif layer.is_playing(t):
+                frame = layer.blit_on(frame, t)
+        return frame
@@ -0,0 +1,617 @@
+"""
+Segment renderer for the final ad.
+Encodes each scene (or each cached chunk of a scene) as its own silent
+video and joins them, with any pre-encoded chunks, by stream copy,
+encoding the in-memory audio mix over the whole video in the same pass.
+Fully static scenes skip per-frame compositing: their single frame is
+looped by ffmpeg, so their cost does not depend on their duration.
+Preview images are sampled from the composed frames on their way to
+ffmpeg.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from PIL import Image
+from moviepy.config import get_setting
+
+from jobs import tracing
+from render.streaming import aac_frame_range, aac_frame_time, split_adts
+
+
+class RenderAborted(Exception):
+    """The render was stopped through its abort event."""
+
+
+@dataclass
+class RenderOutput:
+    """One output format of a render: its chunks, path and previews."""
+
+    chunks: List
+    output_path: str
+    previews: object = None
+    # HlsPlaylist the chunks are also published to as they are encoded
+    stream: object = None
+    # FrameProfiler timing the layers of the chunks this render composes
+    profiler: object = None
+
+
+class SegmentRenderer:
+    """Renders a sequence of scene clips into one MP4."""
+
+    def __init__(self, fps: int = 30, codec: str = 'libx264',
+                 audio_codec: str = 'aac', audio_fps: int = 44100,
+                 preset: str = 'medium', temp_dir: str = None, memory=None):
+        """
+        Initialize the renderer.
+
+        Args:
+            fps: Output frame rate
+            codec: Video codec (all segments must share it for stream copy)
+            audio_codec: Audio codec
+            audio_fps: Audio sample rate
+            preset: Encoder preset
+            temp_dir: Directory for intermediate segment files
+            memory: MemoryMonitor of the job (see jobs/memory.py), checked
+                before every composed frame, or None
+        """
+        self.fps = fps
+        self.codec = codec
+        self.audio_codec = audio_codec
+        self.audio_fps = audio_fps
+        self.preset = preset
+        self.temp_dir = temp_dir
+        self.memory = memory
+
+    def encoding(self) -> dict:
+        """Settings that must match for encoded chunks to be spliced."""
+        return {
+            'codec': self.codec,
+            'preset': self.preset,
+            'pix_fmt': 'yuv420p',
+            'fps': self.fps,
+        }
+
+    def render(self, clips: List, output_path: str, audio: np.ndarray = None,
+               previews=None, cache=None, abort: threading.Event = None) -> str:
+        """
+        Render clips back to back into `output_path`.
+
+        Args:
+            clips: Scene clips or Chunks (see render/segment_cache.py) in
+                playback order
+            output_path: Final MP4 path
+            audio: int16 PCM (samples, channels) at `audio_fps` for the
+                whole video, or None for a silent video
+            previews: PreviewCollector offered every frame, or None
+            cache: SegmentCache reused for chunks with a key, or None
+            abort: Event checked before each chunk and before the final
+                mux; once set, RenderAborted is raised
+
+        Returns:
+            Path to the rendered video
+        """
+        from render.segment_cache import Chunk
+
+        chunks = []
+        first_frame = 0
+        for i, clip in enumerate(clips):
+            if not isinstance(clip, Chunk):
+                clip = Chunk.of_clip(clip, first_frame, self.fps, name=f'segment {i + 1}')
+            chunks.append(clip)
+            first_frame = clip.last_frame
+
+        output = RenderOutput(chunks, output_path, previews)
+        return self.render_outputs([output], audio, cache, abort)[0]
+
+    def render_outputs(self, outputs: List[RenderOutput], audio: np.ndarray = None,
+                       cache=None, abort: threading.Event = None) -> List[str]:
+        """
+        Render several formats of one timeline in one pass.
+
+        The outputs' chunks cover the same frame ranges (formats share the
+        plan's timing). The i-th chunks of all outputs are encoded together:
+        their frames are composed in lockstep and fed to one ffmpeg per
+        format, so the encoders run side by side. The audio mix is encoded
+        into every output. Outputs with a stream get an HLS segment per
+        chunk as soon as the chunk is encoded; outputs with a profiler get
+        the clip trees of the chunks they compose instrumented.
+
+        Args:
+            outputs: One RenderOutput per format
+            audio: Shared audio mix (see render)
+            cache: SegmentCache reused for chunks with a key, or None
+            abort: Event checked before each chunk and before each mux
+
+        Returns:
+            Paths of the rendered videos, in the order of `outputs`
+        """
+        if len({len(output.chunks) for output in outputs}) != 1:
+            raise ValueError("Outputs must be cut into the same chunks")
+
+        if self.temp_dir:
+            os.makedirs(self.temp_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='segments_', dir=self.temp_dir)
+
+        try:
+            stream_audio = None
+            if audio is not None and any(output.stream is not None for output in outputs):
+                stream_audio = self._encode_stream_audio(
+                    audio, outputs[0].chunks[-1].last_frame, work_dir
+                )
+            chunk_paths = [[] for _ in outputs]
+            reused = 0
+            chunk_count = len(outputs[0].chunks)
+            for i in range(chunk_count):
+                last = i == chunk_count - 1
+                self._check_abort(abort)
+                self._check_memory()
+                pending = []
+                for k, output in enumerate(outputs):
+                    chunk = output.chunks[i]
+                    path = self._reuse(chunk, cache, output.previews)
+                    if path is not None:
+                        chunk_paths[k].append(path)
+                        reused += 1
+                        if output.stream is not None:
+                            self._stream_segment(output.stream, path, chunk, stream_audio,
+                                                 work_dir, last)
+                    else:
+                        path = os.path.join(work_dir, f'chunk_{k}_{i:03d}.mp4')
+                        pending.append((k, chunk, path))
+                        if output.profiler is not None:
+                            output.profiler.instrument(chunk.clip(), chunk.name)
+
+                if pending:
+                    with tracing.span(f'chunk {pending[0][1].name}',
+                                      formats=len(pending), frames=pending[0][1].frame_count):
+                        self.encode_chunks([(chunk, path, outputs[k].previews)
+                                            for k, chunk, path in pending])
+                for k, chunk, path in pending:
+                    if cache is not None and chunk.key:
+                        path = cache.put(chunk.key, path)
+                    chunk_paths[k].append(path)
+                    if outputs[k].stream is not None:
+                        self._stream_segment(outputs[k].stream, path, chunk, stream_audio,
+                                             work_dir, last)
+
+            for output in outputs:
+                if output.stream is not None:
+                    output.stream.finish()
+
+            if reused:
+                total = sum(len(output.chunks) for output in outputs)
+                print(f"  Reused {reused} of {total} chunks")
+            for output, paths in zip(outputs, chunk_paths):
+                self._check_abort(abort)
+                with tracing.span('mux', path=output.output_path):
+                    self._mux(paths, audio, output.output_path, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return [output.output_path for output in outputs]
+
+    def _reuse(self, chunk, cache, previews) -> str:
+        """Path of an already encoded chunk (pre-encoded or cached), or None."""
+        if chunk.encoded_path is not None:
+            print(f"  Chunk {chunk.name}: pre-encoded ({chunk.duration:.1f}s), appended")
+            path = chunk.encoded_path
+        else:
+            path = cache.get(chunk.key) if cache is not None and chunk.key else None
+            if path is None:
+                return None
+            print(f"  Chunk {chunk.name}: unchanged ({chunk.duration:.1f}s), reused")
+        if previews is not None:
+            self._sample_previews(chunk, previews)
+        return path
+
+    def encode_chunks(self, items: List):
+        """
+        Encode chunks covering the same frames (one per format).
+
+        Static chunks are encoded from their still one after the other;
+        animated ones are composed in lockstep, unless the job is in its
+        low-memory mode (one composition and encoder at a time).
+
+        Args:
+            items: (chunk, path, previews) tuples
+        """
+        animated = []
+        for chunk, path, previews in items:
+            clip = chunk.clip()
+            if (len(items) == 1 or getattr(clip, 'is_static', False)
+                    or (self.memory is not None and self.memory.low_memory)):
+                self.encode_chunk(chunk, path, previews)
+            else:
+                animated.append((clip, chunk, path, previews))
+        if len(animated) == 1:
+            clip, chunk, path, previews = animated[0]
+            print(f"  Chunk {chunk.name}: animated ({chunk.duration:.1f}s)")
+            self._render_animated(clip, chunk, path, previews)
+        elif animated:
+            names = ', '.join(chunk.name for _, chunk, _, _ in animated)
+            print(f"  Chunks {names}: animated ({animated[0][1].duration:.1f}s), in lockstep")
+            self._render_lockstep(animated)
+
+    def encode_chunk(self, chunk, path: str, previews=None):
+        """
+        Encode one chunk as a silent video that splices with the others.
+
+        Args:
+            chunk: Chunk to compose and encode
+            path: Output MP4 path
+            previews: PreviewCollector offered its frames, or None
+        """
+        clip = chunk.clip()
+        if getattr(clip, 'is_static', False):
+            print(f"  Chunk {chunk.name}: static ({chunk.duration:.1f}s), looping one frame")
+            self._render_static(clip, chunk, path, previews)
+        else:
+            print(f"  Chunk {chunk.name}: animated ({chunk.duration:.1f}s)")
+            self._render_animated(clip, chunk, path, previews)
+
+    @staticmethod
+    def _check_abort(abort: threading.Event):
+        if abort is not None and abort.is_set():
+            raise RenderAborted("Render aborted")
+
+    def _check_memory(self):
+        if self.memory is not None:
+            self.memory.check()
+
+    def _guard(self, frames):
+        """Pass frames through, stopping once the job is over its memory budget."""
+        for frame in frames:
+            self._check_memory()
+            yield frame
+
+    def _video_params(self) -> List[str]:
+        """Encoder arguments shared by every chunk."""
+        return [
+            '-vcodec', self.codec,
+            '-preset', self.preset,
+            '-pix_fmt', 'yuv420p',
+            '-r', str(self.fps),
+            # Closed GOPs: every chunk decodes on its own after a splice
+            '-flags', '+cgop',
+        ]
+
+    def _audio_params(self) -> List[str]:
+        return ['-acodec', self.audio_codec, '-ar', str(self.audio_fps)]
+
+    def _raw_input(self, clip) -> List[str]:
+        """ffmpeg input options for raw frames of `clip` on stdin."""
+        width, height = clip.size
+        return [
+            '-f', 'rawvideo', '-vcodec', 'rawvideo',
+            '-s', '%dx%d' % (width, height), '-pix_fmt', 'rgb24',
+            '-r', str(self.fps), '-i', '-',
+        ]
+
+    def _render_animated(self, clip, chunk, path: str, previews=None):
+        """Compose every frame of an animated clip and pipe it to ffmpeg."""
+        frames = self._guard(clip.iter_frames(fps=self.fps, dtype='uint8', logger='bar'))
+        if previews is not None:
+            frames = self._tap(frames, previews, chunk.first_frame)
+        self._encode(self._raw_input(clip), frames, chunk.frame_count, path)
+
+    def _render_lockstep(self, items: List):
+        """
+        Compose animated clips one frame of each in turn, each piped to its
+        own ffmpeg.
+
+        Args:
+            items: (clip, chunk, path, previews) tuples
+        """
+        encoders = []
+        try:
+            for n, (clip, chunk, path, previews) in enumerate(items):
+                frames = self._guard(clip.iter_frames(fps=self.fps, dtype='uint8',
+                                                      logger='bar' if n == 0 else None))
+                if previews is not None:
+                    frames = self._tap(frames, previews, chunk.first_frame)
+                proc, cmd = self._start_encoder(self._raw_input(clip), chunk.frame_count, path,
+                                                pipe_frames=True)
+                encoders.append((proc, cmd, frames))
+
+            active = list(encoders)
+            while active:
+                for encoder in list(active):
+                    proc, _, frames = encoder
+                    frame = next(frames, None)
+                    try:
+                        if frame is None:
+                            proc.stdin.close()
+                        else:
+                            proc.stdin.write(np.ascontiguousarray(frame).tobytes())
+                            continue
+                    except (BrokenPipeError, OSError):
+                        # ffmpeg exited early (or has all its frames); stderr explains
+                        pass
+                    active.remove(encoder)
+        except BaseException:
+            for proc, _, _ in encoders:
+                self._abort(proc)
+            raise
+        for proc, cmd, _ in encoders:
+            self._finish_encoder(proc, cmd)
+
+    @staticmethod
+    def _tap(frames, previews, first_frame: int):
+        """Pass frames through, offering each to the preview collector."""
+        for i, frame in enumerate(frames):
+            previews.frame(first_frame + i, frame)
+            yield frame
+
+    def _render_static(self, clip, chunk, path: str, previews=None):
+        """Encode a static clip from a single looped still frame."""
+        still_path = f'{path}.png'
+        frame = np.asarray(clip.get_frame(0)).astype('uint8')
+        Image.fromarray(frame).save(still_path)
+        if previews is not None:
+            previews.still(chunk.first_frame, chunk.last_frame, frame)
+
+        video_input = ['-loop', '1', '-framerate', str(self.fps), '-i', still_path]
+        try:
+            self._encode(video_input, None, chunk.frame_count, path)
+        finally:
+            os.remove(still_path)
+
+    def _sample_previews(self, chunk, previews):
+        """Compose just the preview frames of a chunk that was not rendered."""
+        indices = previews.wanted(chunk.first_frame, chunk.last_frame)
+        if not indices:
+            return
+        if chunk.still is not None:
+            previews.still(chunk.first_frame, chunk.last_frame, chunk.still())
+            return
+        clip = chunk.clip()
+        if getattr(clip, 'is_static', False):
+            previews.still(chunk.first_frame, chunk.last_frame, clip.get_frame(0))
+            return
+        for index in indices:
+            previews.frame(index, clip.get_frame((index - chunk.first_frame) / self.fps))
+
+    def _encode(self, video_input: List[str], frames, frame_count: int, path: str):
+        """
+        Run one ffmpeg process encoding a silent chunk.
+
+        Raw frames (if any) go to stdin.
+        """
+        proc, cmd = self._start_encoder(video_input, frame_count, path,
+                                        pipe_frames=frames is not None)
+        try:
+            if frames is not None:
+                for frame in frames:
+                    proc.stdin.write(np.ascontiguousarray(frame).tobytes())
+                proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            # ffmpeg exited early (or has all its frames); stderr explains
+            pass
+        except BaseException:
+            # The frames failed: ffmpeg would wait on stdin forever
+            self._abort(proc)
+            raise
+        self._finish_encoder(proc, cmd)
+
+    def _start_encoder(self, video_input: List[str], frame_count: int, path: str,
+                       pipe_frames: bool):
+        """Start ffmpeg encoding a silent chunk; returns (process, command)."""
+        cmd = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error']
+        cmd.extend(video_input)
+        cmd.extend(self._video_params())
+        cmd.extend(['-an', '-frames:v', str(frame_count), path])
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if pipe_frames else subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        tracing.process_started(proc.pid, 'ffmpeg encode', path=path, frames=frame_count)
+        return proc, cmd
+
+    @staticmethod
+    def _finish_encoder(proc: subprocess.Popen, cmd: List[str]):
+        """Wait for an encoder, raising with its stderr on failure."""
+        stderr = proc.stderr.read()
+        proc.wait()
+        tracing.process_exited(proc.pid, proc.returncode)
+        if proc.returncode != 0:
+            raise IOError(
+                "ffmpeg failed: %s\n%s" % (' '.join(cmd), stderr.decode(errors='replace'))
+            )
+
+    @staticmethod
+    def _abort(proc: subprocess.Popen):
+        """Stop an ffmpeg process whose input failed."""
+        proc.kill()
+        for pipe in (proc.stdin, proc.stderr):
+            if pipe is not None:
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+        proc.wait()
+        tracing.process_exited(proc.pid, proc.returncode)
+
+    @staticmethod
+    def _write_pcm(fd: int, audio: np.ndarray, errors: List[BaseException]):
+        try:
+            with os.fdopen(fd, 'wb') as pipe:
+                pipe.write(audio.tobytes())
+        except (BrokenPipeError, OSError):
+            # ffmpeg exited early; its stderr explains
+            pass
+        except BaseException as e:
+            errors.append(e)
+
+    def _mux(self, chunk_paths: List[str], audio, output_path: str, work_dir: str):
+        """
+        Join the encoded chunks by stream copy and encode the audio over them.
+
+        On POSIX the PCM goes through an extra pipe fed by a writer thread;
+        elsewhere it is written to a WAV file first.
+        """
+        list_path = os.path.join(work_dir, 'chunks.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in chunk_paths:
+                f.write("file '%s'\n" % os.path.abspath(path).replace("'", "'\\''"))
+
+        cmd = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio is None:
+            self._run(cmd + ['-c', 'copy', '-movflags', '+faststart', output_path])
+            return
+
+        pass_fds = ()
+        read_fd = write_fd = None
+        channels = audio.shape[1]
+        if os.name == 'posix':
+            read_fd, write_fd = os.pipe()
+            pass_fds = (read_fd,)
+            cmd.extend([
+                '-f', 's16le', '-ar', str(self.audio_fps), '-ac', str(channels),
+                '-i', f'pipe:{read_fd}'
+            ])
+        else:
+            wav_path = os.path.join(work_dir, 'audio.wav')
+            self._write_wav(wav_path, audio)
+            cmd.extend(['-i', wav_path])
+        cmd.extend(['-map', '0:v', '-map', '1:a', '-c:v', 'copy'])
+        cmd.extend(self._audio_params())
+        cmd.extend(['-movflags', '+faststart', output_path])
+
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, pass_fds=pass_fds
+        )
+        tracing.process_started(proc.pid, 'ffmpeg mux', path=output_path)
+        writer = None
+        writer_errors = []
+        try:
+            if read_fd is not None:
+                os.close(read_fd)
+                writer = threading.Thread(
+                    target=tracing.bind(self._write_pcm, 'write PCM'),
+                    args=(write_fd, audio, writer_errors), name='pcm-writer', daemon=True
+                )
+                writer.start()
+            stderr = proc.stderr.read()
+            proc.wait()
+            tracing.process_exited(proc.pid, proc.returncode)
+        except BaseException:
+            self._abort(proc)
+            raise
+        finally:
+            if writer is not None:
+                writer.join()
+            elif write_fd is not None:
+                os.close(write_fd)
+
+        if writer_errors:
+            # The audio is incomplete even if ffmpeg was content with it
+            raise writer_errors[0]
+        if proc.returncode != 0:
+            raise IOError(
+                "ffmpeg failed: %s\n%s" % (' '.join(cmd), stderr.decode(errors='replace'))
+            )
+
+    def _encode_stream_audio(self, audio: np.ndarray, frame_count: int,
+                             work_dir: str) -> List[bytes]:
+        """
+        Encode the audio mix once for the HLS segments.
+
+        Args:
+            audio: Audio mix, padded with silence to the video's duration
+            frame_count: Video frames of the render
+            work_dir: Directory for the intermediate files
+
+        Returns:
+            AAC frames of the mix (ADTS)
+        """
+        samples = int(round(frame_count / self.fps * self.audio_fps))
+        if len(audio) < samples:
+            silence = np.zeros((samples - len(audio), audio.shape[1]), audio.dtype)
+            audio = np.concatenate([audio, silence])
+        wav_path = os.path.join(work_dir, 'stream_audio.wav')
+        aac_path = os.path.join(work_dir, 'stream_audio.aac')
+        self._write_wav(wav_path, audio)
+        with tracing.span('encode stream audio'):
+            self._run([get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error', '-i', wav_path]
+                      + self._audio_params() + ['-f', 'adts', aac_path])
+        with open(aac_path, 'rb') as f:
+            return split_adts(f.read())
+
+    def _stream_segment(self, stream, path: str, chunk, audio_frames, work_dir: str,
+                        last: bool = False):
+        """
+        Remux an encoded chunk into the next segment of an HLS stream.
+
+        The video is copied, and so are the AAC frames of the mix that start
+        within the chunk (see render.streaming.aac_frame_range), so the audio
+        of consecutive segments meets exactly. Timestamps are offset to the
+        chunk's place in the ad.
+
+        Args:
+            audio_frames: AAC frames of the whole mix (_encode_stream_audio),
+                or None for a silent stream
+            last: The chunk is the ad's last (it takes the remaining frames)
+        """
+        start = chunk.first_frame / self.fps
+        duration = chunk.frame_count / self.fps
+        segment_path = stream.next_segment_path()
+        tmp_path = f'{segment_path}.tmp'
+
+        cmd = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error', '-i', path]
+        if audio_frames:
+            first, stop = aac_frame_range(
+                int(round(start * self.audio_fps)),
+                None if last else int(round((start + duration) * self.audio_fps)),
+                len(audio_frames),
+            )
+            if first < stop:
+                aac_path = os.path.join(work_dir, 'stream_segment.aac')
+                with open(aac_path, 'wb') as f:
+                    f.write(b''.join(audio_frames[first:stop]))
+                # Place the frames at their time in the mix, relative to the chunk
+                offset = aac_frame_time(first, self.audio_fps) - start
+                cmd.extend(['-itsoffset', '%.6f' % offset, '-i', aac_path,
+                            '-map', '0:v', '-map', '1:a', '-c:a', 'copy'])
+        # Every segment is shifted by the same second, so the reordered
+        # B-frames of the first one (and its priming frame) never need
+        # negative timestamps (which ffmpeg would fix by shifting that
+        # segment alone)
+        cmd.extend(['-c:v', 'copy', '-output_ts_offset', '%.6f' % (start + 1.0),
+                    '-muxdelay', '0', '-f', 'mpegts', tmp_path])
+        try:
+            with tracing.span('stream segment', path=segment_path):
+                self._run(cmd)
+            os.replace(tmp_path, segment_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        stream.add(segment_path, duration)
+
+    def _write_wav(self, path: str, audio: np.ndarray):
+        """Write 16-bit PCM samples to a WAV file."""
+        with wave.open(path, 'wb') as wav:
+            wav.setnchannels(audio.shape[1])
+            wav.setsampwidth(2)
+            wav.setframerate(self.audio_fps)
+            wav.writeframes(np.ascontiguousarray(audio).tobytes())
+
+    @staticmethod
+    def _run(cmd: List[str]):
+        """Run an ffmpeg command, raising with its stderr on failure."""
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise IOError(
+                "ffmpeg failed: %s\n%s" % (' '.join(cmd), proc.stderr.decode(errors='replace'))
+            )
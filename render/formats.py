@@ -0,0 +1,84 @@
+"""
+Output formats of the ad.
+One request can produce the ad in several aspect ratios. Scripts,
+voiceovers, the audio mix and the decoded wallpapers are shared; each
+format only gets its own layout, composition and encode. A format's layout
+rules size the phone (whose screen shows the wallpapers) from the frame
+height, so the phone keeps its proportions in every aspect and only the
+background around it changes. Formats with the same frame height share
+the pre-scaled wallpaper frames.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+# Phone screen of the 9:16 layout the scenes were designed for
+BASE_SCREEN_SIZE = (720, 1280)
+
+
+def _even(value: float) -> int:
+    return max(2, int(round(value / 2)) * 2)
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """An aspect ratio and its layout rules."""
+
+    name: str
+    size: Tuple[int, int]
+    # Phone screen height as a fraction of the frame height
+    screen_height: float = 2 / 3
+    # Added to output file names ('' for the primary format)
+    suffix: str = ''
+
+    @property
+    def megapixels(self) -> float:
+        return self.size[0] * self.size[1] / 1e6
+
+    @property
+    def scale(self) -> float:
+        """Size of the phone relative to the 9:16 layout."""
+        return self.screen_size[1] / BASE_SCREEN_SIZE[1]
+
+    @property
+    def screen_size(self) -> Tuple[int, int]:
+        """Phone screen (wallpaper) size."""
+        base_width, base_height = BASE_SCREEN_SIZE
+        height = _even(self.size[1] * self.screen_height)
+        return _even(height * base_width / base_height), height
+
+    def scaled(self, size: Tuple[int, int]):
+        """
+        A size of the 9:16 layout in this format.
+
+        Returns:
+            The scaled size, or None if the layout is not scaled (the
+            source is used at its own size)
+        """
+        if self.scale == 1.0:
+            return None
+        return _even(size[0] * self.scale), _even(size[1] * self.scale)
+
+
+FORMATS: Dict[str, OutputFormat] = {
+    '9:16': OutputFormat('9:16', (1080, 1920)),
+    '1:1': OutputFormat('1:1', (1080, 1080), suffix='1x1'),
+    '16:9': OutputFormat('16:9', (1920, 1080), suffix='16x9'),
+}
+DEFAULT_FORMAT = '9:16'
+
+
+def get_formats(names: List[str] = None) -> List[OutputFormat]:
+    """
+    Formats by name, in the order given (the first is the primary one).
+
+    Raises:
+        ValueError: For an unknown name
+    """
+    formats = []
+    for name in names or [DEFAULT_FORMAT]:
+        if name not in FORMATS:
+            raise ValueError(f"Unknown output format: {name}")
+        if FORMATS[name] not in formats:
+            formats.append(FORMATS[name])
+    return formats
@@ -0,0 +1,187 @@
+"""
+Ken Burns pan and zoom for still wallpapers.
+Each wallpaper is decoded once into a mip-mapped pyramid (the image and
+its successive halvings, reduced in C by Pillow). A frame is the
+wallpaper's moving viewport resampled from the smallest level that still
+has at least the output's resolution, so the resample reads at most about
+four source pixels per output pixel however large the upload is.
+Animating with moviepy's resize(lambda t: ...) would resample the full
+source on every frame instead.
+
+Pyramids are kept in a small process-wide LRU, so the formats of one ad
+(rendered in lockstep) share them.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+from moviepy.video.VideoClip import VideoClip
+
+# Pyramids kept for reuse (a few wallpaper slots of every format)
+PYRAMID_CACHE_SIZE = 4
+
+# Motions cycled through the wallpapers of a scene: zoom factor at the
+# start and end, and the viewport center at the start and end (as a
+# fraction of the room left around the viewport, 0.5 = centered)
+MOTIONS: Tuple[Dict, ...] = (
+    {'zoom': (1.0, 1.15), 'focus': ((0.5, 0.5), (0.5, 0.35))},
+    {'zoom': (1.15, 1.0), 'focus': ((0.3, 0.5), (0.7, 0.5))},
+    {'zoom': (1.0, 1.15), 'focus': ((0.5, 0.5), (0.65, 0.65))},
+    {'zoom': (1.15, 1.0), 'focus': ((0.7, 0.4), (0.3, 0.6))},
+)
+
+
+class ImagePyramid:
+    """An image and its successive halvings."""
+
+    def __init__(self, image: Image.Image, min_size: Tuple[int, int] = (16, 16)):
+        """
+        Args:
+            image: Source image (RGB or RGBA)
+            min_size: Stop halving below this size
+        """
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        self.levels: List[Image.Image] = [image]
+        while (image.width // 2 >= min_size[0] and image.height // 2 >= min_size[1]):
+            image = image.reduce(2)
+            self.levels.append(image)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.levels[0].size
+
+    @property
+    def has_alpha(self) -> bool:
+        return self.levels[0].mode == 'RGBA'
+
+    def sample(self, box: Tuple[float, float, float, float], size: Tuple[int, int]) -> np.ndarray:
+        """
+        Resample a region of the image.
+
+        Args:
+            box: (left, top, right, bottom) in level 0 pixels
+            size: Output (width, height)
+
+        Returns:
+            uint8 array (height, width, channels)
+        """
+        scale = (box[2] - box[0]) / size[0]
+        index = min(max(int(math.floor(math.log2(scale))), 0) if scale > 1 else 0,
+                    len(self.levels) - 1)
+        level = self.levels[index]
+        fx = level.width / self.levels[0].width
+        fy = level.height / self.levels[0].height
+        level_box = (box[0] * fx, box[1] * fy, box[2] * fx, box[3] * fy)
+        return np.asarray(level.resize(size, Image.BILINEAR, box=level_box))
+
+
+_pyramids: 'OrderedDict[str, ImagePyramid]' = OrderedDict()
+_pyramids_lock = threading.Lock()
+# Per-key locks, so formats prefetching the same wallpaper build it once
+_building: Dict[str, threading.Lock] = {}
+
+
+def get_pyramid(source: str, key: str) -> ImagePyramid:
+    """
+    Pyramid of an image source, built once and kept in a small LRU.
+
+    Args:
+        source: Image path or registered asset
+        key: Content fingerprint of the source
+    """
+    with _pyramids_lock:
+        build_lock = _building.setdefault(key, threading.Lock())
+
+    with build_lock:
+        with _pyramids_lock:
+            pyramid = _pyramids.get(key)
+            if pyramid is not None:
+                _pyramids.move_to_end(key)
+                return pyramid
+
+        from render.assets import load_image
+        pixels = load_image(source)
+        if isinstance(pixels, str):
+            with Image.open(pixels) as image:
+                image.load()
+                pyramid = ImagePyramid(image)
+        else:
+            pyramid = ImagePyramid(Image.fromarray(np.asarray(pixels)))
+
+        with _pyramids_lock:
+            _pyramids[key] = pyramid
+            while len(_pyramids) > PYRAMID_CACHE_SIZE:
+                evicted, _ = _pyramids.popitem(last=False)
+                _building.pop(evicted, None)
+        return pyramid
+
+
+def clear_pyramids():
+    """Drop the cached pyramids (clips still using one keep it alive)."""
+    with _pyramids_lock:
+        _pyramids.clear()
+        _building.clear()
+
+
+class KenBurnsClip(VideoClip):
+    """A still image panned and zoomed over time."""
+
+    def __init__(self, pyramid: ImagePyramid, size, duration: float,
+                 zoom=(1.0, 1.15), focus=((0.5, 0.5), (0.5, 0.5))):
+        """
+        Args:
+            pyramid: ImagePyramid of the image
+            size: Output (width, height)
+            duration: Duration of the motion
+            zoom: Zoom factor at the start and the end (1.0 shows the
+                largest region of the image with the output's aspect)
+            focus: Viewport center at the start and the end, as fractions
+                of the room left around the viewport
+        """
+        VideoClip.__init__(self, duration=duration)
+        self.pyramid = pyramid
+        self.size = tuple(size)
+        self.zoom = zoom
+        self.focus = focus
+
+        # Largest region of the image with the output's aspect
+        width, height = pyramid.size
+        aspect = self.size[0] / self.size[1]
+        if width / height > aspect:
+            self._cover = (height * aspect, height)
+        else:
+            self._cover = (width, width / aspect)
+
+        # The color and the mask of a frame are asked for one after the other
+        self._last = (None, None)
+        self.make_frame = lambda t: self._sample(t)[:, :, :3]
+        if pyramid.has_alpha:
+            self.mask = VideoClip(ismask=True, duration=duration)
+            self.mask.size = self.size
+            self.mask.make_frame = lambda t: self._sample(t)[:, :, 3] / 255.0
+
+    def box(self, t: float) -> Tuple[float, float, float, float]:
+        """Viewport at time `t`, in image pixels."""
+        progress = min(max(t / self.duration, 0.0), 1.0) if self.duration else 0.0
+        zoom = self.zoom[0] + (self.zoom[1] - self.zoom[0]) * progress
+        (x0, y0), (x1, y1) = self.focus
+        fx = x0 + (x1 - x0) * progress
+        fy = y0 + (y1 - y0) * progress
+
+        width, height = self.pyramid.size
+        view_w, view_h = self._cover[0] / zoom, self._cover[1] / zoom
+        left = (width - view_w) * fx
+        top = (height - view_h) * fy
+        return left, top, left + view_w, top + view_h
+
+    def _sample(self, t: float) -> np.ndarray:
+        last_t, frame = self._last
+        if last_t != t:
+            frame = self.pyramid.sample(self.box(t), self.size)
+            self._last = (t, frame)
+        return frame
@@ -0,0 +1,161 @@
+"""
+Lazily opened layer sources.
+Wallpapers only hold a decoded image or an ffmpeg reader while their time
+window is playing: each source is opened when its window starts (prefetched
+one slot ahead on a background thread) and released when it ends, so
+resource use stays flat however many wallpapers a scene has.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+from PIL import Image
+from moviepy.video.VideoClip import VideoClip
+
+from jobs import tracing
+
+
+def image_has_alpha(path: str) -> bool:
+    """Check an image's header for an alpha channel without decoding it."""
+    from render.assets import ASSET_SCHEME, get_asset_registry, is_asset
+    if is_asset(path):
+        return get_asset_registry().asset(path[len(ASSET_SCHEME):]).has_alpha
+    with Image.open(path) as img:
+        return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+
+class LazySource:
+    """A layer source opened on demand and released after its window."""
+
+    def __init__(self, name: str, opener: Callable, start: float, end: float):
+        """
+        Args:
+            name: Layer name (for logging)
+            opener: Callable returning (clip, readers_to_close)
+            start: Window start, in segment time
+            end: Window end, in segment time
+        """
+        self.name = name
+        self.start = start
+        self.end = end
+        self._opener = opener
+        self._clip = None
+        self._readers = []
+        self._future = None
+        self._open_hooks = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._clip is not None or self._future is not None
+
+    def prefetch(self, executor: ThreadPoolExecutor):
+        """Start opening the source in the background."""
+        with self._lock:
+            if self._clip is None and self._future is None:
+                self._future = executor.submit(
+                    tracing.bind(self._opener, f'open {self.name}', prefetch=True)
+                )
+
+    def add_open_hook(self, hook: Callable):
+        """Call `hook(clip)` on the clip each time the source is opened."""
+        with self._lock:
+            self._open_hooks.append(hook)
+            clip = self._clip
+        if clip is not None:
+            hook(clip)
+
+    def get(self):
+        """Return the opened clip, waiting for a pending prefetch."""
+        with self._lock:
+            if self._clip is None:
+                if self._future is not None:
+                    with tracing.span(f'wait for {self.name}'):
+                        self._clip, self._readers = self._future.result()
+                    self._future = None
+                else:
+                    with tracing.span(f'open {self.name}'):
+                        self._clip, self._readers = self._opener()
+                for hook in self._open_hooks:
+                    hook(self._clip)
+            return self._clip
+
+    def release(self):
+        """Close the source's readers and drop its decoded frames."""
+        with self._lock:
+            if self._future is not None:
+                self._clip, self._readers = self._future.result()
+                self._future = None
+            for reader in self._readers:
+                reader.close()
+            self._clip = None
+            self._readers = []
+
+
+class LazyClip(VideoClip):
+    """VideoClip proxy whose frames come from a LazySource."""
+
+    def __init__(self, source: LazySource, size, duration: float,
+                 ismask: bool = False):
+        VideoClip.__init__(self, ismask=ismask, duration=duration)
+        self.source = source
+        self.size = tuple(size)
+        if ismask:
+            self.make_frame = lambda t: self._mask_frame(t)
+        else:
+            self.make_frame = lambda t: source.get().get_frame(t)
+
+    def _mask_frame(self, t):
+        mask = self.source.get().mask
+        if mask is None:
+            return np.ones(self.size[::-1], dtype=float)
+        return mask.get_frame(t)
+
+
+class SourceScheduler:
+    """Opens, prefetches and releases the lazy sources of one segment."""
+
+    def __init__(self):
+        self.sources: List[LazySource] = []
+        self._executor = None
+
+    def add(self, source: LazySource):
+        self.sources.append(source)
+        self.sources.sort(key=lambda s: s.start)
+
+    def update(self, t: float):
+        """
+        Bring sources in line with segment time `t`.
+
+        Sources whose window has ended are released and the next source
+        to start is prefetched.
+        """
+        upcoming = None
+        for source in self.sources:
+            if source.end <= t:
+                if source.is_open:
+                    source.release()
+            elif source.start > t and upcoming is None:
+                upcoming = source
+
+        if upcoming is not None and not upcoming.is_open:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='prefetch'
+                )
+            upcoming.prefetch(self._executor)
+
+    def frame_filter(self, get_frame, t):
+        """moviepy `fl` filter running update() before each frame."""
+        self.update(t)
+        return get_frame(t)
+
+    def close(self):
+        """Release every source and stop the prefetch thread."""
+        for source in self.sources:
+            source.release()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,261 @@
+"""
+Media reader manager.
+Every ffmpeg decoder process (VideoFileClip, AudioFileClip, probes and
+pre-scaling decodes) takes a slot from a process-wide pool, so a
+long-running worker never runs more than a fixed number of them at once.
+Probe results are cached by content hash, and readers opened during a job
+are all closed when the job ends.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict
+
+from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.video.io.VideoFileClip import VideoFileClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from jobs import tracing
+from render.timeline import file_fingerprint
+
+# Seconds to wait for a free decoder slot before giving up
+SLOT_TIMEOUT = 300
+
+
+class ReaderLease:
+    """Decoder slots held by one reader; released exactly once."""
+
+    def __init__(self, manager: 'MediaReaderManager', slots: int, job: 'MediaJob' = None):
+        self.manager = manager
+        self.slots = slots
+        self.job = job
+        self.reader = None
+        # ffmpeg process traced from open to close
+        self.pid = None
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        if self.pid is not None:
+            tracing.process_exited(self.pid)
+        if self.job is not None:
+            self.job.forget(self.reader)
+        self.manager.release_slots(self.slots)
+
+
+class ManagedVideoFileClip(VideoFileClip):
+    """VideoFileClip that gives its decoder slots back when closed."""
+
+    def __init__(self, filename, lease: ReaderLease, **kwargs):
+        self.lease = lease
+        VideoFileClip.__init__(self, filename, **kwargs)
+
+    def close(self):
+        VideoFileClip.close(self)
+        self.lease.release()
+
+
+class ManagedAudioFileClip(AudioFileClip):
+    """AudioFileClip that gives its decoder slot back when closed."""
+
+    def __init__(self, filename, lease: ReaderLease, **kwargs):
+        self.lease = lease
+        AudioFileClip.__init__(self, filename, **kwargs)
+
+    def close(self):
+        AudioFileClip.close(self)
+        self.lease.release()
+
+
+class MediaJob:
+    """Readers opened on behalf of one generation job."""
+
+    def __init__(self, manager: 'MediaReaderManager'):
+        self.manager = manager
+        self._readers = []
+        self._lock = threading.Lock()
+
+    def open_video(self, path: str, **kwargs) -> VideoFileClip:
+        return self.manager.open_video(path, job=self, **kwargs)
+
+    def open_audio(self, path: str, **kwargs) -> AudioFileClip:
+        return self.manager.open_audio(path, job=self, **kwargs)
+
+    def track(self, reader):
+        with self._lock:
+            self._readers.append(reader)
+
+    def forget(self, reader):
+        with self._lock:
+            if reader in self._readers:
+                self._readers.remove(reader)
+
+    @property
+    def open_readers(self) -> int:
+        return len(self._readers)
+
+    def close(self):
+        """Close every reader still open in this job."""
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for reader in readers:
+            reader.close()
+
+
+class MediaReaderManager:
+    """Caps concurrent ffmpeg decoders and caches probe results."""
+
+    def __init__(self, max_readers: int = 8, max_probe_entries: int = 1024):
+        """
+        Initialize the manager.
+
+        Args:
+            max_readers: Maximum concurrent ffmpeg decoder processes
+            max_probe_entries: Size of the probe metadata cache
+        """
+        self.max_readers = max_readers
+        self.max_probe_entries = max_probe_entries
+        self._slots = threading.BoundedSemaphore(max_readers)
+        self._probes = OrderedDict()
+        self._probe_lock = threading.Lock()
+        self._local = threading.local()
+
+    # Slots
+
+    def acquire_slots(self, count: int = 1):
+        """Block until `count` decoder slots are free, then take them."""
+        count = min(count, self.max_readers)
+        taken = 0
+        try:
+            for _ in range(count):
+                if not self._slots.acquire(blocking=False):
+                    with tracing.span('wait for reader slot', cat='wait'):
+                        if not self._slots.acquire(timeout=SLOT_TIMEOUT):
+                            raise RuntimeError(
+                                f"Timed out waiting for a media reader slot "
+                                f"({self.max_readers} in use)"
+                            )
+                taken += 1
+        except Exception:
+            self.release_slots(taken)
+            raise
+        return count
+
+    def release_slots(self, count: int = 1):
+        for _ in range(count):
+            self._slots.release()
+
+    @contextmanager
+    def slot(self):
+        """Hold one decoder slot for a short-lived ffmpeg process."""
+        self.acquire_slots(1)
+        try:
+            yield
+        finally:
+            self.release_slots(1)
+
+    # Jobs
+
+    @contextmanager
+    def job(self):
+        """
+        Scope readers to a job; everything still open is closed on exit.
+
+        The job is also the current job of this thread, so readers opened
+        without an explicit job are attributed to it.
+        """
+        job = MediaJob(self)
+        previous = getattr(self._local, 'job', None)
+        self._local.job = job
+        try:
+            yield job
+        finally:
+            self._local.job = previous
+            job.close()
+
+    def current_job(self) -> MediaJob:
+        return getattr(self._local, 'job', None)
+
+    # Readers
+
+    def open_video(self, path: str, job: MediaJob = None, **kwargs) -> VideoFileClip:
+        """Open a VideoFileClip holding one slot per ffmpeg process."""
+        slots = 2 if kwargs.get('audio', True) and self.probe(path)['audio_found'] else 1
+        return self._open(ManagedVideoFileClip, path, slots, job, kwargs)
+
+    def open_audio(self, path: str, job: MediaJob = None, **kwargs) -> AudioFileClip:
+        """Open an AudioFileClip holding one slot."""
+        return self._open(ManagedAudioFileClip, path, 1, job, kwargs)
+
+    def _open(self, cls, path, slots, job, kwargs):
+        job = job or self.current_job()
+        lease = ReaderLease(self, self.acquire_slots(slots), job)
+        try:
+            reader = cls(path, lease, **kwargs)
+        except Exception:
+            lease.release()
+            raise
+        lease.reader = reader
+        proc = getattr(getattr(reader, 'reader', None), 'proc', None)
+        if proc is not None:
+            lease.pid = proc.pid
+            tracing.process_started(proc.pid, 'ffmpeg reader', path=path)
+        if job is not None:
+            job.track(reader)
+        return reader
+
+    # Metadata
+
+    def probe(self, path: str) -> Dict:
+        """
+        Duration, fps, size and stream info of a media file.
+
+        Results are cached by content hash, so re-uploads of the same file
+        and the fixed voiceovers are only probed once per process.
+        """
+        key = file_fingerprint(path)
+        with self._probe_lock:
+            if key in self._probes:
+                self._probes.move_to_end(key)
+                return dict(self._probes[key])
+
+        with self.slot():
+            infos = ffmpeg_parse_infos(path)
+        result = {
+            'duration': infos.get('duration'),
+            'video_found': infos.get('video_found', False),
+            'video_fps': infos.get('video_fps'),
+            'video_size': infos.get('video_size'),
+            'audio_found': infos.get('audio_found', False),
+            'audio_fps': infos.get('audio_fps'),
+        }
+
+        with self._probe_lock:
+            self._probes[key] = result
+            while len(self._probes) > self.max_probe_entries:
+                self._probes.popitem(last=False)
+        return dict(result)
+
+    def duration(self, path: str) -> float:
+        return self.probe(path)['duration']
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_reader_manager() -> MediaReaderManager:
+    """Process-wide manager; the cap comes from MAX_MEDIA_READERS."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = MediaReaderManager(
+                max_readers=int(os.environ.get('MAX_MEDIA_READERS', 8))
+            )
+        return _manager
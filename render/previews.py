@@ -0,0 +1,189 @@
+"""
+Preview images captured during the render.
+The segment renderer hands every composed frame to a PreviewCollector,
+which keeps only the few it needs (downscaled right away): a poster,
+evenly spaced thumbnails and the tiles of a sprite sheet indexed by a
+WebVTT file for scrubbing previews. Nothing is decoded from the finished
+video.
+
+Previews of `output/<name>.mp4` are written to `output/previews/<name>/`
+with a `previews.json` manifest of the files.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image, features
+
+MANIFEST_NAME = 'previews.json'
+
+
+def preview_dir(video_path: str) -> str:
+    """Directory holding the previews of a rendered video."""
+    output_dir, filename = os.path.split(video_path)
+    return os.path.join(output_dir, 'previews', os.path.splitext(filename)[0])
+
+
+def load_previews(video_path: str) -> Optional[Dict]:
+    """Manifest of a video's previews, or None if it has none."""
+    try:
+        with open(os.path.join(preview_dir(video_path), MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _timestamp(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    return '%02d:%02d:%02d.%03d' % (hours, minutes, millis // 1000, millis % 1000)
+
+
+class PreviewCollector:
+    """Samples preview frames from the frames being encoded."""
+
+    def __init__(self, duration: float, fps: int, poster_time: float = None,
+                 thumbnail_count: int = 6, thumbnail_width: int = 270,
+                 sprite_interval: float = 1.0, tile_width: int = 108,
+                 sprite_columns: int = 10, image_format: str = 'JPEG'):
+        """
+        Plan which frames to keep.
+
+        Args:
+            duration: Video duration in seconds
+            fps: Frame rate of the frames offered
+            poster_time: Time of the poster frame (a quarter in by default)
+            thumbnail_count: Number of evenly spaced thumbnails
+            thumbnail_width: Thumbnail width (height follows the aspect ratio)
+            sprite_interval: Seconds between sprite tiles
+            tile_width: Sprite tile width
+            sprite_columns: Tiles per sprite sheet row
+            image_format: 'JPEG' or 'WEBP' (JPEG if Pillow lacks WebP)
+        """
+        self.duration = duration
+        self.fps = fps
+        self.thumbnail_width = thumbnail_width
+        self.tile_width = tile_width
+        self.sprite_interval = sprite_interval
+        self.sprite_columns = sprite_columns
+        if image_format.upper() == 'WEBP' and not features.check('webp'):
+            image_format = 'JPEG'
+        self.image_format = image_format.upper()
+
+        last_frame = max(int(round(duration * fps)) - 1, 0)
+
+        def index(t):
+            return min(max(int(round(t * fps)), 0), last_frame)
+
+        if poster_time is None:
+            poster_time = duration / 4
+        self.thumbnail_times = [duration * (k + 0.5) / thumbnail_count
+                                for k in range(thumbnail_count)]
+        tile_count = max(1, int(np.ceil(duration / sprite_interval)))
+        self.tile_times = [k * sprite_interval for k in range(tile_count)]
+
+        # Frame index -> what it is kept as
+        self._wanted: Dict[int, List] = {}
+        self._wanted.setdefault(index(poster_time), []).append(('poster', 0))
+        for k, t in enumerate(self.thumbnail_times):
+            self._wanted.setdefault(index(t), []).append(('thumbnail', k))
+        for k, t in enumerate(self.tile_times):
+            self._wanted.setdefault(index(t), []).append(('tile', k))
+
+        self.poster: Optional[Image.Image] = None
+        self.thumbnails: Dict[int, Image.Image] = {}
+        self.tiles: Dict[int, Image.Image] = {}
+
+    def wanted(self, first: int, last: int) -> List[int]:
+        """Sampled frame indices in first..last-1."""
+        return sorted(index for index in self._wanted if first <= index < last)
+
+    def frame(self, index: int, frame: np.ndarray):
+        """Offer the frame at `index` (cheap unless it is a sample)."""
+        uses = self._wanted.get(index)
+        if uses:
+            self._keep(uses, frame)
+
+    def still(self, first: int, last: int, frame: np.ndarray):
+        """Offer one frame standing for indices first..last-1 (static scene)."""
+        uses = [use for index in range(first, last) for use in self._wanted.get(index, ())]
+        if uses:
+            self._keep(uses, frame)
+
+    def _keep(self, uses, frame: np.ndarray):
+        image = Image.fromarray(np.asarray(frame, dtype=np.uint8)).convert('RGB')
+        for kind, k in uses:
+            if kind == 'poster':
+                self.poster = image
+            elif kind == 'thumbnail':
+                self.thumbnails[k] = self._scaled(image, self.thumbnail_width)
+            else:
+                self.tiles[k] = self._scaled(image, self.tile_width)
+
+    @staticmethod
+    def _scaled(image: Image.Image, width: int) -> Image.Image:
+        height = max(1, int(round(image.height * width / image.width)))
+        return image.resize((width, height), Image.BILINEAR, reducing_gap=2.0)
+
+    def save(self, directory: str) -> Dict:
+        """
+        Write the previews and their manifest.
+
+        Args:
+            directory: Output directory (see preview_dir)
+
+        Returns:
+            The manifest (file names relative to `directory`)
+        """
+        os.makedirs(directory, exist_ok=True)
+        extension = 'webp' if self.image_format == 'WEBP' else 'jpg'
+        manifest = {'duration': self.duration, 'thumbnails': []}
+
+        def write(image, name, quality):
+            image.save(os.path.join(directory, name), self.image_format, quality=quality)
+            return name
+
+        if self.poster is not None:
+            manifest['poster'] = write(self.poster, f'poster.{extension}', 85)
+        for k in sorted(self.thumbnails):
+            manifest['thumbnails'].append({
+                'time': round(self.thumbnail_times[k], 3),
+                'file': write(self.thumbnails[k], f'thumb_{k:02d}.{extension}', 80),
+            })
+        if self.tiles:
+            sprite_name, vtt_name = self._save_sprite(directory, extension)
+            manifest['sprite'] = sprite_name
+            manifest['vtt'] = vtt_name
+
+        with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    def _save_sprite(self, directory: str, extension: str):
+        """Tile the sprite frames into one sheet and index it in WebVTT."""
+        tile_width, tile_height = next(iter(self.tiles.values())).size
+        count = len(self.tile_times)
+        columns = min(self.sprite_columns, count)
+        rows = (count + columns - 1) // columns
+        sheet = Image.new('RGB', (columns * tile_width, rows * tile_height))
+
+        sprite_name = f'sprite.{extension}'
+        cues = ['WEBVTT', '']
+        for k, start in enumerate(self.tile_times):
+            x, y = (k % columns) * tile_width, (k // columns) * tile_height
+            tile = self.tiles.get(k)
+            if tile is not None:
+                sheet.paste(tile, (x, y))
+            end = min(start + self.sprite_interval, self.duration)
+            cues.append(f'{_timestamp(start)} --> {_timestamp(end)}')
+            cues.append(f'{sprite_name}#xywh={x},{y},{tile_width},{tile_height}')
+            cues.append('')
+
+        sheet.save(os.path.join(directory, sprite_name), self.image_format, quality=75)
+        vtt_name = 'sprite.vtt'
+        with open(os.path.join(directory, vtt_name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(cues))
+        return sprite_name, vtt_name
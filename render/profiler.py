@@ -0,0 +1,269 @@
+"""
+Per-layer frame profiler.
+Composing a frame is a tree of nested get_frame calls (the segment
+composite asks each layer, a resized layer asks its source, a transition
+sequence asks its wallpapers, ...). The profiler walks a chunk's clip tree
+and wraps the make_frame of every clip in it (and of its mask) with a
+timer, so each call is charged to its path in the tree: its total time,
+its self time (without the clips it called) and its call count.
+
+Nodes are named after the timeline layer they render (`layer_name`, set by
+TimelineRenderer), the moviepy effect that produced them (resize, rotate,
+subclip, ...) or their class. Sources opened lazily are instrumented when
+they open.
+
+Profiles of `output/<name>.mp4` are written to `output/profiles/<name>/`:
+`profile.txt`, ranked by self time, and `profile.folded`, folded stacks
+(self time in microseconds) for flamegraph.pl, speedscope or inferno.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Profile every render (jobs can also ask with params['profile'])
+PROFILE = os.environ.get('RENDER_PROFILE', '0') == '1'
+
+REPORT_NAME = 'profile.txt'
+FOLDED_NAME = 'profile.folded'
+
+# Functions of moviepy's effect plumbing; the effect is the function they call
+_PLUMBING = {'Clip.fl', 'Clip.fl_time', 'VideoClip.fl_image', 'VideoClip.__init__'}
+_CLIP_CLASSES = ('Clip.', 'VideoClip.', 'ImageClip.')
+
+
+def profile_dir(video_path: str) -> str:
+    """Directory holding the frame profile of a rendered video."""
+    output_dir, filename = os.path.split(video_path)
+    return os.path.join(output_dir, 'profiles', os.path.splitext(filename)[0])
+
+
+def _is_clip(value) -> bool:
+    return hasattr(value, 'get_frame') and hasattr(value, 'make_frame')
+
+
+def _closure_values(func, depth: int = 4):
+    """Values captured by a function and by the functions it captured."""
+    func = getattr(func, '__func__', func)
+    cells = getattr(func, '__closure__', None) or ()
+    for cell in cells:
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue
+        yield value
+        if depth > 1 and callable(value) and not _is_clip(value):
+            yield from _closure_values(value, depth - 1)
+
+
+def _effect_name(make_frame) -> str:
+    """Name of the effect a make_frame applies (resize, rotate, ...), or ''."""
+    candidates = [make_frame]
+    candidates.extend(value for value in _closure_values(make_frame)
+                      if callable(value) and not _is_clip(value))
+    for func in candidates:
+        if _is_clip(getattr(func, '__self__', None)):
+            # A clip class's own frame method
+            continue
+        qualname = getattr(func, '__qualname__', '')
+        head = qualname.split('.<locals>')[0]
+        if (not head or head in _PLUMBING or head == '<lambda>'
+                or head.endswith('.__init__')):
+            continue
+        for prefix in _CLIP_CLASSES:
+            if head.startswith(prefix):
+                head = head[len(prefix):]
+        return head
+    return ''
+
+
+class _Node:
+    """Timings of one path in the clip tree."""
+
+    __slots__ = ('calls', 'total', 'children')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        # Time spent in the clips this path called
+        self.children = 0.0
+
+    @property
+    def self_time(self) -> float:
+        return max(self.total - self.children, 0.0)
+
+
+class FrameProfiler:
+    """Times the make_frame calls of instrumented clip trees."""
+
+    def __init__(self):
+        self._nodes: Dict[Tuple[str, ...], _Node] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.wall_time = 0.0
+
+    def instrument(self, clip, name: str = None):
+        """
+        Wrap every clip in a tree (clips wrapped already are left as they are).
+
+        Args:
+            clip: Root clip (e.g. a chunk's clip)
+            name: Label of the root
+
+        Returns:
+            The same clip
+        """
+        self._wrap(clip, name)
+        return clip
+
+    def _label(self, clip, name: str = None) -> str:
+        from render.lazy_sources import LazyClip
+
+        if isinstance(clip, LazyClip):
+            # Its own time is spent waiting for the source to open
+            return f'{clip.source.name} [lazy]'
+        name = name or getattr(clip, 'layer_name', None)
+        effect = _effect_name(clip.make_frame) if clip.make_frame is not None else ''
+        if name and effect:
+            return f'{name} [{effect}]'
+        return name or effect or type(clip).__name__
+
+    def _is_timed(self, func) -> bool:
+        # Copies of a clip (set_position, subclip, ...) share its make_frame
+        return getattr(func, 'profiler', None) is self
+
+    def _wrap(self, clip, name: str = None):
+        if clip is None or clip.make_frame is None or self._is_timed(clip.make_frame):
+            return
+        label = self._label(clip, name)
+        children = self._children(clip)
+        clip.make_frame = self._timed(label, clip.make_frame)
+        for child, child_name in children:
+            self._wrap(child, child_name)
+        if clip.mask is not None:
+            self._wrap(clip.mask, f'{label} mask')
+
+    def _children(self, clip) -> List[Tuple[object, str]]:
+        """Clips a clip may ask for frames, with their labels (None for their own)."""
+        from render.compositor import StaticLayer
+        from render.lazy_sources import LazyClip
+
+        children = []
+        for layer in getattr(clip, 'layers', None) or ():
+            if isinstance(layer, StaticLayer):
+                if not self._is_timed(layer.blit_on):
+                    layer.blit_on = self._timed('static layers', layer.blit_on)
+            else:
+                children.append((layer, None))
+        if not getattr(clip, 'layers', None):
+            children.extend((child, None) for child in getattr(clip, 'clips', None) or ())
+            children.append((getattr(clip, 'bg', None), 'background color'))
+        for item in getattr(clip, 'items', None) or ():
+            children.append((getattr(item, 'clip', None), None))
+        if isinstance(clip, LazyClip):
+            source = clip.source
+            source.add_open_hook(lambda opened: self._wrap(opened, source.name))
+        for value in _closure_values(clip.make_frame):
+            if _is_clip(value):
+                children.append((value, None))
+            elif _is_clip(getattr(value, '__self__', None)):
+                children.append((value.__self__, None))
+        return [(child, name) for child, name in children
+                if child is not None and child is not clip]
+
+    def _timed(self, label: str, func):
+        """Wrap a frame function so its calls are charged to `label`."""
+        nodes = self._nodes
+        lock = self._lock
+        local = self._local
+
+        def timed(*args, **kwargs):
+            stack = getattr(local, 'stack', None)
+            if stack is None:
+                stack = local.stack = []
+            path = (stack[-1][0] + (label,)) if stack else (label,)
+            entry = [path, 0.0]
+            stack.append(entry)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                with lock:
+                    node = nodes.get(path)
+                    if node is None:
+                        node = nodes[path] = _Node()
+                    node.calls += 1
+                    node.total += elapsed
+                    node.children += entry[1]
+                    if not stack:
+                        self.wall_time += elapsed
+
+        timed.__wrapped__ = func
+        timed.profiler = self
+        return timed
+
+    @property
+    def frames(self) -> int:
+        """Frames composed (calls of root clips)."""
+        with self._lock:
+            return sum(node.calls for path, node in self._nodes.items() if len(path) == 1)
+
+    def rows(self) -> List[Dict]:
+        """Timings per path, by decreasing self time."""
+        with self._lock:
+            items = list(self._nodes.items())
+        frames = max(sum(node.calls for path, node in items if len(path) == 1), 1)
+        rows = [
+            {
+                'path': list(path),
+                'calls': node.calls,
+                'total_ms': node.total * 1000,
+                'self_ms': node.self_time * 1000,
+                'ms_per_frame': node.total * 1000 / frames,
+            }
+            for path, node in items
+        ]
+        rows.sort(key=lambda row: row['self_ms'], reverse=True)
+        return rows
+
+    def report(self, limit: int = None) -> str:
+        """Ranked table of the paths with the most self time."""
+        rows = self.rows()
+        total = sum(row['self_ms'] for row in rows) or 1.0
+        lines = [
+            f'{self.frames} frames composed in {self.wall_time:.2f}s',
+            '',
+            f"{'self ms':>10} {'self %':>7} {'total ms':>10} {'ms/frame':>9} {'calls':>8}  path",
+        ]
+        for row in rows[:limit]:
+            lines.append(
+                f"{row['self_ms']:10.1f} {100 * row['self_ms'] / total:6.1f}% "
+                f"{row['total_ms']:10.1f} {row['ms_per_frame']:9.2f} {row['calls']:8d}  "
+                + ' > '.join(row['path'])
+            )
+        return '\n'.join(lines) + '\n'
+
+    def folded(self) -> str:
+        """Folded stacks: one `root;child;... <self microseconds>` line per path."""
+        lines = []
+        for row in self.rows():
+            micros = int(round(row['self_ms'] * 1000))
+            if micros > 0:
+                path = ';'.join(part.replace(';', ',') for part in row['path'])
+                lines.append(f'{path} {micros}')
+        return '\n'.join(sorted(lines)) + '\n'
+
+    def save(self, directory: str):
+        """Write the ranked report and the folded stacks to `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        for name, text in ((REPORT_NAME, self.report()), (FOLDED_NAME, self.folded())):
+            path = os.path.join(directory, name)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
@@ -0,0 +1,242 @@
+"""
+Per-chunk cache of encoded video.
+Each segment of a plan is cut into chunks at the points where a wallpaper
+slot starts, so a chunk covers one slot together with the transition into
+it. A chunk is keyed by what its frames depend on: the layers visible in
+its time window (by content fingerprint, not by upload path), its window
+in the segment, the encoding settings and the rendering code. Chunks are
+encoded as silent, closed-GOP H.264 files of the same profile, so an
+unchanged chunk is reused and spliced by stream copy while an edit
+re-encodes only the chunks it touches. Audio is muxed over the whole
+video afterwards (see SegmentRenderer).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional
+
+# Bump when the chunk layout or encoding changes
+CACHE_VERSION = 1
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code that determines the pixels of a chunk
+CODE_FILES = (
+    'render/compositor.py',
+    'render/encoder.py',
+    'render/ken_burns.py',
+    'render/lazy_sources.py',
+    'render/segment_cache.py',
+    'render/text_overlay.py',
+    'render/timeline.py',
+    'render/transitions.py',
+    'render/video_frames.py',
+    'templates/animated_background.py',
+)
+
+_code_key = None
+
+
+def code_key() -> str:
+    """Hash of the rendering code (computed once per process)."""
+    global _code_key
+    if _code_key is None:
+        digest = hashlib.sha1(f'chunks-v{CACHE_VERSION}'.encode())
+        for rel_path in CODE_FILES:
+            path = os.path.join(ROOT_DIR, rel_path)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _code_key = digest.hexdigest()
+    return _code_key
+
+
+class Chunk:
+    """A frame range of the video, encoded on its own."""
+
+    def __init__(self, first_frame: int, frame_count: int, fps: int,
+                 open_clip: Callable, key: Optional[str] = None, name: str = '',
+                 on_close: Callable = None, encoded_path: Optional[str] = None,
+                 still: Callable = None):
+        """
+        Args:
+            first_frame: Index of the chunk's first frame in the whole video
+            frame_count: Number of frames
+            fps: Frame rate
+            open_clip: Callable returning the chunk's clip (only called
+                when its frames are needed)
+            key: Cache key, or None to always render
+            name: Label for logging
+            on_close: Called once when the chunk is closed (releases what
+                the chunks of a segment share)
+            encoded_path: Already encoded file, appended as-is (see
+                render/closing_segment.py)
+            still: Callable returning the frame of a static chunk, used
+                for previews instead of composing it
+        """
+        self.first_frame = first_frame
+        self.frame_count = frame_count
+        self.fps = fps
+        self.key = key
+        self.name = name
+        self._open_clip = open_clip
+        self._on_close = on_close
+        self.encoded_path = encoded_path
+        self.still = still
+        self._clip = None
+
+    @classmethod
+    def of_clip(cls, clip, first_frame: int, fps: int, name: str = '') -> 'Chunk':
+        """Uncached chunk wrapping an already built clip."""
+        frame_count = int(round(clip.duration * fps))
+        return cls(first_frame, frame_count, fps, lambda: clip, name=name)
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.fps
+
+    @property
+    def last_frame(self) -> int:
+        return self.first_frame + self.frame_count
+
+    def clip(self):
+        if self._clip is None:
+            self._clip = self._open_clip()
+        return self._clip
+
+    def close(self):
+        if self._clip is not None:
+            self._clip.close()
+            self._clip = None
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+
+
+def _layer_key(layer) -> Dict:
+    data = asdict(layer)
+    # Uploads get unique paths; their content is in the fingerprint
+    if layer.fingerprint:
+        data.pop('source')
+    return data
+
+
+def chunk_key(plan, segment, start: float, end: float, encoding: Dict) -> str:
+    """
+    Cache key of the frames of `segment` between `start` and `end`.
+
+    Args:
+        plan: TimelinePlan (for size and fps)
+        segment: Segment of the plan
+        start: Chunk start, in segment time
+        end: Chunk end, in segment time
+        encoding: Encoder settings (see SegmentRenderer.encoding)
+    """
+    layers = [_layer_key(layer) for layer in segment.layers
+              if layer.start < end and layer.end > start]
+    data = {
+        'code': code_key(),
+        'encoding': encoding,
+        'size': list(plan.size),
+        'fps': plan.fps,
+        'window': [round(start, 6), round(end, 6)],
+        'layers': layers,
+    }
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chunk_boundaries(segment) -> List[float]:
+    """Segment times where a wallpaper slot (and its transition in) starts."""
+    return sorted({
+        layer.start for layer in segment.layers
+        if layer.params.get('sequence') is not None and 0 < layer.start < segment.duration
+    })
+
+
+def plan_chunks(plan, renderer, encoding: Dict, segments: List = None) -> List[Chunk]:
+    """
+    Cut a plan into cacheable chunks.
+
+    Args:
+        plan: TimelinePlan
+        renderer: TimelineRenderer of the plan; segment clips are built only
+            for segments with a chunk that has to be rendered
+        encoding: Encoder settings (part of every key)
+        segments: Segments to cut (all of the plan's by default)
+
+    Returns:
+        Chunks in playback order, aligned to whole frames
+    """
+    chunks = []
+    for segment in plan.segments if segments is None else segments:
+        segment_first = int(round(segment.start * plan.fps))
+        segment_last = int(round((segment.start + segment.duration) * plan.fps))
+        cuts = [segment_first]
+        if not segment.is_static:
+            cuts.extend(int(round((segment.start + t) * plan.fps))
+                        for t in chunk_boundaries(segment))
+        cuts = sorted(set(cut for cut in cuts if cut < segment_last)) + [segment_last]
+
+        # The segment clip is built once for all of its chunks and closed
+        # with the last of them
+        shared = {'open_chunks': len(cuts) - 1}
+
+        def open_clip(first, last, segment=segment, segment_first=segment_first,
+                      shared=shared):
+            if 'clip' not in shared:
+                shared['clip'] = renderer.segment_clip(segment, with_audio=False)
+            clip = shared['clip']
+            if first == segment_first and last - first == int(round(clip.duration * plan.fps)):
+                return clip
+            return clip.subclip((first - segment_first) / plan.fps,
+                                (last - segment_first) / plan.fps)
+
+        def chunk_closed(shared=shared):
+            shared['open_chunks'] -= 1
+            if shared['open_chunks'] == 0 and 'clip' in shared:
+                shared.pop('clip').close()
+
+        for i, (first, last) in enumerate(zip(cuts, cuts[1:])):
+            start = (first - segment_first) / plan.fps
+            end = (last - segment_first) / plan.fps
+            chunks.append(Chunk(
+                first, last - first, plan.fps,
+                lambda first=first, last=last, open_clip=open_clip: open_clip(first, last),
+                key=chunk_key(plan, segment, start, end, encoding),
+                name=f'{segment.name}[{i}]',
+                on_close=chunk_closed
+            ))
+    return chunks
+
+
+class SegmentCache:
+    """Directory of encoded chunks named by key."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key[:40]}.mp4')
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of a cached chunk (marked as used), or None."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        from jobs.storage import touch
+        touch(path)
+        return path
+
+    def put(self, key: str, encoded_path: str) -> str:
+        """Move a freshly encoded chunk into the cache and return its path."""
+        path = self.path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.move(encoded_path, tmp_path)
+        os.replace(tmp_path, path)
+        return path
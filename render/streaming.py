@@ -0,0 +1,133 @@
+"""
+Progressive HLS output.
+While an ad renders, every encoded chunk is also remuxed (video by stream
+copy) into an MPEG-TS segment and appended to an event playlist, so playback can start after the first chunk
+instead of after the final mux. Chunks are cut on closed GOPs, so each
+segment starts with a keyframe. The playlist is rewritten atomically after
+every segment and closed with EXT-X-ENDLIST once the last one is written;
+the final MP4 is produced as before.
+
+The audio mix is encoded to AAC once and each segment takes the AAC frames
+that start within its time range, also by stream copy. Encoding every
+segment's slice on its own would restart the encoder, and the priming
+samples of each restart would overlap the end of the previous segment.
+"""
+
+import math
+import os
+from typing import List, Tuple
+
+PLAYLIST_NAME = 'index.m3u8'
+
+# Samples per AAC-LC frame
+AAC_FRAME_SAMPLES = 1024
+# Priming samples ffmpeg's AAC encoder puts before the audio (ADTS does not
+# record them, so segment timestamps account for them)
+AAC_PRIMING_SAMPLES = 1024
+
+
+def stream_dir(output_dir: str, stream_id: str) -> str:
+    """Directory of a video's stream (playlist and segments)."""
+    return os.path.join(output_dir, 'streams', stream_id)
+
+
+def split_adts(data: bytes) -> List[bytes]:
+    """Split an ADTS stream into its AAC frames (headers included)."""
+    frames = []
+    offset = 0
+    while offset + 7 <= len(data):
+        if data[offset] != 0xFF or data[offset + 1] & 0xF0 != 0xF0:
+            raise ValueError(f"No ADTS sync word at byte {offset}")
+        # 13-bit frame length, header included
+        length = (((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3)
+                  | (data[offset + 5] >> 5))
+        if length < 7:
+            raise ValueError(f"Invalid ADTS frame length at byte {offset}")
+        frames.append(data[offset:offset + length])
+        offset += length
+    return frames
+
+
+def aac_frame_range(first_sample: int, end_sample: int = None,
+                    frame_count: int = None) -> Tuple[int, int]:
+    """
+    AAC frames of a segment: those whose audio starts in its sample range.
+
+    Consecutive segments get consecutive frames, so their audio meets
+    without overlap. The first segment also gets the priming frame.
+
+    Args:
+        first_sample: First sample of the segment in the mix
+        end_sample: Sample the next segment starts at (None for the last)
+        frame_count: Frames of the encoded mix
+
+    Returns:
+        Range (start, stop) of frame indices
+    """
+    def first_frame_from(sample: int) -> int:
+        return max(-(-(sample + AAC_PRIMING_SAMPLES) // AAC_FRAME_SAMPLES), 0)
+
+    start = first_frame_from(first_sample) if first_sample > 0 else 0
+    stop = frame_count if end_sample is None else first_frame_from(end_sample)
+    if frame_count is not None:
+        start, stop = min(start, frame_count), min(stop, frame_count)
+    return start, stop
+
+
+def aac_frame_time(index: int, sample_rate: int) -> float:
+    """Position in the mix, in seconds, of the audio of an AAC frame."""
+    return (index * AAC_FRAME_SAMPLES - AAC_PRIMING_SAMPLES) / sample_rate
+
+
+class HlsPlaylist:
+    """Event playlist of a stream being rendered."""
+
+    def __init__(self, directory: str, target_duration: float):
+        """
+        Args:
+            directory: Directory of the playlist and its segments
+            target_duration: Longest segment duration in seconds (fixed up
+                front, as players read it from the first playlist)
+        """
+        self.directory = directory
+        self.target_duration = max(1, int(math.ceil(target_duration)))
+        self.segments: List[Tuple[str, float]] = []
+        self.finished = False
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, PLAYLIST_NAME)
+
+    def next_segment_path(self) -> str:
+        """Path the next segment is written to."""
+        return os.path.join(self.directory, f'segment_{len(self.segments):03d}.ts')
+
+    def add(self, path: str, duration: float):
+        """Publish a written segment."""
+        self.segments.append((os.path.basename(path), duration))
+        self._write()
+
+    def finish(self):
+        """Mark the stream complete."""
+        self.finished = True
+        self._write()
+
+    def _write(self):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-PLAYLIST-TYPE:EVENT',
+            f'#EXT-X-TARGETDURATION:{self.target_duration}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+        ]
+        for name, duration in self.segments:
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(name)
+        if self.finished:
+            lines.append('#EXT-X-ENDLIST')
+
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
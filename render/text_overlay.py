@@ -0,0 +1,413 @@
+"""
+Glyph-atlas text overlay.
+Captions (the deity name, the custom text) are drawn without ImageMagick:
+text is split into clusters (a Latin letter with its combining marks, or a
+Devanagari syllable: consonants joined by virama plus their vowel signs),
+each cluster is shaped and rasterized once with FreeType into a per-font,
+per-size atlas, and the caption is laid out from atlas entries. Frames
+are composited with NumPy from the laid-out coverage, so effects (fade,
+typewriter) cost a few array operations per frame.
+
+Shaping uses Pillow's Raqm layout when libraqm is installed (conjuncts and
+vowel sign reordering come from the font). Without it, the pre-base vowel
+sign I is moved in front of its syllable so Hindi text stays readable.
+"""
+
+import hashlib
+import os
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from moviepy.video.VideoClip import ImageClip, VideoClip
+from PIL import Image, ImageDraw, ImageFont, features
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Candidate fonts per script, first existing one wins
+FONT_PATHS = {
+    'latin': (
+        os.environ.get('CAPTION_FONT'),
+        os.path.join(ROOT_DIR, 'assets', 'fonts', 'NotoSans-Bold.ttf'),
+        '/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf',
+        '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    ),
+    'devanagari': (
+        os.environ.get('CAPTION_FONT_DEVANAGARI'),
+        os.path.join(ROOT_DIR, 'assets', 'fonts', 'NotoSansDevanagari-Bold.ttf'),
+        '/usr/share/fonts/truetype/noto/NotoSansDevanagari-Bold.ttf',
+        '/usr/share/fonts/truetype/lohit-devanagari/Lohit-Devanagari.ttf',
+    ),
+}
+
+VIRAMA = '्'
+VOWEL_SIGN_I = 'ि'
+JOINERS = ('‌', '‍')
+
+# Width of the atlas texture; rows are added as glyphs are rasterized
+ATLAS_WIDTH = 1024
+
+_fonts_fingerprint = None
+
+
+def is_devanagari(char: str) -> bool:
+    return 'ऀ' <= char <= 'ॿ'
+
+
+def _is_consonant(char: str) -> bool:
+    return 'क' <= char <= 'ह' or 'क़' <= char <= 'य़'
+
+
+def clusters(text: str) -> List[str]:
+    """
+    Split text into the units that are shaped and placed together.
+
+    Combining marks (vowel signs, nukta, anusvara, accents) and joiners stay
+    with the preceding character, and a consonant following a virama joins
+    its syllable, so conjuncts are shaped as one unit.
+    """
+    units = []
+    for char in text:
+        if units and (
+            unicodedata.category(char).startswith('M')
+            or char in JOINERS
+            or (units[-1][-1] in (VIRAMA,) + JOINERS and _is_consonant(char))
+        ):
+            units[-1] += char
+        else:
+            units.append(char)
+    return units
+
+
+def find_font(script: str) -> Optional[str]:
+    """Path of the first installed font for a script, or None."""
+    for path in FONT_PATHS[script]:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+def fonts_fingerprint() -> str:
+    """Hash of the caption fonts in use (part of the chunk cache keys)."""
+    global _fonts_fingerprint
+    if _fonts_fingerprint is None:
+        digest = hashlib.sha1(str(features.check('raqm')).encode())
+        for script in sorted(FONT_PATHS):
+            path = find_font(script)
+            digest.update(f'{script}:{path}'.encode())
+            if path:
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha1(f.read()).digest())
+        _fonts_fingerprint = digest.hexdigest()
+    return _fonts_fingerprint
+
+
+@dataclass(frozen=True)
+class Glyph:
+    """A rasterized cluster: its atlas rectangle and placement."""
+
+    x: int
+    y: int
+    width: int
+    height: int
+    # Offset of the bitmap from the pen position on the baseline
+    left: int
+    top: int
+    advance: float
+
+
+class GlyphAtlas:
+    """Clusters of one font at one size, rasterized once into one texture."""
+
+    def __init__(self, font_path: Optional[str], size: int):
+        """
+        Args:
+            font_path: TrueType/OpenType file (None for Pillow's default font)
+            size: Font size in pixels
+        """
+        if font_path is None:
+            self.font = ImageFont.load_default(size)
+        else:
+            layout = ImageFont.Layout.RAQM if features.check('raqm') else ImageFont.Layout.BASIC
+            self.font = ImageFont.truetype(font_path, size, layout_engine=layout)
+        self.shaped = features.check('raqm') and font_path is not None
+        self.ascent, self.descent = self.font.getmetrics()
+        self.texture = np.zeros((0, ATLAS_WIDTH), np.uint8)
+        self.glyphs: Dict[str, Glyph] = {}
+        self._lock = threading.Lock()
+        # Shelf packing: current row top, height and fill
+        self._row_y = 0
+        self._row_height = 0
+        self._row_x = 0
+
+    def glyph(self, cluster: str) -> Glyph:
+        """Atlas entry of a cluster, rasterizing it on first use."""
+        glyph = self.glyphs.get(cluster)
+        if glyph is None:
+            with self._lock:
+                glyph = self.glyphs.get(cluster)
+                if glyph is None:
+                    glyph = self._rasterize(cluster)
+                    self.glyphs[cluster] = glyph
+        return glyph
+
+    def _rasterize(self, cluster: str) -> Glyph:
+        text = cluster
+        if not self.shaped and VOWEL_SIGN_I in text:
+            # Pre-base vowel sign: drawn before the syllable it follows
+            text = VOWEL_SIGN_I + text.replace(VOWEL_SIGN_I, '')
+        advance = self.font.getlength(text)
+        left, top, right, bottom = self.font.getbbox(text, anchor='ls')
+        width, height = right - left, bottom - top
+        if width <= 0 or height <= 0:
+            return Glyph(0, 0, 0, 0, 0, 0, advance)
+
+        image = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(image).text((-left, -top), text, font=self.font, fill=255, anchor='ls')
+        x, y = self._allocate(width, height)
+        self.texture[y:y + height, x:x + width] = np.asarray(image)
+        return Glyph(x, y, width, height, left, top, advance)
+
+    def _allocate(self, width: int, height: int) -> Tuple[int, int]:
+        """Place a bitmap on the current shelf, or on a new one."""
+        # The current shelf is the last one, so it can grow in height
+        if self._row_x + width > ATLAS_WIDTH:
+            self._row_y += self._row_height
+            self._row_x = 0
+            self._row_height = 0
+        self._row_height = max(self._row_height, height)
+        needed = self._row_y + self._row_height
+        if needed > self.texture.shape[0]:
+            rows = max(needed, self.texture.shape[0] * 2)
+            grown = np.zeros((rows, ATLAS_WIDTH), np.uint8)
+            grown[:self.texture.shape[0]] = self.texture
+            self.texture = grown
+        x = self._row_x
+        self._row_x += width
+        return x, self._row_y
+
+    def bitmap(self, glyph: Glyph) -> np.ndarray:
+        return self.texture[glyph.y:glyph.y + glyph.height, glyph.x:glyph.x + glyph.width]
+
+
+_atlases: Dict[Tuple, GlyphAtlas] = {}
+_atlases_lock = threading.Lock()
+
+
+def get_atlas(script: str, size: int) -> GlyphAtlas:
+    """Process-wide atlas of a script's font at a size."""
+    path = find_font(script)
+    if path is None and script != 'latin':
+        # Missing script font: draw with the Latin one
+        path = find_font('latin')
+    key = (path, size)
+    with _atlases_lock:
+        if key not in _atlases:
+            _atlases[key] = GlyphAtlas(path, size)
+        return _atlases[key]
+
+
+@dataclass
+class PlacedGlyph:
+    atlas: GlyphAtlas
+    glyph: Glyph
+    x: int
+    y: int
+
+
+class TextLayout:
+    """Text wrapped into centered lines of atlas glyphs."""
+
+    def __init__(self, text: str, size: int, max_width: int, max_lines: int = None,
+                 line_spacing: float = 1.2):
+        """
+        Args:
+            text: Text to lay out (Latin and Devanagari may be mixed)
+            size: Font size in pixels
+            max_width: Width lines are wrapped at (on spaces)
+            max_lines: Lines kept (the rest is cut with an ellipsis)
+            line_spacing: Line height relative to the font size
+        """
+        latin = get_atlas('latin', size)
+        devanagari = get_atlas('devanagari', size)
+
+        def atlas_of(cluster):
+            return devanagari if any(is_devanagari(c) for c in cluster) else latin
+
+        # Wrap words greedily
+        space = latin.glyph(' ').advance
+        lines = [[]]
+        widths = [0.0]
+        for word in text.split():
+            units = clusters(word)
+            word_width = sum(atlas_of(unit).glyph(unit).advance for unit in units)
+            if lines[-1] and widths[-1] + space + word_width > max_width:
+                lines.append([])
+                widths.append(0.0)
+            if lines[-1]:
+                lines[-1].append(' ')
+                widths[-1] += space
+            lines[-1].extend(units)
+            widths[-1] += word_width
+
+        if max_lines and len(lines) > max_lines:
+            lines = lines[:max_lines]
+            widths = widths[:max_lines]
+            lines[-1].append('…')
+            widths[-1] += latin.glyph('…').advance
+
+        ascent = max(latin.ascent, devanagari.ascent)
+        descent = max(latin.descent, devanagari.descent)
+        line_height = max(int(round(size * line_spacing)), ascent + descent)
+        self.width = max(2, int(np.ceil(min(max(widths), max_width) if text.strip() else 2)))
+        self.height = max(2, line_height * (len(lines) - 1) + ascent + descent)
+
+        # Glyph positions in reading order (the typewriter reveal order)
+        self.glyphs: List[PlacedGlyph] = []
+        for i, (units, width) in enumerate(zip(lines, widths)):
+            pen = (self.width - width) / 2
+            baseline = i * line_height + ascent
+            for unit in units:
+                atlas = atlas_of(unit)
+                glyph = atlas.glyph(unit)
+                if glyph.width:
+                    self.glyphs.append(PlacedGlyph(
+                        atlas, glyph, int(round(pen)) + glyph.left, baseline + glyph.top
+                    ))
+                pen += glyph.advance
+
+    def coverage(self, count: int = None, out: np.ndarray = None, first: int = 0) -> np.ndarray:
+        """
+        Alpha coverage (uint8) of the first `count` glyphs.
+
+        Args:
+            count: Glyphs to draw (all by default)
+            out: Coverage of the first `first` glyphs to draw onto
+            first: Glyphs already in `out`
+        """
+        if out is None:
+            out = np.zeros((self.height, self.width), np.uint8)
+            first = 0
+        for placed in self.glyphs[first:count]:
+            bitmap = placed.atlas.bitmap(placed.glyph)
+            # Clip to the block (wide glyphs on a full line)
+            x1, y1 = max(placed.x, 0), max(placed.y, 0)
+            x2 = min(placed.x + bitmap.shape[1], self.width)
+            y2 = min(placed.y + bitmap.shape[0], self.height)
+            if x1 >= x2 or y1 >= y2:
+                continue
+            region = out[y1:y2, x1:x2]
+            np.maximum(region, bitmap[y1 - placed.y:y2 - placed.y, x1 - placed.x:x2 - placed.x],
+                       out=region)
+        return out
+
+
+class CaptionClip(VideoClip):
+    """Animated caption composited from a TextLayout."""
+
+    def __init__(self, layout: TextLayout, duration: float, color=(255, 255, 255),
+                 shadow: int = 3, effect: Optional[str] = 'fade', effect_duration: float = 0.5,
+                 fade_out: float = 0.5):
+        """
+        Args:
+            layout: Laid-out text
+            duration: Duration of the caption
+            color: Text color
+            shadow: Offset of the black drop shadow in pixels (0 for none)
+            effect: 'fade' (fades in), 'typewriter' (clusters appear one by
+                one) or None
+            effect_duration: Length of the fade in or of the typing
+            fade_out: Length of the fade out at the end (0 for none)
+        """
+        VideoClip.__init__(self, duration=duration)
+        self.layout = layout
+        self.effect = effect
+        self.effect_duration = effect_duration
+        self.fade_out = fade_out
+        self.shadow = shadow
+        self.size = (layout.width + shadow, layout.height + shadow)
+        self._color = np.array(color, np.float32)
+        # Once the text is complete only its opacity changes
+        self._full = self._compose(layout.coverage())
+        # Typewriter coverage grows frame by frame; keep the last one
+        self._typed = (0, None)
+        # The color and the mask of a frame are asked for one after the other
+        self._last = (None, None)
+
+        self.make_frame = lambda t: self._frame(t)[0]
+        self.mask = VideoClip(ismask=True, duration=duration)
+        self.mask.size = self.size
+        self.mask.make_frame = lambda t: self._frame(t)[1]
+
+    def _compose(self, coverage: np.ndarray):
+        """(uint8 color, float alpha) of the text over its drop shadow."""
+        text = coverage.astype(np.float32) / 255
+        height, width = text.shape
+        s = self.shadow
+        top = np.zeros((height + s, width + s), np.float32)
+        top[:height, :width] = text
+        alpha = np.zeros_like(top)
+        alpha[s:, s:] = text
+        alpha = top + alpha * (1 - top)
+        # Unpremultiplied: text color where the text is, black in the shadow
+        color = self._color * (top / np.maximum(alpha, 1e-6))[:, :, None]
+        return np.rint(color).astype(np.uint8), alpha
+
+    def _typed_frame(self, t: float):
+        count = int(len(self.layout.glyphs) * max(t, 0.0) / self.effect_duration)
+        typed, coverage = self._typed
+        if coverage is None or count < typed:
+            typed, coverage = 0, None
+        else:
+            coverage = coverage.copy()
+        coverage = self.layout.coverage(count, coverage, typed)
+        self._typed = (count, coverage)
+        return self._compose(coverage)
+
+    def _opacity(self, t: float) -> float:
+        level = 1.0
+        if self.fade_out:
+            level = min(level, (self.duration - t) / self.fade_out)
+        if self.effect == 'fade' and self.effect_duration:
+            level = min(level, t / self.effect_duration)
+        return min(max(level, 0.0), 1.0)
+
+    def _frame(self, t: float):
+        """(uint8 color, float alpha) of the caption at time `t`."""
+        last_t, frame = self._last
+        if last_t == t:
+            return frame
+
+        if self.effect == 'typewriter' and t < self.effect_duration:
+            color, alpha = self._typed_frame(t)
+        else:
+            color, alpha = self._full
+        opacity = self._opacity(t)
+        if opacity < 1.0:
+            alpha = alpha * opacity
+
+        frame = (color, alpha)
+        self._last = (t, frame)
+        return frame
+
+
+def caption_clip(text: str, size: int, max_width: int, duration: float,
+                 max_lines: int = None, effect: Optional[str] = 'fade',
+                 effect_duration: float = 0.5, fade_out: float = 0.5,
+                 color=(255, 255, 255)):
+    """
+    Caption clip of `text`.
+
+    Captions without any animation are an ImageClip, so the compositor
+    flattens them with the other static layers.
+    """
+    layout = TextLayout(text, size, max_width, max_lines)
+    clip = CaptionClip(layout, duration, color=color, effect=effect,
+                       effect_duration=effect_duration, fade_out=fade_out)
+    if effect is None and not fade_out:
+        color_frame, alpha = clip._full
+        clip = ImageClip(color_frame, duration=duration)
+        clip.mask = ImageClip(alpha, ismask=True, duration=duration)
+    return clip
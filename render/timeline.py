@@ -0,0 +1,526 @@
+"""
+Declarative timeline plan for the ad.
+A TimelinePlan describes every layer, its time range, transitions and the
+audio tracks as plain data. Durations are resolved once when the plan is
+built, from the known voiceover lengths. TimelineRenderer turns the plan
+into clips that only ask the layers active at time t for frames.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+# Sample rate of the audio mix
+AUDIO_FPS = 44100
+
+# (path, size, mtime) -> content hash
+_fingerprints = {}
+
+
+def is_video_file(path: str) -> bool:
+    """Check whether a wallpaper path points to a video file."""
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Content hash of a file, memoized per path, size and mtime.
+
+    Args:
+        path: File path
+
+    Returns:
+        Hex SHA-1 digest of the file contents
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprints:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _fingerprints[key] = digest.hexdigest()
+    return _fingerprints[key]
+
+
+@dataclass(frozen=True)
+class Transition:
+    """A transition on one edge of a layer."""
+
+    kind: str        # 'fade' (to/from black), or 'crossfade', 'slide',
+                     # 'wipe' or 'zoom' (from the previous layer in a sequence)
+    edge: str        # 'in' or 'out'
+    duration: float
+
+
+@dataclass
+class Layer:
+    """A visual layer; times are relative to the start of its segment."""
+
+    name: str
+    kind: str                          # 'background', 'image', 'video' or 'text'
+    start: float
+    end: float
+    source: Optional[str] = None
+    fingerprint: Optional[str] = None
+    size: Optional[Tuple[int, int]] = None
+    position: Tuple = ('center', 'center')
+    transitions: List[Transition] = field(default_factory=list)
+    params: Dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def animated(self) -> bool:
+        """True if the layer's pixels change over time."""
+        if self.kind == 'video' or self.transitions:
+            return True
+        if self.kind == 'text':
+            return bool(self.params.get('effect') or self.params.get('fade_out'))
+        if self.kind == 'image' and self.params.get('ken_burns'):
+            return True
+        return self.kind == 'background' and self.params.get('style') == 'mandala'
+
+    def is_active(self, t: float) -> bool:
+        """Check whether the layer is on screen at segment time `t`."""
+        return self.start <= t < self.end
+
+
+@dataclass
+class AudioTrack:
+    """An audio source placed on the timeline."""
+
+    name: str
+    source: str
+    start: float
+    duration: float
+    fingerprint: Optional[str] = None
+    volume: float = 1.0
+    loop: bool = False
+
+
+@dataclass
+class Segment:
+    """A scene: layers and audio that play back to back with other scenes."""
+
+    name: str
+    duration: float
+    layers: List[Layer] = field(default_factory=list)
+    audio: List[AudioTrack] = field(default_factory=list)
+    start: float = 0.0
+
+    @property
+    def is_static(self) -> bool:
+        return not any(layer.animated for layer in self.layers)
+
+    def active_layers(self, t: float) -> List[Layer]:
+        """Layers on screen at segment time `t`, bottom to top."""
+        return [layer for layer in self.layers if layer.is_active(t)]
+
+
+@dataclass
+class TimelinePlan:
+    """The whole ad: segments in playback order plus ad-wide audio."""
+
+    size: Tuple[int, int]
+    fps: int
+    segments: List[Segment]
+    audio: List[AudioTrack] = field(default_factory=list)
+
+    def __post_init__(self):
+        # Resolve absolute segment start times once
+        offset = 0.0
+        for segment in self.segments:
+            segment.start = offset
+            offset += segment.duration
+
+    @property
+    def duration(self) -> float:
+        return sum(segment.duration for segment in self.segments)
+
+    def segment_at(self, t: float) -> Optional[Segment]:
+        """Segment playing at absolute time `t`."""
+        for segment in self.segments:
+            if segment.start <= t < segment.start + segment.duration:
+                return segment
+        return None
+
+    def active_layers(self, t: float) -> List[Layer]:
+        """Layers on screen at absolute time `t`, bottom to top."""
+        segment = self.segment_at(t)
+        return segment.active_layers(t - segment.start) if segment else []
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def to_json(self) -> str:
+        """Canonical JSON form of the plan."""
+        return json.dumps(self.to_dict(), sort_keys=True, ensure_ascii=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TimelinePlan':
+        segments = []
+        for seg in data['segments']:
+            layers = []
+            for layer in seg['layers']:
+                layer = dict(layer)
+                layer['transitions'] = [Transition(**tr) for tr in layer['transitions']]
+                layer['position'] = tuple(layer['position'])
+                if layer['size'] is not None:
+                    layer['size'] = tuple(layer['size'])
+                layers.append(Layer(**layer))
+            audio = [AudioTrack(**track) for track in seg['audio']]
+            segments.append(Segment(
+                name=seg['name'], duration=seg['duration'],
+                layers=layers, audio=audio
+            ))
+        return cls(
+            size=tuple(data['size']),
+            fps=data['fps'],
+            segments=segments,
+            audio=[AudioTrack(**track) for track in data['audio']]
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> 'TimelinePlan':
+        return cls.from_dict(json.loads(text))
+
+    def digest(self) -> str:
+        """Stable content hash of the plan, for caching rendered output."""
+        return hashlib.sha256(self.to_json().encode('utf-8')).hexdigest()
+
+    def __hash__(self):
+        return int(self.digest()[:16], 16)
+
+    def cost_summary(self) -> Dict:
+        """
+        Inspect the plan for cost estimation.
+
+        Returns:
+            Dictionary with the total duration and frame count, and per
+            segment whether it is static, its layer count and the seconds
+            of animated and decoded-video layers it contains
+        """
+        segments = []
+        for segment in self.segments:
+            segments.append({
+                'name': segment.name,
+                'duration': segment.duration,
+                'static': segment.is_static,
+                'layers': len(segment.layers),
+                'animated_layer_seconds': sum(
+                    layer.duration for layer in segment.layers if layer.animated
+                ),
+                'video_seconds': sum(
+                    layer.duration for layer in segment.layers if layer.kind == 'video'
+                ),
+            })
+        return {
+            'duration': self.duration,
+            'frames': int(round(self.duration * self.fps)),
+            'size': list(self.size),
+            'fps': self.fps,
+            'segments': segments,
+        }
+
+
+class TimelineRenderer:
+    """Evaluates a TimelinePlan into moviepy clips."""
+
+    def __init__(self, plan: TimelinePlan, cache_dir: str = 'output/frame_cache'):
+        """
+        Initialize the renderer.
+
+        Args:
+            plan: Timeline plan to evaluate
+            cache_dir: Directory for pre-scaled video wallpaper frames
+        """
+        self.plan = plan
+        self.cache_dir = cache_dir
+        self._opened = []
+        self._schedulers = []
+
+        # Readers are attributed to the job that built the renderer, even
+        # when a prefetch thread opens them
+        from render.media_readers import get_reader_manager
+        self._readers = get_reader_manager()
+        self._job = self._readers.current_job()
+
+    def segment_clips(self, with_audio: bool = True) -> List:
+        """One clip per segment, in playback order."""
+        return [self.segment_clip(segment, with_audio) for segment in self.plan.segments]
+
+    def segment_clip(self, segment: Segment, with_audio: bool = True):
+        """
+        Build the composite clip for a segment.
+
+        Each layer is placed at its own time range, so the composite only
+        asks layers active at time t for frames; static layers are
+        flattened once by FlattenedCompositeClip. Layers that only play
+        during part of the segment (wallpaper slots) are opened lazily:
+        prefetched one slot ahead and released when their window ends.
+        Layers in the same sequence are joined by the transition engine.
+
+        Args:
+            segment: Segment of the plan
+            with_audio: Attach the mix of the segment's own audio tracks
+                (see mix_audio; for scenes used on their own, leave off
+                when the plan-wide mix is used)
+        """
+        from jobs import tracing
+        from render.lazy_sources import SourceScheduler
+
+        with tracing.span(f'build {segment.name}', layers=len(segment.layers)):
+            return self._segment_clip(segment, with_audio, scheduler=SourceScheduler())
+
+    def _segment_clip(self, segment: Segment, with_audio: bool, scheduler):
+        """Build the composite clip for a segment; see segment_clip."""
+        from render.compositor import FlattenedCompositeClip
+
+        clips = []
+        sequences = set()
+        for layer in segment.layers:
+            # Layers sharing a 'sequence' name are rendered as one clip
+            sequence = layer.params.get('sequence')
+            if sequence is None:
+                clips.append(self._layer_clip(layer, segment, scheduler))
+            elif sequence not in sequences:
+                sequences.add(sequence)
+                members = [other for other in segment.layers
+                           if other.params.get('sequence') == sequence]
+                clips.append(self._sequence_clip(members, segment, scheduler))
+        composite = FlattenedCompositeClip(clips, size=self.plan.size)
+        composite = composite.set_duration(segment.duration)
+        if scheduler.sources:
+            self._schedulers.append(scheduler)
+            composite = composite.fl(scheduler.frame_filter)
+
+        if with_audio and segment.audio:
+            from moviepy.audio.AudioClip import AudioArrayClip
+            pcm = self.mix_audio(segment=segment)
+            composite = composite.set_audio(
+                AudioArrayClip(pcm / 32768.0, fps=AUDIO_FPS).set_duration(segment.duration)
+            )
+        return composite
+
+    def standalone_clip(self, segment: Segment, with_audio: bool = True):
+        """
+        segment_clip for a scene used on its own: closing the clip also
+        closes this renderer, so callers without the renderer cannot leak
+        its readers.
+        """
+        clip = self.segment_clip(segment, with_audio)
+        close_clip = clip.close
+
+        def close():
+            close_clip()
+            self.close()
+
+        clip.close = close
+        return clip
+
+    def mix_audio(self, sample_rate: int = AUDIO_FPS, channels: int = 2,
+                  segment: Segment = None):
+        """
+        Mix every audio track of the plan in memory.
+
+        Each source is decoded to PCM once; trimming and volume are applied
+        with NumPy. Looping tracks (music) come from the process-wide music
+        bed cache, normalized and with crossfaded loop seams. This is the
+        only audio path: segment clips with their audio attached carry the
+        mix of their segment.
+
+        Args:
+            sample_rate: Sample rate of the mix
+            channels: Channel count of the mix
+            segment: Mix only this segment's own tracks, over its duration
+
+        Returns:
+            int16 PCM array (samples, channels) spanning the whole plan (or
+            the segment)
+        """
+        from audio.audio_mixer import AudioMixer, decode_audio
+        from audio.music_bed import get_music_beds
+
+        if segment is None:
+            mixer = AudioMixer(self.plan.duration, sample_rate, channels)
+            placed = [(track, seg.start) for seg in self.plan.segments
+                      for track in seg.audio]
+            placed.extend((track, 0.0) for track in self.plan.audio)
+        else:
+            mixer = AudioMixer(segment.duration, sample_rate, channels)
+            placed = [(track, 0.0) for track in segment.audio]
+
+        decoded = {}
+
+        for track, offset in placed:
+            if track.loop:
+                bed = get_music_beds().bed(track.source, track.duration, track.fingerprint,
+                                           sample_rate, channels)
+                mixer.add(bed, start=offset + track.start, volume=track.volume)
+                continue
+
+            key = track.fingerprint or track.source
+            if key not in decoded:
+                decoded[key] = decode_audio(track.source, sample_rate, channels)
+            mixer.add(
+                decoded[key],
+                start=offset + track.start,
+                duration=track.duration,
+                volume=track.volume
+            )
+        return mixer.render()
+
+    def close(self):
+        """Close every reader opened for this plan."""
+        for scheduler in self._schedulers:
+            scheduler.close()
+        self._schedulers = []
+        for clip in self._opened:
+            clip.close()
+        self._opened = []
+
+    def _open_source(self, layer: Layer):
+        """
+        Open a layer's image or video at its planned size.
+
+        Returns:
+            Tuple of (clip, readers to close when done with it)
+        """
+        from moviepy.editor import ImageClip
+        from render.assets import load_image
+
+        readers = []
+        if layer.kind == 'video' and layer.size is not None and layer.fingerprint:
+            # ffmpeg decodes once at screen size and output fps; frames are
+            # then served by index and loop if the video is too short
+            from render.video_frames import ScaledVideoSource
+            source = ScaledVideoSource(
+                layer.source, layer.size, self.plan.fps, layer.duration,
+                self.cache_dir, layer.fingerprint
+            )
+            readers.append(source)
+            return source.to_clip(layer.duration), readers
+
+        if layer.kind == 'video':
+            clip = self._readers.open_video(layer.source, job=self._job, audio=False)
+            readers.append(clip)
+            # Loop if too short
+            if clip.duration < layer.duration:
+                clip = clip.loop(duration=layer.duration)
+            else:
+                clip = clip.subclip(0, layer.duration)
+        elif layer.params.get('ken_burns') and layer.size is not None:
+            # Panned and zoomed from the wallpaper's image pyramid
+            from render.ken_burns import KenBurnsClip, get_pyramid
+            pyramid = get_pyramid(layer.source, layer.fingerprint or layer.source)
+            clip = KenBurnsClip(pyramid, layer.size, layer.duration, **layer.params['ken_burns'])
+            return clip, readers
+        else:
+            clip = ImageClip(load_image(layer.source), duration=layer.duration)
+
+        if layer.size is not None:
+            clip = clip.resize(layer.size)
+        return clip, readers
+
+    def _source_clip(self, layer: Layer, segment: Segment, scheduler=None):
+        """
+        Clip of an image or video layer's source, without transitions.
+
+        Layers that only play during part of the segment get a lazy proxy
+        with the same size, so nothing is opened to build the composition.
+        """
+        from render.lazy_sources import LazyClip, LazySource, image_has_alpha
+
+        windowed = layer.start > 0 or layer.end < segment.duration
+        if windowed and scheduler is not None and layer.size is not None:
+            source = LazySource(
+                layer.name, lambda: self._open_source(layer), layer.start, layer.end
+            )
+            scheduler.add(source)
+            clip = LazyClip(source, layer.size, layer.duration)
+            if layer.kind == 'image' and image_has_alpha(layer.source):
+                clip.mask = LazyClip(source, layer.size, layer.duration, ismask=True)
+            return clip
+
+        clip, readers = self._open_source(layer)
+        self._opened.extend(readers)
+        return clip
+
+    def _sequence_clip(self, layers: List[Layer], segment: Segment, scheduler=None):
+        """
+        One clip for layers joined by transitions, blended by the NumPy
+        transition engine.
+        """
+        from render.transitions import SequenceItem, TransitionSequenceClip
+
+        size = layers[0].size
+        if size is None or any(layer.size != size for layer in layers):
+            raise ValueError("Layers with transitions need one planned size")
+
+        start = min(layer.start for layer in layers)
+        end = max(layer.end for layer in layers)
+        items = [
+            SequenceItem(
+                self._source_clip(layer, segment, scheduler),
+                layer.start - start,
+                layer.end - start,
+                layer.transitions
+            )
+            for layer in layers
+        ]
+        clip = TransitionSequenceClip(items, size, end - start)
+        # Names the clip in frame profiles (see render/profiler.py)
+        clip.layer_name = layers[0].params.get('sequence') or layers[0].name
+        clip = clip.set_position(layers[0].position)
+        return clip.set_start(start).set_end(end)
+
+    def _layer_clip(self, layer: Layer, segment: Segment, scheduler=None):
+        """Open a layer's source and apply its size, position and transitions."""
+        if layer.kind == 'background':
+            from templates.animated_background import create_animated_background
+            clip = create_animated_background(
+                duration=layer.duration,
+                size=self.plan.size,
+                style=layer.params.get('style', 'mandala')
+            )
+        elif layer.kind == 'text':
+            return self._text_clip(layer)
+        elif layer.transitions:
+            return self._sequence_clip([layer], segment, scheduler)
+        else:
+            clip = self._source_clip(layer, segment, scheduler)
+
+        clip.layer_name = layer.name
+        clip = clip.set_position(layer.position)
+        return clip.set_start(layer.start).set_end(layer.end)
+
+    def _text_clip(self, layer: Layer):
+        """
+        Caption drawn from the glyph atlas (see render/text_overlay.py).
+
+        Text params: text, font_size, max_width, max_lines, effect,
+        effect_duration, fade_out, and center_y (vertical center of the
+        block, which is centered horizontally) instead of a position.
+        """
+        from render.text_overlay import caption_clip
+
+        params = layer.params
+        clip = caption_clip(
+            params['text'], params['font_size'], params['max_width'], layer.duration,
+            max_lines=params.get('max_lines'),
+            effect=params.get('effect'),
+            effect_duration=params.get('effect_duration', 0.5),
+            fade_out=params.get('fade_out', 0.0)
+        )
+        clip.layer_name = layer.name
+        position = layer.position
+        if 'center_y' in params:
+            position = ('center', int(round(params['center_y'] - clip.h / 2)))
+        clip = clip.set_position(position)
+        return clip.set_start(layer.start).set_end(layer.end)
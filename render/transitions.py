@@ -0,0 +1,190 @@
+"""
+NumPy transition engine.
+Renders a sequence of same-sized sources (the wallpaper slots of a scene)
+as one clip. Per frame it works out which one or two sources are active and
+the transition progress, then blends them with integer arithmetic instead
+of stacking moviepy fade effects and compose-mode masks. Every transition
+(crossfade, slide, wipe, zoom, fade to/from black) touches each output
+pixel a small constant number of times.
+
+Sources with a mask (e.g. PNG wallpapers with transparency) keep it: the
+sequence then gets a mask clip that runs the same transition over the
+sources' masks (opaque for sources without one). Fades to black only
+darken the color, as moviepy's fadein/fadeout do.
+"""
+
+from typing import List
+
+import numpy as np
+from moviepy.video.VideoClip import VideoClip
+
+# Weights are in 1/256 steps so blends stay in uint16
+_ONE = 256
+
+
+def _weight(progress: float) -> int:
+    return int(round(min(max(progress, 0.0), 1.0) * _ONE))
+
+
+def _as_uint8(frame) -> np.ndarray:
+    frame = np.asarray(frame)
+    if frame.dtype != np.uint8:
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+    return frame
+
+
+def crossfade(a, b, progress: float) -> np.ndarray:
+    """Blend from `a` to `b`."""
+    w = _weight(progress)
+    if w == 0:
+        return a
+    if w == _ONE:
+        return b
+    out = a.astype(np.uint16) * (_ONE - w)
+    out += b.astype(np.uint16) * w
+    out >>= 8
+    return out.astype(np.uint8)
+
+
+def fade_black(frame, progress: float) -> np.ndarray:
+    """Scale `frame` by `progress` (0 = black, 1 = unchanged)."""
+    w = _weight(progress)
+    if w == _ONE:
+        return frame
+    out = frame.astype(np.uint16) * w
+    out >>= 8
+    return out.astype(np.uint8)
+
+
+def slide(a, b, progress: float) -> np.ndarray:
+    """`b` pushes `a` out to the left."""
+    width = a.shape[1]
+    offset = int(round(min(max(progress, 0.0), 1.0) * width))
+    out = np.empty_like(a)
+    out[:, :width - offset] = a[:, offset:]
+    out[:, width - offset:] = b[:, :offset]
+    return out
+
+
+def wipe(a, b, progress: float) -> np.ndarray:
+    """`b` is revealed from left to right."""
+    edge = int(round(min(max(progress, 0.0), 1.0) * a.shape[1]))
+    out = a.copy()
+    out[:, :edge] = b[:, :edge]
+    return out
+
+
+def zoom(a, b, progress: float, scale: float = 0.25) -> np.ndarray:
+    """`a` zooms in towards its center while crossfading into `b`."""
+    height, width = a.shape[:2]
+    factor = 1.0 + scale * min(max(progress, 0.0), 1.0)
+    # Nearest-neighbour sampling of the centered crop
+    ys = ((np.arange(height) - height / 2) / factor + height / 2).astype(np.intp)
+    xs = ((np.arange(width) - width / 2) / factor + width / 2).astype(np.intp)
+    zoomed = a.take(ys, axis=0).take(xs, axis=1)
+    return crossfade(zoomed, b, progress)
+
+
+TRANSITIONS = {
+    'crossfade': crossfade,
+    'slide': slide,
+    'wipe': wipe,
+    'zoom': zoom,
+}
+
+
+class SequenceItem:
+    """One source in a transition sequence; times are sequence-relative."""
+
+    def __init__(self, clip, start: float, end: float, transitions: List):
+        """
+        Args:
+            clip: Source clip at the sequence size (frames from time 0)
+            start: Time the item starts
+            end: Time the item ends
+            transitions: Transition specs with kind, edge and duration
+        """
+        self.clip = clip
+        self.start = start
+        self.end = end
+        self.transition_in = None
+        self.fade_in = None
+        self.fade_out = None
+        for transition in transitions:
+            if transition.kind == 'fade':
+                if transition.edge == 'in':
+                    self.fade_in = transition.duration
+                else:
+                    self.fade_out = transition.duration
+            elif transition.edge == 'in':
+                if transition.kind not in TRANSITIONS:
+                    raise ValueError(f"Unknown transition: {transition.kind}")
+                self.transition_in = transition
+
+    def mask_frame(self, t: float) -> np.ndarray:
+        """Mask at sequence time `t` as uint8 (255 = opaque)."""
+        mask = self.clip.mask
+        if mask is None:
+            width, height = self.clip.size
+            return np.full((height, width), 255, np.uint8)
+        frame = np.asarray(mask.get_frame(t - self.start), dtype=np.float32)
+        return np.clip(frame * 255 + 0.5, 0, 255).astype(np.uint8)
+
+    def frame(self, t: float) -> np.ndarray:
+        """Frame at sequence time `t`, with edge fades applied."""
+        local = t - self.start
+        frame = _as_uint8(self.clip.get_frame(local))
+        if self.fade_in and local < self.fade_in:
+            frame = fade_black(frame, local / self.fade_in)
+        if self.fade_out and self.end - t < self.fade_out:
+            frame = fade_black(frame, (self.end - t) / self.fade_out)
+        return frame
+
+
+class TransitionSequenceClip(VideoClip):
+    """Sequence of sources joined by NumPy transitions."""
+
+    def __init__(self, items: List[SequenceItem], size, duration: float):
+        """
+        Args:
+            items: Sequence items ordered by start time
+            size: (width, height) shared by all sources
+            duration: Duration of the sequence
+        """
+        VideoClip.__init__(self, duration=duration)
+        self.items = sorted(items, key=lambda item: item.start)
+        self.size = tuple(size)
+        width, height = self.size
+        self._black = np.zeros((height, width, 3), np.uint8)
+        self.make_frame = self._make_frame
+        if any(getattr(item.clip, 'mask', None) is not None for item in self.items):
+            self.mask = VideoClip(ismask=True, duration=duration)
+            self.mask.size = self.size
+            self.mask.make_frame = self._make_mask_frame
+
+    def active_items(self, t: float) -> List[SequenceItem]:
+        return [item for item in self.items if item.start <= t < item.end]
+
+    def _blend(self, t, item_frame, empty):
+        active = self.active_items(t)
+        if not active:
+            return empty
+        if len(active) == 1:
+            return item_frame(active[0], t)
+
+        # Overlap: the later item transitions in over the earlier one
+        previous, current = active[-2], active[-1]
+        a = item_frame(previous, t)
+        b = item_frame(current, t)
+        spec = current.transition_in
+        if spec is None:
+            return b
+        progress = (t - current.start) / spec.duration if spec.duration else 1.0
+        return TRANSITIONS[spec.kind](a, b, progress)
+
+    def _make_frame(self, t):
+        return self._blend(t, SequenceItem.frame, self._black)
+
+    def _make_mask_frame(self, t):
+        mask = self._blend(t, SequenceItem.mask_frame, self._black[:, :, 0])
+        return mask.astype(np.float32) / 255
@@ -0,0 +1,104 @@
+"""
+Pre-scaled video wallpaper frames.
+ffmpeg decodes a video wallpaper once, directly at phone-screen size and
+at the output frame rate, into a raw RGB frame file. Frames are then served
+by index from a memory map, with no per-frame resize or seeking; wallpapers
+shorter than their slot loop over the cached frames.
+"""
+
+import os
+import subprocess
+import threading
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.video.VideoClip import VideoClip
+
+from jobs import tracing
+from jobs.storage import touch
+from render.media_readers import get_reader_manager
+
+
+class ScaledVideoSource:
+    """Raw frame cache of one video wallpaper at a given size and fps."""
+
+    def __init__(self, path: str, size, fps: int, duration: float,
+                 cache_dir: str, fingerprint: str):
+        """
+        Decode the video into the cache if needed and map it.
+
+        Args:
+            path: Video file path
+            size: (width, height) to decode at
+            fps: Frame rate to decode at
+            duration: Longest stretch that will be played (caps decoding)
+            cache_dir: Directory holding raw frame files
+            fingerprint: Content hash of the video (cache key)
+        """
+        self.path = path
+        self.size = tuple(size)
+        self.fps = fps
+
+        width, height = self.size
+        max_frames = max(1, int(round(duration * fps)))
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_path = os.path.join(
+            cache_dir, f'{fingerprint}_{width}x{height}_{fps}fps_{max_frames}.rgb'
+        )
+        if os.path.exists(self.cache_path):
+            # Keeps it out of the storage sweep's eviction order
+            touch(self.cache_path)
+        else:
+            self._decode(max_frames)
+
+        frame_bytes = width * height * 3
+        count = os.path.getsize(self.cache_path) // frame_bytes
+        if count == 0:
+            raise IOError(f"No frames could be decoded from {path}")
+        self.frames = np.memmap(self.cache_path, dtype=np.uint8, mode='r',
+                                shape=(count, height, width, 3))
+
+    def _decode(self, max_frames: int):
+        """Let ffmpeg scale and resample the video into the cache file."""
+        width, height = self.size
+        # Unique per thread too: two jobs may decode the same upload at once
+        tmp_path = f'{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        cmd = [
+            get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+            '-i', self.path,
+            '-an',
+            '-vf', f'fps={self.fps},scale={width}:{height}',
+            '-frames:v', str(max_frames),
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', tmp_path
+        ]
+        with get_reader_manager().slot():
+            with tracing.span('ffmpeg scale video', cat='subprocess', path=self.path):
+                proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise IOError(
+                "ffmpeg failed to decode %s:\n%s" % (self.path, proc.stderr.decode(errors='replace'))
+            )
+        os.replace(tmp_path, self.cache_path)
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.frames)
+
+    def frame_index(self, t: float) -> int:
+        """Index of the cached frame shown at time `t`, looping the cache."""
+        return int(t * self.fps + 1e-6) % self.frame_count
+
+    def get_frame(self, t: float):
+        return self.frames[self.frame_index(t)]
+
+    def to_clip(self, duration: float) -> VideoClip:
+        """VideoClip serving cached frames for `duration` seconds."""
+        clip = VideoClip(make_frame=self.get_frame, duration=duration)
+        clip.fps = self.fps
+        return clip
+
+    def close(self):
+        """Unmap the frame file."""
+        self.frames = None
@@ -22,6 +22,13 @@ class ScriptGenerator:
         }
     }
     
+    # Scenes whose script depends only on the language, so their
+    # voiceovers can be generated once and reused
+    STATIC_SCENES = ('scene2',)
+    # Static scene voiced over the closing Play Store segment, which is
+    # encoded once per language (see render/closing_segment.py)
+    CLOSING_SCENE = 'scene2'
+    
     @staticmethod
     def generate_scene1_script(god_name: str, custom_text: str, language: str) -> str:
         """
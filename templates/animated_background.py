@@ -9,24 +9,51 @@ Animated Background Generator
 Creates decorative animated backgrounds for video scenes.
 """
 
-from moviepy.editor import ColorClip, CompositeVideoClip, ImageClip
+from moviepy.video.VideoClip import ImageClip, VideoClip
+from moviepy.video.fx.rotate import rotate
 from PIL import Image, ImageDraw
 import numpy as np
 import math
+from render.bake import array_name, get_bake
+from render.compositor import FlattenedCompositeClip
 
+# Default gradient: crimson, orange red, dark orange
+DEFAULT_COLORS = [
+    (220, 20, 60),
+    (255, 69, 0),
+    (255, 140, 0),
+]
 
-def create_rotating_mandala(duration, size=(720, 1280), rotation_speed=30):
-    """
-    Create a rotating mandala/Om symbol background.
+# The mandala looks the same after 1/12 of a turn
+MANDALA_SYMMETRY = 12
+
+# Rotation of the mandala in the animated background (degrees per second)
+MANDALA_ROTATION_SPEED = 20
+
+# Drawn background images, shared by every scene (and, when warmed up
+# before gunicorn forks, by every worker)
+_images = {}
+
+
+def _baked_image(kind, size):
+    """Background image from the build-time bake, or None."""
+    baked = get_bake()
+    if baked is None:
+        return None
+    return baked.array(array_name(kind, size))
+
+
+def _mandala_image(size):
+    """RGBA mandala artwork for a background of `size`, drawn once."""
+    key = ('mandala', tuple(size))
+    if key in _images:
+        return _images[key]
     
-    Args:
-        duration: Duration in seconds
-        size: (width, height) tuple
-        rotation_speed: Degrees per second
+    baked = _baked_image('mandala', size)
+    if baked is not None:
+        _images[key] = baked
+        return baked
     
-    Returns:
-        VideoClip with rotating mandala
-    """
     width, height = size
     
     # Create mandala image
@@ -57,43 +84,23 @@ def create_rotating_mandala(duration, size=(720, 1280), rotation_speed=30):
                 fill=(255, 165, 0, 80)
             )
     
-    # Save mandala
-    mandala_path = 'assets/temp_mandala.png'
-    os.makedirs('assets', exist_ok=True)
-    mandala_img.save(mandala_path)
-    
-    # Create rotating clip
-    mandala_clip = ImageClip(mandala_path, duration=duration)
-    
-    # Apply rotation animation
-    def rotate_frame(t):
-        angle = (rotation_speed * t) % 360
-        return angle
-    
-    mandala_clip = mandala_clip.rotate(lambda t: rotate_frame(t), expand=False)
-    mandala_clip = mandala_clip.set_position('center')
-    
-    return mandala_clip
+    image = np.array(mandala_img)
+    image.setflags(write=False)
+    _images[key] = image
+    return image
 
 
-def create_gradient_background(duration, size=(720, 1280), colors=None):
-    """
-    Create an animated gradient background.
-    
-    Args:
-        duration: Duration in seconds
-        size: (width, height) tuple
-        colors: List of color tuples, default is orange/red theme
+def _gradient_image(size, colors):
+    """RGB vertical gradient for a background of `size`, drawn once."""
+    key = ('gradient', tuple(size), tuple(map(tuple, colors)))
+    if key in _images:
+        return _images[key]
     
-    Returns:
-        VideoClip with gradient background
-    """
-    if colors is None:
-        colors = [
-            (220, 20, 60),    # Crimson
-            (255, 69, 0),     # Orange Red
-            (255, 140, 0),    # Dark Orange
-        ]
+    if [tuple(color) for color in colors] == DEFAULT_COLORS:
+        baked = _baked_image('gradient', size)
+        if baked is not None:
+            _images[key] = baked
+            return baked
     
     width, height = size
     
@@ -120,13 +127,128 @@ def create_gradient_background(duration, size=(720, 1280), colors=None):
         
         draw.line([(0, y), (width, y)], fill=(r, g, b))
     
-    # Save gradient
-    gradient_path = 'assets/temp_gradient.png'
-    os.makedirs('assets', exist_ok=True)
-    img.save(gradient_path)
+    image = np.array(img)
+    image.setflags(write=False)
+    _images[key] = image
+    return image
+
+
+def render_mandala_loop(size, fps):
+    """
+    Render one seamless loop of the mandala background.
+    
+    Thanks to the mandala's symmetry the background repeats every 1/12
+    turn, so those frames can be served for any duration.
+    
+    Args:
+        size: (width, height) of the background
+        fps: Frame rate of the loop
+    
+    Returns:
+        uint8 array of frames (N, height, width, 3)
+    """
+    period = 360.0 / MANDALA_SYMMETRY / MANDALA_ROTATION_SPEED
+    count = int(round(period * fps))
+    background = _create_mandala_background(period, size)
+    return np.stack([
+        np.asarray(background.get_frame(i / fps), dtype=np.uint8)
+        for i in range(count)
+    ])
+
+
+def _looped_clip(frames, fps, duration):
+    """VideoClip serving a frame loop for `duration` seconds."""
+    count = len(frames)
+    clip = VideoClip(
+        make_frame=lambda t: frames[int(t * fps + 1e-6) % count],
+        duration=duration
+    )
+    clip.fps = fps
+    return clip
+
+
+def _cropped_loop_clip(frames, fps, duration, size):
+    """
+    VideoClip serving a loop baked for another aspect ratio: each frame is
+    the centered crop of the target's aspect, resized only if the crop is
+    not already at the target size.
+    """
+    width, height = size
+    source_height, source_width = frames.shape[1:3]
+    scale = min(source_width / width, source_height / height)
+    crop_width, crop_height = int(round(width * scale)), int(round(height * scale))
+    x = (source_width - crop_width) // 2
+    y = (source_height - crop_height) // 2
+    count = len(frames)
     
-    # Create clip
-    gradient_clip = ImageClip(gradient_path, duration=duration)
+    def make_frame(t):
+        frame = frames[int(t * fps + 1e-6) % count][y:y + crop_height, x:x + crop_width]
+        if (crop_width, crop_height) != (width, height):
+            frame = np.asarray(Image.fromarray(np.ascontiguousarray(frame)).resize(
+                (width, height), Image.BILINEAR
+            ))
+        return frame
+    
+    clip = VideoClip(make_frame=make_frame, duration=duration)
+    clip.fps = fps
+    return clip
+
+
+def warm_up(sizes=((1080, 1920),)):
+    """
+    Draw the background images for the given sizes ahead of time.
+    
+    Args:
+        sizes: Background (width, height) sizes to prepare
+    """
+    for size in sizes:
+        _gradient_image(size, DEFAULT_COLORS)
+        _mandala_image(size)
+
+
+def create_rotating_mandala(duration, size=(720, 1280), rotation_speed=30):
+    """
+    Create a rotating mandala/Om symbol background.
+    
+    Args:
+        duration: Duration in seconds
+        size: (width, height) tuple
+        rotation_speed: Degrees per second
+    
+    Returns:
+        VideoClip with rotating mandala
+    """
+    # Create rotating clip from the shared mandala artwork
+    mandala_clip = ImageClip(_mandala_image(size), duration=duration)
+    
+    # Apply rotation animation
+    def rotate_frame(t):
+        angle = (rotation_speed * t) % 360
+        return angle
+    
+    mandala_clip = mandala_clip.fx(rotate, lambda t: rotate_frame(t), expand=False)
+    mandala_clip = mandala_clip.set_position('center')
+    
+    return mandala_clip
+
+
+def create_gradient_background(duration, size=(720, 1280), colors=None):
+    """
+    Create an animated gradient background.
+    
+    Args:
+        duration: Duration in seconds
+        size: (width, height) tuple
+        colors: List of color tuples, default is orange/red theme
+    
+    Returns:
+        VideoClip with gradient background
+    """
+    if colors is None:
+        colors = DEFAULT_COLORS
+    
+    # Create clip from the shared gradient image
+    gradient_clip = ImageClip(_gradient_image(size, colors), duration=duration)
     
     return gradient_clip
 
@@ -143,25 +265,38 @@ def create_animated_background(duration, size=(720, 1280), style='mandala'):
     Returns:
         CompositeVideoClip with animated background
     """
-    width, height = size
+    if style == 'mandala':
+        # Pre-rendered loop from the build-time bake, if there is one
+        baked = get_bake()
+        loop = baked.background_loop(style, size) if baked is not None else None
+        if loop is not None:
+            frames, fps = loop
+            return _looped_clip(frames, fps, duration)
+        # Other output formats share the loop of the primary format
+        from render.bake import BACKGROUND_SIZES
+        shared = baked.background_loop(style, BACKGROUND_SIZES[0]) if baked is not None else None
+        if shared is not None:
+            frames, fps = shared
+            return _cropped_loop_clip(frames, fps, duration, size)
+        return _create_mandala_background(duration, size)
     
+    return create_gradient_background(duration, size)
+
+
+def _create_mandala_background(duration, size):
+    """Gradient with the rotating mandala composited on top, per frame."""
     # Base gradient
     gradient = create_gradient_background(duration, size)
     
-    if style == 'mandala':
-        # Add rotating mandala overlay
-        mandala = create_rotating_mandala(duration, size, rotation_speed=20)
-        mandala = mandala.set_opacity(0.3)  # Semi-transparent
-        
-        # Composite
-        background = CompositeVideoClip(
-            [gradient, mandala],
-            size=size
-        )
-    else:
-        background = gradient
+    # Add rotating mandala overlay
+    mandala = create_rotating_mandala(duration, size, rotation_speed=MANDALA_ROTATION_SPEED)
+    mandala = mandala.set_opacity(0.3)  # Semi-transparent
     
-    return background
+    # Composite
+    return FlattenedCompositeClip(
+        [gradient, mandala],
+        size=size
+    )
 
 
 if __name__ == '__main__':
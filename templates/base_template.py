@@ -4,7 +4,9 @@ Coordinates all scenes, voiceovers, and final composition.
 """
 
 import os
+import shutil
 import sys
+import threading
 
 # Apply MoviePy compatibility patch BEFORE moviepy imports
 try:
@@ -16,15 +18,27 @@ try:
 except ImportError:
     pass  # Compatibility patch not found, continue anyway
 
-from moviepy.editor import (
-    concatenate_videoclips, AudioFileClip,
-    CompositeVideoClip, VideoFileClip
-)
-from typing import Dict, List, Union
+from typing import Dict
 from scripts.script_generator import ScriptGenerator
 from audio.voice_generator import VoiceGenerator
+from jobs import tracing
+from jobs.memory import MemoryMonitor
 from templates.scene_multi_wallpapers import MultiWallpaperScene
 from templates.scene3_install import Scene3PlayStoreInstall
+from render.assets import asset_source, get_asset_registry
+from render.closing_segment import ClosingSegmentCache, closing_key
+from render.encoder import RenderOutput, SegmentRenderer
+from render.formats import DEFAULT_FORMAT, FORMATS, OutputFormat, get_formats
+from render.ken_burns import clear_pyramids
+from render.media_readers import get_reader_manager
+from render.previews import PreviewCollector, preview_dir
+from render.profiler import PROFILE, FrameProfiler, profile_dir
+from render.segment_cache import SegmentCache, plan_chunks
+from render.streaming import HlsPlaylist, stream_dir
+from render.timeline import AudioTrack, Segment, TimelinePlan, TimelineRenderer, file_fingerprint
+
+# Frame rate of the ad (sizes come from render.formats)
+VIDEO_FPS = 30
 
 
 class VideoTemplate:
@@ -41,15 +55,44 @@ class VideoTemplate:
         self.assets_dir = assets_dir
         self.output_dir = output_dir
         self.voice_generator = VoiceGenerator()
+        self.static_voice_dir = os.path.join(output_dir, 'static_voice')
+        # Per-video voiceovers, keyed by language and script
+        self.voice_cache_dir = os.path.join(output_dir, 'voice_cache')
+        # Encoded chunks reused when a video is rendered again with edits
+        self.segment_cache = SegmentCache(os.path.join(output_dir, 'segment_cache'))
+        # The closing scene of each language, encoded once
+        self.closing_segments = ClosingSegmentCache(os.path.join(output_dir, 'closing_segments'))
+        # Memory accounting of the last render (see jobs/memory.py)
+        self.memory_report = None
+        
+        # assets/phone_mockup.png when present, otherwise drawn in memory
+        get_asset_registry().register(
+            'phone_mockup', self._create_phone_mockup,
+            path=os.path.join(assets_dir, 'phone_mockup.png')
+        )
         
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
         os.makedirs(os.path.join(output_dir, 'temp_audio'), exist_ok=True)
+        os.makedirs(self.static_voice_dir, exist_ok=True)
     
-    def generate_video(self, params: Dict) -> str:
+    def generate_video(self, params: Dict, abort: threading.Event = None) -> str:
         """
         Generate complete ad video from parameters.
         
+        Args:
+            params: See generate_videos
+            abort: See generate_videos
+                
+        Returns:
+            Path to the video of the primary (first) format
+        """
+        return next(iter(self.generate_videos(params, abort).values()))
+    
+    def generate_videos(self, params: Dict, abort: threading.Event = None) -> Dict[str, str]:
+        """
+        Generate the ad video in every requested format.
+        
         Args:
             params: Dictionary containing:
                 - wallpaper: Path to single wallpaper (backward compatible)
@@ -58,10 +101,42 @@ class VideoTemplate:
                 - god_name: Name of deity
                 - custom_text: Custom promotional text
                 - language_code: Language code (en, hi, etc.)
+                - job_id: Optional id that keeps this video's files apart
+                  from concurrent renders
+                - formats: Optional output format names (see
+                  render.formats.FORMATS), the primary one first; 9:16 only
+                  by default
+                - stream: Also publish the primary format as a progressive
+                  HLS stream under output/streams/<job_id> (see
+                  render.streaming)
+                - profile: Time every layer of the composition and write a
+                  report and folded stacks under output/profiles/ (see
+                  render.profiler); also enabled by RENDER_PROFILE=1
+            abort: Event that stops the render between chunks (raising
+                RenderAborted), e.g. when the job's lease is lost
                 
         Returns:
-            Path to generated video file
+            Dict of format name to video path, in the requested order
+            
+        Raises:
+            MemoryBudgetExceeded: The render grew past JOB_MEMORY_BUDGET_MB
+                (its memory report is still left in memory_report)
         """
+        # Peak memory of the render is kept in memory_report; past the soft
+        # limit it switches to a low-memory mode, past the budget it stops
+        memory = MemoryMonitor(params.get('job_id') or params['god_name'])
+        memory.on_low_memory(clear_pyramids)
+        try:
+            # Every ffmpeg reader opened for this video is closed when it ends
+            with memory, get_reader_manager().job():
+                return self._generate_video(params, abort, memory)
+        finally:
+            tracing.end_step()
+            self.memory_report = memory.report()
+    
+    def _generate_video(self, params: Dict, abort: threading.Event,
+                        memory: MemoryMonitor) -> Dict[str, str]:
+        """Run the generation steps; see generate_videos."""
         # Support both single wallpaper and multiple wallpapers
         if 'wallpapers' in params:
             wallpapers = params['wallpapers']
@@ -75,6 +150,8 @@ class VideoTemplate:
         god_name = params['god_name']
         custom_text = params.get('custom_text', '')
         language = params['language_code']
+        job_id = params.get('job_id')
+        profile = bool(params.get('profile')) or PROFILE
         
         try:
             print(f"Generating video for {god_name} in language: {language}")
@@ -83,6 +160,7 @@ class VideoTemplate:
         print(f"Using {len(wallpapers)} wallpaper(s)")
         
         # Step 1: Generate scripts for all scenes
+        self._begin_step(memory, 'scripts')
         print("Step 1: Generating scripts...")
         scripts = ScriptGenerator.generate_all_scripts(god_name, custom_text, language)
         try:
@@ -93,99 +171,274 @@ class VideoTemplate:
             print("  Scene 2: [Script generated]")
         
         # Step 2: Generate voiceovers
+        self._begin_step(memory, 'voiceovers')
         print("\nStep 2: Generating voiceovers...")
         voiceover_paths = {}
         voiceover_durations = {}
         
         for scene_name, script_text in scripts.items():
-            audio_path = os.path.join(self.output_dir, 'temp_audio', f'{scene_name}_vo.mp3')
-            path, duration = self.voice_generator.generate_voiceover(
-                script_text, language, audio_path
-            )
+            with tracing.span(f'voiceover {scene_name}', cat='tts'):
+                if scene_name in ScriptGenerator.STATIC_SCENES:
+                    # Same text for every video in this language: reuse it
+                    path, duration = self.voice_generator.static_voiceover(
+                        script_text, language, self.static_voice_dir
+                    )
+                else:
+                    # Unchanged scripts (e.g. only a wallpaper was swapped) reuse theirs
+                    path, duration = self.voice_generator.cached_voiceover(
+                        script_text, language, self.voice_cache_dir
+                    )
             voiceover_paths[scene_name] = path
             voiceover_durations[scene_name] = duration
             print(f"  {scene_name}: {duration:.2f}s")
         
-        # Step 3: Create scenes
-        print("\nStep 3: Creating scenes...")
+        # Step 3: Plan the timeline of every output format
+        # Durations are resolved once here from the measured voiceovers;
+        # the formats share them (and so their chunk boundaries) and only
+        # differ in layout
+        self._begin_step(memory, 'plan')
+        print("\nStep 3: Planning timeline...")
+        formats = get_formats(params.get('formats'))
         
         # Asset paths
-        phone_mockup = os.path.join(self.assets_dir, 'phone_mockup.png')
-        playstore_mockup = os.path.join(self.assets_dir, 'playstore.png')
-        
-        # Create phone mockup if it doesn't exist
-        if not os.path.exists(phone_mockup):
-            print("  Creating phone mockup...")
-            self._create_phone_mockup(phone_mockup)
-        
-        # Scene 1: Multi-Wallpaper Showcase
-        print(f"  Creating Scene 1: Multi-Wallpaper Showcase ({len(wallpapers)} wallpapers)...")
+        phone_mockup = asset_source('phone_mockup')
         scene1 = MultiWallpaperScene(phone_mockup)
-        scene1_clip = scene1.create(
-            wallpapers=wallpapers,
-            voiceover_path=voiceover_paths['scene1'],
-            duration_per_wallpaper=4  # 4 seconds per wallpaper
-        )
         
-        # Scene 2: Play Store Install
-        print("  Creating Scene 2: Play Store Install...")
-        scene2 = Scene3PlayStoreInstall(phone_mockup, playstore_mockup)
-        scene2_clip = scene2.create(
-            voiceover_paths['scene2'],
-            voiceover_durations['scene2']
-        )
-        
-        # Step 4: Concatenate scenes
-        print("\nStep 4: Concatenating scenes...")
-        final_video = concatenate_videoclips([scene1_clip, scene2_clip])
-        
-        # Step 5: Add background music (optional)
-        background_music_path = os.path.join(self.assets_dir, 'background_music.mp3')
-        if os.path.exists(background_music_path):
-            print("Step 5: Adding background music...")
-            bg_music = AudioFileClip(background_music_path)
+        plans = []
+        for output_format in formats:
+            # Scene 1: Multi-Wallpaper Showcase
+            print(f"  Planning {output_format.name} Scene 1: Multi-Wallpaper Showcase "
+                  f"({len(wallpapers)} wallpapers)...")
+            scene1_segment = scene1.plan(
+                wallpapers=wallpapers,
+                voiceover_path=voiceover_paths['scene1'],
+                voiceover_duration=voiceover_durations['scene1'],
+                duration_per_wallpaper=4,  # 4 seconds per wallpaper
+                output_format=output_format,
+                title=god_name,
+                caption=custom_text
+            )
             
-            # Loop background music to match video duration
-            if bg_music.duration < final_video.duration:
-                num_loops = int(final_video.duration / bg_music.duration) + 1
-                bg_music = concatenate_videoclips([bg_music] * num_loops)
+            # Scene 2: Play Store Install
+            print(f"  Planning {output_format.name} Scene 2: Play Store Install...")
+            scene2_segment = self._closing_segment(
+                voiceover_paths['scene2'],
+                voiceover_durations['scene2'],
+                output_format
+            )
             
-            bg_music = bg_music.subclip(0, final_video.duration)
+            # Background music (optional), looped under the whole ad
+            plan_audio = []
+            background_music_path = os.path.join(self.assets_dir, 'background_music.mp3')
+            if os.path.exists(background_music_path):
+                plan_audio.append(AudioTrack(
+                    name='background_music',
+                    source=background_music_path,
+                    start=0,
+                    duration=scene1_segment.duration + scene2_segment.duration,
+                    fingerprint=file_fingerprint(background_music_path),
+                    volume=0.2,  # Lower volume of background music
+                    loop=True
+                ))
             
-            # Lower volume of background music
-            bg_music = bg_music.volumex(0.2)
+            plan = TimelinePlan(
+                size=output_format.size,
+                fps=VIDEO_FPS,
+                segments=[scene1_segment, scene2_segment],
+                audio=plan_audio
+            )
+            print(f"  Timeline {output_format.name}: {plan.duration:.1f}s, plan {plan.digest()[:12]}")
+            plans.append(plan)
+        
+        # Step 4: Build scene clips from the plans
+        self._begin_step(memory, 'scenes')
+        print("\nStep 4: Building scenes from timeline...")
+        segment_renderer = self._segment_renderer(VIDEO_FPS, memory)
+        renderers = []
+        outputs = []
+        try:
+            for output_format, plan in zip(formats, plans):
+                scene1_segment, scene2_segment = plan.segments
+                renderer = TimelineRenderer(plan, cache_dir=os.path.join(self.output_dir, 'frame_cache'))
+                renderers.append(renderer)
+                # One chunk per wallpaper slot; a scene is only built if one
+                # of its chunks is not in the segment cache. The closing
+                # scene is the same in every ad of the language and is
+                # appended pre-encoded
+                chunks = plan_chunks(plan, renderer, segment_renderer.encoding(),
+                                     segments=[scene1_segment])
+                outputs.append(RenderOutput(
+                    chunks,
+                    self._output_path(god_name, language, job_id, output_format),
+                    # Poster, thumbnails and sprite sheet come from the
+                    # frames being encoded
+                    PreviewCollector(plan.duration, plan.fps),
+                    profiler=FrameProfiler() if profile else None
+                ))
+                chunks.append(self.closing_segments.chunk(
+                    language, plan, scene2_segment, renderer, segment_renderer
+                ))
             
-            # Mix with existing audio
-            from moviepy.audio.AudioClip import CompositeAudioClip
-            final_audio = CompositeAudioClip([final_video.audio, bg_music])
-            final_video = final_video.set_audio(final_audio)
-        
-        # Step 6: Render final video
-        print("\nStep 6: Rendering final video...")
-        output_filename = f"{god_name.replace(' ', '_')}_{language}_ad.mp4"
-        output_path = os.path.join(self.output_dir, output_filename)
-        
-        final_video.write_videofile(
-            output_path,
-            fps=30,
+            # The primary format is also published as HLS while it renders,
+            # so playback can start before the final MP4 is muxed
+            if params.get('stream'):
+                primary = outputs[0]
+                stream_id = job_id or os.path.splitext(os.path.basename(primary.output_path))[0]
+                directory = stream_dir(self.output_dir, stream_id)
+                shutil.rmtree(directory, ignore_errors=True)
+                primary.stream = HlsPlaylist(
+                    directory, max(chunk.duration for chunk in primary.chunks)
+                )
+                print(f"  Streaming {formats[0].name} to {directory}")
+            
+            # Step 5: Mix voiceovers and background music in memory, once
+            # for all formats
+            self._begin_step(memory, 'audio')
+            print("Step 5: Mixing audio...")
+            final_audio = renderers[0].mix_audio(sample_rate=44100)
+            
+            # Step 6: Render final videos
+            # Each chunk is encoded on its own (static scenes from a single
+            # looped frame) or reused from the cache, the formats of a chunk
+            # side by side, and each format's chunks are joined by stream copy
+            self._begin_step(memory, 'render')
+            print("\nStep 6: Rendering final video...")
+            # A profiled render composes every chunk instead of reusing
+            # cached ones
+            segment_renderer.render_outputs(outputs, audio=final_audio,
+                                            cache=None if profile else self.segment_cache,
+                                            abort=abort)
+            for output in outputs:
+                with tracing.span('save previews', path=output.output_path):
+                    output.previews.save(preview_dir(output.output_path))
+                if output.profiler is not None:
+                    directory = profile_dir(output.output_path)
+                    output.profiler.save(directory)
+                    print(f"  Frame profile: {directory}")
+                    print(output.profiler.report(limit=10))
+        finally:
+            # Cleanup
+            for output in outputs:
+                for chunk in output.chunks:
+                    chunk.close()
+            for renderer in renderers:
+                renderer.close()
+        
+        output_paths = {output_format.name: output.output_path
+                        for output_format, output in zip(formats, outputs)}
+        for output_path in output_paths.values():
+            try:
+                print(f"\nVideo generated successfully: {output_path}")
+            except UnicodeEncodeError:
+                print("\nVideo generated successfully!")
+        return output_paths
+    
+    @staticmethod
+    def _begin_step(memory: MemoryMonitor, step: str):
+        """Attribute what follows to a generation step (memory and trace)."""
+        memory.begin_step(step)
+        tracing.begin_step(step)
+    
+    def _output_path(self, god_name: str, language: str, job_id: str,
+                     output_format: OutputFormat) -> str:
+        """Output file of a format (the primary format has no suffix)."""
+        parts = [god_name.replace(' ', '_'), language]
+        if job_id:
+            parts.append(job_id[:8])
+        if output_format.suffix:
+            parts.append(output_format.suffix)
+        return os.path.join(self.output_dir, '_'.join(parts) + '_ad.mp4')
+    
+    def _segment_renderer(self, fps: int, memory: MemoryMonitor = None) -> SegmentRenderer:
+        """Encoder of the ad (shared by chunks and closing segments)."""
+        return SegmentRenderer(
+            fps=fps,
             codec='libx264',
             audio_codec='aac',
-            temp_audiofile=os.path.join(self.output_dir, 'temp_audio', 'temp-audio.m4a'),
-            remove_temp=True
+            temp_dir=os.path.join(self.output_dir, 'temp_audio'),
+            memory=memory
         )
+    
+    def _closing_segment(self, voiceover_path: str, duration: float,
+                         output_format: OutputFormat) -> Segment:
+        """Plan the closing Play Store scene."""
+        scene = Scene3PlayStoreInstall(
+            asset_source('phone_mockup'),
+            os.path.join(self.assets_dir, 'playstore.png')
+        )
+        return scene.plan(voiceover_path, duration, output_format)
+    
+    def prepare_closing(self, language: str, voiceover_path: str, duration: float,
+                        output_format: OutputFormat = None):
+        """
+        Encode the closing scene of a language ahead of its first ad.
         
-        # Cleanup
-        scene1_clip.close()
-        scene2_clip.close()
-        final_video.close()
-        
+        Args:
+            language: Language code
+            voiceover_path: The language's closing voiceover
+            duration: Its duration
+            output_format: Format to encode it in (9:16 by default)
+            
+        Returns:
+            Tuple of (key, (video path, still frame path))
+        """
+        output_format = output_format or FORMATS[DEFAULT_FORMAT]
+        segment = self._closing_segment(voiceover_path, duration, output_format)
+        plan = TimelinePlan(size=output_format.size, fps=VIDEO_FPS, segments=[segment])
+        renderer = TimelineRenderer(plan, cache_dir=os.path.join(self.output_dir, 'frame_cache'))
+        segment_renderer = self._segment_renderer(plan.fps)
+        key = closing_key(language, segment, plan.size, plan.fps, segment_renderer.encoding())
         try:
-            print(f"\nVideo generated successfully: {output_path}")
-        except UnicodeEncodeError:
-            print("\nVideo generated successfully!")
-        return output_path
+            return key, self.closing_segments.prepare(key, plan, segment, renderer, segment_renderer)
+        finally:
+            renderer.close()
+    
+    def warm_up(self, languages=None):
+        """
+        Prepare everything that is shared between videos.
+        
+        Meant to run once in the gunicorn master (preload_app) so forked
+        workers share the results copy-on-write: heavy media imports, the
+        registered mockups and placeholders, background artwork, the music
+        bed, and the static voiceovers and encoded closing scene of every
+        language (in every format).
+        
+        Args:
+            languages: Language codes to prepare (defaults to all scripts)
+        """
+        import moviepy.editor  # noqa: F401 (loads and patches all clip methods)
+        import templates.scene2_showcase  # noqa: F401 (registers its placeholder)
+        from audio.music_bed import get_music_beds
+        from render.bake import get_bake
+        from templates.animated_background import warm_up as warm_up_backgrounds
+        
+        print("Warming up shared assets...")
+        # Validate and map the build-time bake, if any, before building
+        get_bake()
+        get_asset_registry().warm_up()
+        warm_up_backgrounds()
+        
+        background_music_path = os.path.join(self.assets_dir, 'background_music.mp3')
+        if os.path.exists(background_music_path):
+            get_music_beds().loop(background_music_path)
+        
+        for language in languages or ScriptGenerator.TEMPLATES:
+            scripts = ScriptGenerator.generate_all_scripts('', '', language)
+            for scene_name in ScriptGenerator.STATIC_SCENES:
+                try:
+                    path, duration = self.voice_generator.static_voiceover(
+                        scripts[scene_name], language, self.static_voice_dir
+                    )
+                    print(f"  {language} {scene_name}: {duration:.2f}s")
+                    if scene_name == ScriptGenerator.CLOSING_SCENE:
+                        for output_format in FORMATS.values():
+                            self.prepare_closing(language, path, duration, output_format)
+                except Exception as e:
+                    # TTS may be unreachable at boot; jobs generate it later
+                    print(f"  Skipping {language} {scene_name}: {e}")
     
-    def _create_phone_mockup(self, output_path: str):
+    @staticmethod
+    def _create_phone_mockup():
         """Create a simple phone mockup frame."""
         from PIL import Image, ImageDraw
         
@@ -214,20 +467,44 @@ class VideoTemplate:
             fill=(0, 0, 0, 0)
         )
         
-        # Save
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        img.save(output_path)
+        return img
 
 
-def generate_video(params: Dict) -> str:
+def generate_video(params: Dict, abort: threading.Event = None) -> str:
     """
     Convenience function to generate video.
     
     Args:
         params: Video parameters
+        abort: Event that stops the render (see VideoTemplate.generate_video)
         
     Returns:
         Path to generated video
     """
     template = VideoTemplate()
-    return template.generate_video(params)
+    return template.generate_video(params, abort)
+
+
+def generate_videos(params: Dict, abort: threading.Event = None) -> Dict[str, str]:
+    """
+    Convenience function to generate the video in several formats.
+    
+    Args:
+        params: Video parameters (see VideoTemplate.generate_videos)
+        abort: Event that stops the render
+        
+    Returns:
+        Dict of format name to video path
+    """
+    template = VideoTemplate()
+    return template.generate_videos(params, abort)
+
+
+def warm_up(languages=None):
+    """
+    Prepare shared assets before workers fork (see VideoTemplate.warm_up).
+    
+    Args:
+        languages: Language codes to prepare (defaults to all scripts)
+    """
+    VideoTemplate().warm_up(languages)
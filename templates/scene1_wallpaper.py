@@ -9,12 +9,11 @@ Scene 1: Live Wallpaper Preview
 Displays a phone mockup with the wallpaper inserted inside the screen.
 """
 
-from moviepy.editor import (
-    VideoFileClip, ImageClip, CompositeVideoClip,
-    AudioFileClip, concatenate_videoclips
-)
-from PIL import Image
+from moviepy.editor import VideoFileClip, ImageClip
 import os
+from render.assets import load_image
+from render.media_readers import get_reader_manager
+from render.compositor import FlattenedCompositeClip
 
 
 class Scene1WallpaperPreview:
@@ -46,15 +45,16 @@ class Scene1WallpaperPreview:
         Returns:
             VideoFileClip for Scene 1
         """
-        # Load voiceover to get duration
-        voiceover = AudioFileClip(voiceover_path)
+        # Load voiceover to get duration (closed when the job ends)
+        readers = get_reader_manager()
+        voiceover = readers.open_audio(voiceover_path)
         scene_duration = duration or voiceover.duration
         
         # Determine if wallpaper is image or video
         is_video = wallpaper_path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv'))
         
         if is_video:
-            wallpaper_clip = VideoFileClip(wallpaper_path)
+            wallpaper_clip = readers.open_video(wallpaper_path, audio=False)
             # Loop if needed
             if wallpaper_clip.duration < scene_duration:
                 wallpaper_clip = wallpaper_clip.loop(duration=scene_duration)
@@ -73,7 +73,7 @@ class Scene1WallpaperPreview:
         wallpaper_clip = wallpaper_clip.resize((screen_width, screen_height))
         
         # Load phone mockup
-        phone_mockup = ImageClip(self.phone_mockup_path, duration=scene_duration)
+        phone_mockup = ImageClip(load_image(self.phone_mockup_path), duration=scene_duration)
         
         # Position wallpaper in center (behind phone frame)
         video_width = 1080
@@ -83,7 +83,7 @@ class Scene1WallpaperPreview:
         phone_mockup = phone_mockup.set_position(('center', 'center'))
         
         # Composite: wallpaper behind phone frame
-        composite = CompositeVideoClip(
+        composite = FlattenedCompositeClip(
             [wallpaper_clip, phone_mockup],
             size=(video_width, video_height)
         ).set_duration(scene_duration)
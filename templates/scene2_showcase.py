@@ -9,12 +9,17 @@ Scene 2: App Showcase
 Displays the app interface with multiple wallpaper options.
 """
 
-from moviepy.editor import (
-    ImageClip, CompositeVideoClip, AudioFileClip,
-    VideoFileClip
-)
+from typing import TYPE_CHECKING
 from PIL import Image, ImageDraw, ImageFont
 import os
+from render.assets import asset_source, get_asset_registry, source_fingerprint
+from render.media_readers import get_reader_manager
+from render.timeline import (
+    AudioTrack, Layer, Segment, TimelinePlan, TimelineRenderer, Transition, file_fingerprint
+)
+
+if TYPE_CHECKING:
+    from moviepy.video.VideoClip import VideoClip
 
 
 class Scene2AppShowcase:
@@ -29,11 +34,49 @@ class Scene2AppShowcase:
         """
         self.app_showcase_path = app_showcase_path
     
+    def plan(self, voiceover_path: str, duration: float) -> Segment:
+        """
+        Plan the app showcase scene.
+        
+        Args:
+            voiceover_path: Path to voiceover audio file
+            duration: Scene duration
+            
+        Returns:
+            Timeline Segment for Scene 2
+        """
+        # If no showcase image provided, use the shared placeholder
+        showcase_source = self.app_showcase_path
+        if not showcase_source or not os.path.exists(showcase_source):
+            showcase_source = asset_source('showcase_placeholder')
+        
+        # Full-screen showcase, faded in and out
+        layers = [
+            Layer(
+                name='showcase',
+                kind='image',
+                start=0,
+                end=duration,
+                source=showcase_source,
+                fingerprint=source_fingerprint(showcase_source),
+                size=(1080, 1920),
+                transitions=[Transition('fade', 'in', 0.5), Transition('fade', 'out', 0.5)]
+            )
+        ]
+        voiceover = AudioTrack(
+            name='voiceover',
+            source=voiceover_path,
+            start=0,
+            duration=duration,
+            fingerprint=file_fingerprint(voiceover_path)
+        )
+        return Segment('showcase', duration, layers, [voiceover])
+    
     def create(
         self,
         voiceover_path: str,
         duration: float = None
-    ) -> VideoFileClip:
+    ) -> 'VideoClip':
         """
         Create Scene 2 video clip.
         
@@ -42,43 +85,18 @@ class Scene2AppShowcase:
             duration: Scene duration (if None, uses voiceover duration)
             
         Returns:
-            VideoFileClip for Scene 2
+            VideoClip for Scene 2; closing it closes its readers
         """
-        # Load voiceover to get duration
-        voiceover = AudioFileClip(voiceover_path)
-        scene_duration = duration or voiceover.duration
-        
-        # If no showcase image provided, create a simple placeholder
-        if not self.app_showcase_path or not os.path.exists(self.app_showcase_path):
-            showcase_image = self._create_placeholder_showcase()
-            self.app_showcase_path = 'assets/generated_showcase.png'
-            showcase_image.save(self.app_showcase_path)
-        
-        # Load showcase image
-        showcase_clip = ImageClip(self.app_showcase_path, duration=scene_duration)
-        
-        # Apply fade in/out transitions
-        showcase_clip = showcase_clip.fadein(0.5).fadeout(0.5)
-        
-        # Create composite
-        video_width = 1080
-        video_height = 1920
-        
-        # Resize to fit using tuple parameter (MoviePy 1.0.3 + Pillow 11+ compatible)
-        showcase_clip = showcase_clip.resize((video_width, video_height))
-        showcase_clip = showcase_clip.set_position('center')
+        if duration is None:
+            # Probe voiceover to get duration
+            duration = get_reader_manager().duration(voiceover_path)
         
-        composite = CompositeVideoClip(
-            [showcase_clip],
-            size=(video_width, video_height)
-        ).set_duration(scene_duration)
-        
-        # Add voiceover
-        composite = composite.set_audio(voiceover)
-        
-        return composite
+        segment = self.plan(voiceover_path, duration)
+        plan = TimelinePlan(size=(1080, 1920), fps=30, segments=[segment])
+        return TimelineRenderer(plan).standalone_clip(segment)
     
-    def _create_placeholder_showcase(self) -> Image.Image:
+    @staticmethod
+    def _create_placeholder_showcase() -> Image.Image:
         """Create a placeholder app showcase image."""
         width, height = 1080, 1920
         img = Image.new('RGB', (width, height), color='#1a1a2e')
@@ -135,3 +153,9 @@ class Scene2AppShowcase:
                 draw.rectangle([x, y, x + cell_width, y + cell_height], fill=color)
         
         return img
+
+
+# Drawn once per process, shared by every video
+get_asset_registry().register(
+    'showcase_placeholder', Scene2AppShowcase._create_placeholder_showcase
+)
@@ -9,12 +9,18 @@ Scene 3: Play Store Install
 Shows Play Store listing with install animation.
 """
 
-from moviepy.editor import (
-    ImageClip, CompositeVideoClip, AudioFileClip,
-    VideoFileClip
-)
+from typing import TYPE_CHECKING
 from PIL import Image, ImageDraw, ImageFont
 import os
+from render.assets import asset_source, get_asset_registry, source_fingerprint, source_size
+from render.formats import DEFAULT_FORMAT, FORMATS, OutputFormat
+from render.media_readers import get_reader_manager
+from render.timeline import (
+    AudioTrack, Layer, Segment, TimelinePlan, TimelineRenderer, file_fingerprint
+)
+
+if TYPE_CHECKING:
+    from moviepy.video.io.VideoFileClip import VideoFileClip
 
 
 class Scene3PlayStoreInstall:
@@ -31,11 +37,61 @@ class Scene3PlayStoreInstall:
         self.phone_mockup_path = phone_mockup_path
         self.playstore_mockup_path = playstore_mockup_path
     
+    def plan(self, voiceover_path: str, duration: float,
+             output_format: OutputFormat = None) -> Segment:
+        """
+        Plan the Play Store scene.
+        
+        Args:
+            voiceover_path: Path to voiceover audio file
+            duration: Scene duration (the voiceover duration)
+            output_format: Format whose layout to use (9:16 by default)
+            
+        Returns:
+            Timeline Segment for Scene 3
+        """
+        # If no Play Store mockup provided, use the shared placeholder
+        playstore_source = self.playstore_mockup_path
+        if not playstore_source or not os.path.exists(playstore_source):
+            playstore_source = asset_source('playstore_placeholder')
+        
+        # Play Store screen resized to the phone screen, behind the phone
+        # frame (scaled with the screen in other formats)
+        output_format = output_format or FORMATS[DEFAULT_FORMAT]
+        layers = [
+            Layer(
+                name='playstore',
+                kind='image',
+                start=0,
+                end=duration,
+                source=playstore_source,
+                fingerprint=source_fingerprint(playstore_source),
+                size=output_format.screen_size
+            ),
+            Layer(
+                name='phone_mockup',
+                kind='image',
+                start=0,
+                end=duration,
+                source=self.phone_mockup_path,
+                fingerprint=source_fingerprint(self.phone_mockup_path),
+                size=output_format.scaled(source_size(self.phone_mockup_path))
+            )
+        ]
+        voiceover = AudioTrack(
+            name='voiceover',
+            source=voiceover_path,
+            start=0,
+            duration=duration,
+            fingerprint=file_fingerprint(voiceover_path)
+        )
+        return Segment('playstore', duration, layers, [voiceover])
+    
     def create(
         self,
         voiceover_path: str,
         duration: float = None
-    ) -> VideoFileClip:
+    ) -> 'VideoFileClip':
         """
         Create Scene 3 video clip.
         
@@ -44,50 +100,18 @@ class Scene3PlayStoreInstall:
             duration: Scene duration (if None, uses voiceover duration)
             
         Returns:
-            VideoFileClip for Scene 3
+            VideoFileClip for Scene 3; closing it closes its readers
         """
-        # Load voiceover to get duration
-        voiceover = AudioFileClip(voiceover_path)
-        scene_duration = duration or voiceover.duration
+        if duration is None:
+            # Probe voiceover to get duration
+            duration = get_reader_manager().duration(voiceover_path)
         
-        # If no Play Store mockup provided, create placeholder
-        if not self.playstore_mockup_path or not os.path.exists(self.playstore_mockup_path):
-            playstore_image = self._create_placeholder_playstore()
-            self.playstore_mockup_path = 'assets/generated_playstore.png'
-            playstore_image.save(self.playstore_mockup_path)
-        
-        # Load Play Store screenshot
-        playstore_clip = ImageClip(self.playstore_mockup_path, duration=scene_duration)
-        
-        # Phone screen dimensions
-        screen_width = 720
-        screen_height = 1280
-        
-        # Resize to fit phone screen using tuple parameter (MoviePy 1.0.3 + Pillow 11+ compatible)
-        playstore_clip = playstore_clip.resize((screen_width, screen_height))
-        
-        # Load phone mockup
-        phone_mockup = ImageClip(self.phone_mockup_path, duration=scene_duration)
-        
-        # Position elements
-        video_width = 1080
-        video_height = 1920
-        
-        playstore_clip = playstore_clip.set_position(('center', 'center'))
-        phone_mockup = phone_mockup.set_position(('center', 'center'))
-        
-        # Composite: Play Store screen behind phone frame
-        composite = CompositeVideoClip(
-            [playstore_clip, phone_mockup],
-            size=(video_width, video_height)
-        ).set_duration(scene_duration)
-        
-        # Add voiceover
-        composite = composite.set_audio(voiceover)
-        
-        return composite
+        segment = self.plan(voiceover_path, duration)
+        plan = TimelinePlan(size=FORMATS[DEFAULT_FORMAT].size, fps=30, segments=[segment])
+        return TimelineRenderer(plan).standalone_clip(segment)
     
-    def _create_placeholder_playstore(self) -> Image.Image:
+    @staticmethod
+    def _create_placeholder_playstore() -> Image.Image:
         """Create a placeholder Play Store listing image."""
         width, height = 720, 1280
         img = Image.new('RGB', (width, height), color='#ffffff')
@@ -166,3 +190,9 @@ class Scene3PlayStoreInstall:
             )
         
         return img
+
+
+# Drawn once per process, shared by every video
+get_asset_registry().register(
+    'playstore_placeholder', Scene3PlayStoreInstall._create_placeholder_playstore
+)
@@ -10,11 +10,17 @@ Displays multiple wallpapers in sequence with smooth transitions.
 Similar to reference video style.
 """
 
-from moviepy.editor import (VideoFileClip, ImageClip, CompositeVideoClip, 
-                            concatenate_videoclips, AudioFileClip, ColorClip)
 from PIL import Image, ImageDraw
 import os
-from templates.animated_background import create_animated_background
+from render.assets import asset_source, get_asset_registry, source_fingerprint
+from render.formats import DEFAULT_FORMAT, FORMATS, OutputFormat
+from render.ken_burns import MOTIONS
+from render.media_readers import get_reader_manager
+from render.text_overlay import fonts_fingerprint
+from render.timeline import (
+    AudioTrack, Layer, Segment, TimelinePlan, TimelineRenderer, Transition,
+    file_fingerprint, is_video_file
+)
 
 
 class MultiWallpaperScene:
@@ -27,9 +33,10 @@ class MultiWallpaperScene:
         Args:
             phone_mockup_path: Path to phone mockup PNG (optional)
         """
-        self.phone_mockup_path = phone_mockup_path or self._generate_phone_mockup()
+        self.phone_mockup_path = phone_mockup_path or asset_source('phone_mockup_multi')
     
-    def _generate_phone_mockup(self):
+    @staticmethod
+    def _generate_phone_mockup() -> Image.Image:
         """Generate a simple phone mockup if none provided."""
         width, height = 800, 1600
         img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
@@ -57,127 +64,163 @@ class MultiWallpaperScene:
             fill=(0, 0, 0, 0)
         )
         
-        # Save mockup
-        mockup_path = 'assets/phone_mockup_multi.png'
-        os.makedirs('assets', exist_ok=True)
-        img.save(mockup_path)
-        
-        return mockup_path
+        return img
     
-    def create(self, wallpapers, voiceover_path, duration_per_wallpaper=4):
+    def plan(self, wallpapers, voiceover_path, voiceover_duration,
+             duration_per_wallpaper=4, transition_duration=0.5,
+             transition='crossfade', output_format: OutputFormat = None,
+             title=None, caption=None, ken_burns=True):
         """
-        Create the multi-wallpaper showcase scene.
+        Plan the multi-wallpaper showcase scene.
         
         Args:
             wallpapers: List of wallpaper file paths (images or videos)
             voiceover_path: Path to voiceover audio file
+            voiceover_duration: Length of the voiceover in seconds
             duration_per_wallpaper: Seconds to show each wallpaper
+            transition_duration: Duration of each transition
+            transition: Transition between wallpapers ('crossfade',
+                'slide', 'wipe' or 'zoom')
+            output_format: Format whose layout to use (9:16 by default)
+            title: Text shown above the phone (e.g. the deity name)
+            caption: Text typed out below the phone (e.g. the custom text)
+            ken_burns: Slowly pan and zoom image wallpapers
         
         Returns:
-            VideoClip of the complete scene
+            Timeline Segment for the scene
         """
         if not wallpapers or len(wallpapers) == 0:
             raise ValueError("At least one wallpaper is required")
         
-        # Get voiceover duration
-        voiceover = AudioFileClip(voiceover_path)
-        voiceover_duration = voiceover.duration
-        
         # Calculate scene duration
-        total_wallpaper_time = len(wallpapers) * duration_per_wallpaper
+        count = len(wallpapers)
+        total_wallpaper_time = count * duration_per_wallpaper
         scene_duration = max(voiceover_duration, total_wallpaper_time)
         
-        # Adjust duration per wallpaper if needed
-        if total_wallpaper_time < voiceover_duration:
-            duration_per_wallpaper = voiceover_duration / len(wallpapers)
+        # Stretch wallpaper slots so the overlapping sequence fills the scene
+        if count == 1:
+            transition_duration = min(transition_duration, scene_duration / 2)
+            slot_duration = scene_duration
+        else:
+            slot_duration = (scene_duration + (count - 1) * transition_duration) / count
         
         print(f"  Creating Multi-Wallpaper Scene...")
-        print(f"  - {len(wallpapers)} wallpapers")
-        print(f"  - {duration_per_wallpaper:.1f}s per wallpaper")
+        print(f"  - {count} wallpapers")
+        print(f"  - {slot_duration:.1f}s per wallpaper")
         print(f"  - Total duration: {scene_duration:.1f}s")
         
-        # Video dimensions
-        video_width = 1080
-        video_height = 1920
-        
-        # Phone screen dimensions (inside mockup)
-        screen_width = 720
-        screen_height = 1280
-        
-        # Create animated background
-        background = create_animated_background(
-            duration=scene_duration,
-            size=(video_width, video_height),
-            style='mandala'
-        )
+        # Phone screen dimensions (inside mockup), from the format's layout
+        output_format = output_format or FORMATS[DEFAULT_FORMAT]
+        screen_size = output_format.screen_size
         
-        # Load phone mockup
-        phone_mockup = ImageClip(self.phone_mockup_path, duration=scene_duration)
-        phone_mockup = phone_mockup.resize((screen_width, screen_height))
-        phone_mockup = phone_mockup.set_position('center')
-        
-        # Create wallpaper clips with transitions
-        wallpaper_clips = []
-        transition_duration = 0.5  # Crossfade duration
+        # Animated background
+        layers = [Layer('background', 'background', 0, scene_duration,
+                        params={'style': 'mandala'})]
         
+        # Wallpapers with transitions, overlapping for the transition
         for i, wallpaper_path in enumerate(wallpapers):
-            # Load wallpaper (image or video)
-            if wallpaper_path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
-                wallpaper_clip = VideoFileClip(wallpaper_path)
-                # Loop if too short
-                if wallpaper_clip.duration < duration_per_wallpaper:
-                    wallpaper_clip = wallpaper_clip.loop(duration=duration_per_wallpaper)
-                else:
-                    wallpaper_clip = wallpaper_clip.subclip(0, duration_per_wallpaper)
-            else:
-                wallpaper_clip = ImageClip(wallpaper_path, duration=duration_per_wallpaper)
-            
-            # Resize wallpaper to fit phone screen using tuple parameter
-            # This works with MoviePy 1.0.3 and Pillow 10+
-            wallpaper_clip = wallpaper_clip.resize((screen_width, screen_height))
-            
-            # Add fade in/out for smooth transitions
+            start = i * (slot_duration - transition_duration)
             if i == 0:
-                # First wallpaper: fade in only
-                wallpaper_clip = wallpaper_clip.fadein(transition_duration)
-            elif i == len(wallpapers) - 1:
-                # Last wallpaper: fade out only
-                wallpaper_clip = wallpaper_clip.fadeout(transition_duration)
+                # First wallpaper fades in from black
+                transitions = [Transition('fade', 'in', transition_duration)]
             else:
-                # Middle wallpapers: fade in and out
-                wallpaper_clip = wallpaper_clip.fadein(transition_duration)
-                wallpaper_clip = wallpaper_clip.fadeout(transition_duration)
+                # Later wallpapers transition in over the previous one
+                transitions = [Transition(transition, 'in', transition_duration)]
+            if i == count - 1 and count > 1:
+                # Last wallpaper fades out
+                transitions.append(Transition('fade', 'out', transition_duration))
             
-            wallpaper_clips.append(wallpaper_clip)
-        
-        # Concatenate wallpapers with crossfade
-        if len(wallpaper_clips) == 1:
-            wallpapers_sequence = wallpaper_clips[0]
-        else:
-            # Use crossfadein for smooth transitions
-            for i in range(1, len(wallpaper_clips)):
-                wallpaper_clips[i] = wallpaper_clips[i].crossfadein(transition_duration)
-            
-            wallpapers_sequence = concatenate_videoclips(
-                wallpaper_clips,
-                method="compose",
-                padding=-transition_duration  # Overlap for crossfade
-            )
-        
-        # Position wallpapers in center
-        wallpapers_sequence = wallpapers_sequence.set_position('center')
-        
-        # Composite: background + wallpapers + phone mockup
-        composite = CompositeVideoClip(
-            [background, wallpapers_sequence, phone_mockup],
-            size=(video_width, video_height)
+            kind = 'video' if is_video_file(wallpaper_path) else 'image'
+            params = {'sequence': 'wallpapers'}
+            if kind == 'image' and ken_burns:
+                # Alternate the motion from one wallpaper to the next
+                params['ken_burns'] = MOTIONS[i % len(MOTIONS)]
+            layers.append(Layer(
+                name=f'wallpaper_{i}',
+                kind=kind,
+                start=start,
+                end=min(start + slot_duration, scene_duration),
+                source=wallpaper_path,
+                fingerprint=file_fingerprint(wallpaper_path),
+                size=screen_size,
+                transitions=transitions,
+                params=params
+            ))
+        
+        # Phone mockup on top
+        layers.append(Layer(
+            name='phone_mockup',
+            kind='image',
+            start=0,
+            end=scene_duration,
+            source=self.phone_mockup_path,
+            fingerprint=source_fingerprint(self.phone_mockup_path),
+            size=screen_size
+        ))
+        
+        # Captions in the bands above and below the phone
+        width, height = output_format.size
+        band = (height - screen_size[1]) / 2
+        captions = [
+            # Title fades in with the first wallpaper
+            ('title', title, band / 2, 0.3, 1, 0, {'effect': 'fade', 'effect_duration': 0.5}),
+            # Caption is typed out once the title is up
+            ('caption', caption, height - band / 2, 0.19, 3, 0.5,
+             {'effect': 'typewriter', 'effect_duration': min(2.0, scene_duration / 3)}),
+        ]
+        for name, text, center_y, font_scale, max_lines, start, effect in captions:
+            if not text or not text.strip():
+                continue
+            layers.append(Layer(
+                name=name,
+                kind='text',
+                start=start,
+                end=scene_duration,
+                fingerprint=fonts_fingerprint(),
+                params=dict(
+                    text=text.strip(),
+                    font_size=int(round(band * font_scale)),
+                    max_width=int(width * 0.9),
+                    max_lines=max_lines,
+                    center_y=int(round(center_y)),
+                    fade_out=transition_duration,
+                    **effect
+                )
+            ))
+        
+        voiceover = AudioTrack(
+            name='voiceover',
+            source=voiceover_path,
+            start=0,
+            duration=voiceover_duration,
+            fingerprint=file_fingerprint(voiceover_path)
         )
+        return Segment('multi_wallpaper', scene_duration, layers, [voiceover])
+    
+    def create(self, wallpapers, voiceover_path, duration_per_wallpaper=4,
+               voiceover_duration=None):
+        """
+        Create the multi-wallpaper showcase scene.
+        
+        Args:
+            wallpapers: List of wallpaper file paths (images or videos)
+            voiceover_path: Path to voiceover audio file
+            duration_per_wallpaper: Seconds to show each wallpaper
+            voiceover_duration: Known voiceover length (measured if None)
         
-        # Set duration and add voiceover
-        composite = composite.set_duration(scene_duration)
-        composite = composite.set_audio(voiceover)
+        Returns:
+            VideoClip of the complete scene; closing it closes its readers
+        """
+        if voiceover_duration is None:
+            voiceover_duration = get_reader_manager().duration(voiceover_path)
         
-        return composite
+        segment = self.plan(wallpapers, voiceover_path, voiceover_duration,
+                            duration_per_wallpaper)
+        plan = TimelinePlan(size=FORMATS[DEFAULT_FORMAT].size, fps=30, segments=[segment])
+        return TimelineRenderer(plan).standalone_clip(segment)
+
+# Drawn once per process, shared by every video
+get_asset_registry().register('phone_mockup_multi', MultiWallpaperScene._generate_phone_mockup)
 
 
 if __name__ == '__main__':
@@ -5,6 +5,8 @@ Provides a simple UI for uploading wallpapers and generating videos.
 
 import os
 import sys
+import time
+import uuid
 
 # Add parent directory to path FIRST
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -15,10 +17,20 @@ try:
 except ImportError:
     pass  # Compatibility patch not found, continue anyway
 
-from flask import Flask, render_template, request, send_file, jsonify, url_for
+from flask import (Flask, g, render_template, request, send_file, send_from_directory, jsonify,
+                   url_for)
 from werkzeug.utils import secure_filename
 
-from templates.base_template import generate_video
+from jobs import tracing
+from jobs.cost_model import get_admission_controller, video_features
+from jobs.job_queue import DONE, FAILED, get_job_queue
+from jobs.storage import touch
+from render.formats import DEFAULT_FORMAT, get_formats
+from render.streaming import PLAYLIST_NAME, stream_dir
+
+# The video pipeline (moviepy, scenes, gTTS) runs in render workers that
+# pull jobs from the shared queue (jobs/worker.py); it is imported on
+# first use, or ahead of the fork by the gunicorn warm-up hook
 
 # Get base directory (parent of web/)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -41,6 +53,33 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@app.before_request
+def start_trace():
+    """Trace requests that queue a job (the first part of its trace)."""
+    if tracing.ENABLED and request.endpoint == 'generate':
+        g.trace = tracing.Trace('http', process_name=f'web (pid {os.getpid()})')
+        g.trace_start = time.time()
+        tracing.set_current(g.trace)
+
+
+@app.after_request
+def save_trace(response):
+    """Save the trace of a request that queued a job."""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracing.set_current(None)
+        job_id = g.get('queued_job_id')
+        if job_id is not None:
+            trace.add_span(f'{request.method} {request.path}', g.trace_start * 1e6,
+                           time.time() * 1e6, cat='http',
+                           args={'status': response.status_code})
+            try:
+                trace.save(job_id)
+            except OSError as e:
+                print(f"Could not save the trace of job {job_id}: {e}")
+    return response
+
+
 @app.route('/')
 def index():
     """Render the main upload form."""
@@ -53,9 +92,27 @@ def health():
     return jsonify({'status': 'healthy', 'message': 'App is running!'})
 
 
+def save_upload(file):
+    """Save an uploaded file under a unique name and return its path."""
+    filename = f"{uuid.uuid4().hex[:12]}_{secure_filename(file.filename)}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    with tracing.span('save upload', cat='http', filename=filename):
+        file.save(filepath)
+    return filepath
+
+
+def remove_uploads(paths):
+    """Delete uploads of a request that was not queued."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 @app.route('/generate', methods=['POST'])
 def generate():
-    """Handle video generation request."""
+    """Queue a video generation request."""
     try:
         # Support both single and multiple file uploads
         wallpaper_paths = []
@@ -71,10 +128,7 @@ def generate():
                     if not allowed_file(file.filename):
                         return jsonify({'error': f'Invalid file type: {file.filename}'}), 400
                     
-                    filename = secure_filename(file.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    wallpaper_paths.append(filepath)
+                    wallpaper_paths.append(save_upload(file))
         
         # Fallback to single file upload (backward compatibility)
         elif 'wallpaper' in request.files:
@@ -85,10 +139,7 @@ def generate():
             if not allowed_file(file.filename):
                 return jsonify({'error': 'Invalid file type'}), 400
             
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            wallpaper_paths.append(filepath)
+            wallpaper_paths.append(save_upload(file))
         else:
             return jsonify({'error': 'No wallpaper file(s) uploaded'}), 400
         
@@ -103,34 +154,169 @@ def generate():
         if not god_name:
             return jsonify({'error': 'God name is required'}), 400
         
+        # Output formats, the primary one first (9:16 unless chosen)
+        try:
+            formats = [output_format.name for output_format
+                       in get_formats(request.form.getlist('formats'))]
+        except ValueError as e:
+            remove_uploads(wallpaper_paths)
+            return jsonify({'error': str(e)}), 400
+        
         # Prepare parameters
+        job_id = uuid.uuid4().hex
         params = {
             'wallpapers': wallpaper_paths,  # Use list for multi-wallpaper support
             'god_name': god_name,
             'custom_text': custom_text or '',
-            'language_code': language_code
+            'language_code': language_code,
+            'job_id': job_id,
+            'formats': formats,
+            # Watch the first chunks while the rest renders
+            'stream': request.form.get('stream') == 'on'
         }
         
-        # Generate video
-        print(f"\nGenerating video with {len(wallpaper_paths)} wallpaper(s)...")
-        output_path = generate_video(params)
+        # Refuse work the render workers could not start in time
+        with tracing.span('admission', cat='http'):
+            features = video_features(params)
+            admission = get_admission_controller().check(features)
+        if not admission.admitted:
+            remove_uploads(wallpaper_paths)
+            print(f"\nRejected job {job_id}: {admission.reason} "
+                  f"(estimated {admission.cost:.0f}s)")
+            if admission.retry_after:
+                response = jsonify({
+                    'error': admission.reason,
+                    'retry_after': admission.retry_after
+                })
+                response.headers['Retry-After'] = str(admission.retry_after)
+                return response, 429
+            return jsonify({'error': admission.reason}), 413
         
-        # Get filename for download
-        filename = os.path.basename(output_path)
-        download_url = url_for('download', filename=filename)
+        # Queue the video; any render worker sharing the queue picks it up.
+        # Public requests share the default priority (clients cannot jump
+        # the queue); higher priorities are for internal callers
+        queue = get_job_queue()
+        with tracing.span('enqueue', cat='http'):
+            queue.enqueue('generate_video', params, job_id=job_id,
+                          cost=admission.cost, features=features)
+        g.queued_job_id = job_id
+        print(f"\nQueued job {job_id} with {len(wallpaper_paths)} wallpaper(s) "
+              f"(estimated {admission.cost:.0f}s, ETA {admission.eta:.0f}s)")
         
         return jsonify({
             'success': True,
-            'message': f'Video generated successfully with {len(wallpaper_paths)} wallpaper(s)!',
-            'download_url': download_url,
-            'filename': filename
-        })
+            'message': f'Video queued with {len(wallpaper_paths)} wallpaper(s)',
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'eta_seconds': round(admission.eta)
+        }), 202
     
     except Exception as e:
-        print(f"Error generating video: {str(e)}")
+        print(f"Error queueing video: {str(e)}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': f'Failed to generate video: {str(e)}'}), 500
+        return jsonify({'error': f'Failed to queue video: {str(e)}'}), 500
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the state of a queued video."""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    response = {
+        'job_id': job.id,
+        'status': job.status,
+        'attempts': job.attempts
+    }
+    # Published once the first chunk is encoded
+    if os.path.exists(os.path.join(stream_dir(app.config['OUTPUT_FOLDER'], job.id), PLAYLIST_NAME)):
+        response['stream_url'] = url_for('stream', job_id=job.id, filename=PLAYLIST_NAME)
+    # Updated after the request and after every render attempt
+    if os.path.isdir(tracing.trace_dir(job.id)):
+        response['trace_url'] = url_for('job_trace', job_id=job.id)
+    if job.status == DONE:
+        filename = job.result['filename']
+        if os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], filename)):
+            response['message'] = 'Video generated successfully!'
+            response['download_url'] = url_for('download', filename=filename)
+            response['filename'] = filename
+            previews = job.result.get('previews')
+            if previews:
+                response['previews'] = preview_urls(filename, previews)
+            # Jobs from before multi-format rendering only have the primary
+            outputs = job.result.get('outputs') or {
+                DEFAULT_FORMAT: {'filename': filename, 'previews': previews}
+            }
+            response['outputs'] = {
+                name: {'filename': output['filename'],
+                       'download_url': url_for('download', filename=output['filename'])}
+                for name, output in outputs.items()
+                if os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], output['filename']))
+            }
+            if job.result.get('memory'):
+                response['memory'] = job.result['memory']
+        else:
+            # Evicted to stay within the storage quota
+            response['error'] = 'This video has expired. Please generate it again.'
+            response['expired'] = True
+    elif job.status == FAILED:
+        response['error'] = f'Failed to generate video: {job.error}'
+    else:
+        response['position'] = queue.position(job)
+        if job.cost is not None:
+            response['eta_seconds'] = round(get_admission_controller().eta(job))
+    return jsonify(response)
+
+
+@app.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    """Chrome trace of a job, for chrome://tracing or ui.perfetto.dev."""
+    # Only ids of known jobs reach the filesystem
+    if get_job_queue().get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    trace = tracing.load_trace(job_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = f'attachment; filename=trace_{job_id}.json'
+    return response
+
+
+def preview_urls(filename, manifest):
+    """URLs of the preview images listed in a video's preview manifest."""
+    name = os.path.splitext(filename)[0]
+    
+    def url(file):
+        return url_for('preview', name=name, filename=file)
+    
+    urls = {'thumbnails': [url(thumb['file']) for thumb in manifest.get('thumbnails', [])]}
+    for key in ('poster', 'sprite', 'vtt'):
+        if key in manifest:
+            urls[key] = url(manifest[key])
+    return urls
+
+
+@app.route('/previews/<name>/<filename>')
+def preview(name, filename):
+    """Serve a poster, thumbnail or sprite sheet of a generated video."""
+    # send_from_directory refuses paths escaping the previews folder
+    directory = os.path.join(app.config['OUTPUT_FOLDER'], 'previews')
+    return send_from_directory(directory, f'{name}/{filename}', max_age=86400)
+
+
+@app.route('/streams/<job_id>/<filename>')
+def stream(job_id, filename):
+    """Serve the HLS playlist or a segment of a video being rendered."""
+    directory = os.path.join(app.config['OUTPUT_FOLDER'], 'streams')
+    if filename == PLAYLIST_NAME:
+        # Rewritten after every segment until the render ends
+        return send_from_directory(directory, f'{job_id}/{filename}', max_age=0,
+                                   mimetype='application/vnd.apple.mpegurl')
+    return send_from_directory(directory, f'{job_id}/{filename}', max_age=86400,
+                               mimetype='video/mp2t')
 
 
 @app.route('/download/<filename>')
@@ -139,6 +325,7 @@ def download(filename):
     try:
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
         if os.path.exists(output_path):
+            touch(output_path)
             return send_file(output_path, as_attachment=True)
         else:
             return jsonify({'error': 'File not found'}), 404
@@ -160,6 +347,14 @@ if __name__ == '__main__':
     print(f"Open your browser and navigate to: http://localhost:{port}")
     print("="*60 + "\n")
     
+    # Render in this process too; with the debug reloader, only in the
+    # child that serves requests (the watcher parent runs this block as well)
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from jobs.storage import get_storage_manager
+        from jobs.worker import start_worker_threads
+        start_worker_threads()
+        get_storage_manager().start()
+    
     # Run Flask app
     app.run(
         host='0.0.0.0',  # Allow external connections (required for cloud hosting)